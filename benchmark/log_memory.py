@@ -0,0 +1,81 @@
+import argparse
+import json
+import tracemalloc
+import uuid
+from array import array
+
+from src.log import Command, LogEntry, MemoryLog, Operation
+
+
+class BaselineCommand:
+    """
+    Command as the in-memory log used to hold it, with a __dict__ instead of __slots__.
+    """
+
+    def __init__(self, id, operation, message=None):
+        self.id = id
+        self.operation = operation
+        self.message = message
+
+
+class BaselineLogEntry:
+    """
+    Log entry as the in-memory log used to hold it, with a __dict__ instead of __slots__.
+    """
+
+    def __init__(self, term, command):
+        self.term = term
+        self.command = command
+
+
+class BaselineLog:
+    """
+    In-memory log as it used to be: the entry objects in a list and the size of every encoded entry in an array.
+    """
+
+    def __init__(self):
+        self.entries = []
+        self.sizes = array('q')
+
+    def extend(self, entries):
+        self.entries.extend(entries)
+        self.sizes.extend(len(json.dumps({'term': entry.term, 'command': {
+            'id': entry.command.id, 'operation': entry.command.operation.value, 'message': entry.command.message}}))
+                          for entry in entries)
+
+
+def make_entries(count, message_size, entry_class=LogEntry, command_class=Command):
+    # every entry holds its own message, as the entries received from clients do
+    return [entry_class(7, command_class(str(uuid.uuid4()), Operation.PUT_MESSAGE,
+                                         json.dumps({'topic': 'benchmark', 'message': 'x' * message_size})))
+            for _ in range(count)]
+
+
+def measure(build, entries, message_size, batch=1000, **classes):
+    """
+    :param classes: entry_class and command_class of the entries, the current ones if not given
+    :return: bytes allocated per entry by the structure built from the entries
+    """
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    structure = build()
+    for start in range(0, entries, batch):
+        structure.extend(make_entries(min(batch, entries - start), message_size, **classes))
+    allocated = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return allocated / entries
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Memory held per log entry by the in-memory log.')
+    parser.add_argument('--entries', type=int, default=200000, help='number of log entries')
+    parser.add_argument('--message-size', type=int, default=32, help='size of the message of every entry')
+    args = parser.parse_args()
+    baseline = measure(BaselineLog, args.entries, args.message_size, entry_class=BaselineLogEntry,
+                       command_class=BaselineCommand)
+    # slotted entry objects kept in a list, without the sizes
+    objects = measure(list, args.entries, args.message_size)
+    arena = measure(MemoryLog, args.entries, args.message_size)
+    print(f'baseline entry objects and sizes: {baseline:.0f} bytes per entry')
+    print(f'slotted entry objects:            {objects:.0f} bytes per entry')
+    print(f'packed arena:                     {arena:.0f} bytes per entry')
@@ -0,0 +1,37 @@
+import argparse
+import json
+import timeit
+import uuid
+
+from src import wire
+from src.log import Command, LogEntry, Operation
+
+
+def build_request(entries, message_size):
+    message = json.dumps({'topic': 'benchmark', 'message': 'x' * message_size})
+    log_entries = [LogEntry(7, Command(str(uuid.uuid4()), Operation.PUT_MESSAGE, message)) for _ in range(entries)]
+    return {'term': 7, 'leaderId': 0, 'prevLogTerm': 7, 'prevLogIndex': 1000, 'entries': log_entries,
+            'leaderCommit': 1000}
+
+
+def measure(data, content_type, repeat):
+    """
+    :return: body size in bytes, and milliseconds spent to encode and to decode one request
+    """
+    body, _ = wire.encode_request('logs/append', data, content_type)
+    encode = timeit.timeit(lambda: wire.encode_request('logs/append', data, content_type), number=repeat)
+    decode = timeit.timeit(lambda: wire.decode_append_request(body, content_type), number=repeat)
+    return len(body), encode * 1000 / repeat, decode * 1000 / repeat
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compares the JSON and binary encodings of the append request.')
+    parser.add_argument('--entries', type=int, default=256, help='number of log entries in the request')
+    parser.add_argument('--repeat', type=int, default=50, help='number of requests encoded and decoded')
+    args = parser.parse_args()
+    print(f'{"message":>8} {"format":>8} {"bytes":>10} {"encode ms":>10} {"decode ms":>10}')
+    for message_size in [16, 256, 4096]:
+        data = build_request(args.entries, message_size)
+        for name, content_type in [('json', wire.JSON), ('binary', wire.BINARY)]:
+            size, encode, decode = measure(data, content_type, args.repeat)
+            print(f'{message_size:>8} {name:>8} {size:>10} {encode:>10.3f} {decode:>10.3f}')
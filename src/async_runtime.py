@@ -0,0 +1,667 @@
+import asyncio
+import json
+import re
+import time
+from urllib.parse import parse_qsl
+
+from werkzeug.datastructures import MultiDict
+
+from src import rest_client, wire
+from src.raft import MIN_ELECTION_TIMEOUT, Role
+
+LEADER_ONLY = 'Only leader node can serve requests.'
+
+
+def retrieve_exception(task):
+    """
+    Marks the exception of a task nobody awaits as retrieved.
+    """
+    if not task.cancelled():
+        task.exception()
+
+
+def spawn(coroutine):
+    task = asyncio.ensure_future(coroutine)
+    task.add_done_callback(retrieve_exception)
+    return task
+
+
+async def read_head(reader):
+    """
+    Reads the status line and the headers of an HTTP response.
+    :return: status code and headers, with lower case names
+    """
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError('Connection closed by the peer.')
+    status = int(status_line.split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            return status, headers
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+
+class PeerClient:
+    """
+    Async HTTP/1.1 client for the RPCs between nodes. Keeps up to pool_size keep-alive connections open to each peer.
+    The Raft RPCs are sent in wire_format to the peers advertising it, in JSON otherwise.
+    """
+
+    def __init__(self, pool_size, wire_format=wire.JSON):
+        self.__pool_size = pool_size
+        self.__wire_format = wire_format
+        self.__idle = dict()  # hostname -> idle connections, as (reader, writer) pairs
+        self.__accepted_types = dict()  # hostname -> media types the peer accepts, from its Accept-Post header
+
+    async def post(self, hostname, service_url, data, timeout):
+        content_type = self.__wire_format if self.__wire_format in self.__accepted_types.get(hostname, ()) \
+            else wire.JSON
+        body, content_type = wire.encode_request(service_url, data, content_type)
+        status, _, payload = await asyncio.wait_for(
+            self.__send(hostname, 'POST', service_url, body, content_type, {}), timeout)
+        if status not in [200, 201]:
+            raise Exception(f'{hostname} replied with status {status}.')
+        return json.loads(payload)
+
+    async def forward(self, hostname, method, target, body, content_type, headers, timeout):
+        """
+        Sends a client request on to the host as it is.
+        :param target: path of the request, without its leading slash, with its query string
+        :return: status code, headers, with lower case names, and body of the response, whatever its status code
+        """
+        return await asyncio.wait_for(self.__send(hostname, method, target, body, content_type, headers), timeout)
+
+    async def __send(self, hostname, method, service_url, body, content_type, extra_headers):
+        idle = self.__idle.setdefault(hostname, [])
+        while True:
+            reused = bool(idle)
+            if reused:
+                reader, writer = idle.pop()
+            else:
+                host, port = hostname.rsplit(':', 1)
+                reader, writer = await asyncio.open_connection(host, int(port))
+            try:
+                head = ''.join(f'{name}: {value}\r\n' for name, value in extra_headers.items())
+                writer.write(f'{method} /{service_url} HTTP/1.1\r\nHost: {hostname}\r\n{head}'
+                             f'Content-Type: {content_type}\r\nContent-Length: {len(body)}\r\n\r\n'.encode('latin-1')
+                             + body)
+                await writer.drain()
+                status, headers = await read_head(reader)
+                length = int(headers.get('content-length', -1))
+                payload = await reader.readexactly(length) if length >= 0 else await reader.read()
+            except ConnectionError:
+                writer.close()
+                if reused:  # the peer closed the idle connection, retry on a new one
+                    continue
+                raise
+            except BaseException:
+                writer.close()
+                raise
+            break
+        if 'accept-post' in headers:
+            self.__accepted_types[hostname] = {media_type.strip() for media_type in headers['accept-post'].split(',')}
+        if length < 0 or headers.get('connection', '').lower() == 'close' or len(idle) >= self.__pool_size:
+            writer.close()
+        else:
+            idle.append((reader, writer))
+        return status, headers, payload
+
+    def close(self):
+        for connections in self.__idle.values():
+            for _, writer in connections:
+                writer.close()
+        self.__idle.clear()
+
+
+class AsyncRuntime:
+    """
+    Runs a node on a single asyncio event loop, as an ASGI application. Client requests wait for their log entries
+    on futures instead of threads, peer RPCs are sent with an async client, and the election and heartbeats are
+    driven by timers. The REST API is the same as the Flask one: the routes which wait for the log are served here,
+    the other ones are dispatched to the Flask app.
+    :param server: the node module, holding the node and its state machine
+    """
+
+    def __init__(self, server):
+        self.__server = server
+        self.__client = PeerClient(rest_client.POOL_SIZE, server.WIRE_FORMAT)
+        self.__loop = None
+        self.__waiters = dict()  # future -> condition it waits for
+        self.__pending = None  # commands of the next log entry, future resolved once appended, flush timer
+        self.__election_timer = None
+        self.__housekeeping_timer = None
+        self.__election = None
+        self.__replicators = dict()  # follower -> replication task
+        self.__routes = [
+            ('PUT', re.compile('/topic'), self.put_topic),
+            ('GET', re.compile('/topic'), self.get_topics),
+            ('GET', re.compile('/topic/([^/]+)'), self.peek_topic),
+            ('PUT', re.compile('/message'), self.put_message),
+            ('PUT', re.compile('/messages'), self.put_messages),
+            ('GET', re.compile('/message/([^/]+)'), self.get_message),
+            ('PUT', re.compile('/offset'), self.commit_offset),
+            ('PUT', re.compile('/ack'), self.ack_messages),
+        ]
+
+    @property
+    def node(self):
+        return self.__server.node
+
+    def start(self):
+        """
+        Starts the election and housekeeping timers. Called on the event loop.
+        """
+        self.__loop = asyncio.get_running_loop()
+        self.__schedule_election_timer()
+        self.__schedule_housekeeping()
+
+    async def stop(self):
+        for timer in (self.__election_timer, self.__housekeeping_timer):
+            if timer:
+                timer.cancel()
+        tasks = list(self.__replicators.values()) + ([self.__election] if self.__election else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.__replicators.clear()
+        self.__client.close()
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.__lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+        body = bytearray()
+        while True:
+            message = await receive()
+            body.extend(message.get('body', b''))
+            if not message.get('more_body'):
+                break
+        headers = {name.decode('latin-1'): value.decode('latin-1') for name, value in scope['headers']}
+        status, response_headers, payload = await self.handle(
+            scope['method'], scope['path'], scope['query_string'].decode('latin-1'), bytes(body), headers)
+        response_headers['content-length'] = str(len(payload))
+        response_headers['accept-post'] = wire.ACCEPT_POST
+        leader = self.__server.known_leader()
+        if leader is not None:
+            response_headers[rest_client.LEADER_HEADER.lower()] = leader
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(name.encode('latin-1'), value.encode('latin-1')) for name, value in response_headers.items()]
+        })
+        await send({'type': 'http.response.body', 'body': payload})
+
+    async def __lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self.start()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.stop()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def handle(self, method, path, query, body, headers):
+        """
+        Serves a request.
+        :param headers: request headers, with lower case names
+        :return: status code, headers, with lower case names, and body of the response
+        """
+        for route_method, pattern, handler in self.__routes:
+            match = pattern.fullmatch(path)
+            if route_method != method or not match:
+                continue
+            args = MultiDict(parse_qsl(query, keep_blank_values=True))
+            if self.__server.placement.group_count > 1 and handler != self.get_topics:
+                try:
+                    owner = self.__server.request_group(match.group(1) if match.groups() else None, body,
+                                                        handler == self.put_messages)
+                except (ValueError, KeyError) as e:
+                    output = {'success': False, 'error': f'Raft group of the request could not be found: {e}'}
+                    return 400, {'content-type': 'application/json'}, json.dumps(output).encode('utf-8')
+                if owner != self.__server.group:
+                    return await self.__forward(self.__server.group_nodes[owner], method, path, query, args, body,
+                                                headers, {}, 'Raft group could not be reached.')
+            if not self.node.is_leader():
+                return await self.__to_leader(method, path, query, args, body, headers)
+            try:
+                status, output = await handler(args, body, *match.groups())
+            except Exception as e:
+                print(f'Request {method} {path} failed with: {e}.')
+                status, output = 500, {'success': False, 'error': 'Internal server error.'}
+            return status, {'content-type': 'application/json'}, json.dumps(output).encode('utf-8')
+        return self.dispatch(method, path, query, body, headers)
+
+    async def __to_leader(self, method, path, query, args, body, headers):
+        """
+        Forwards, or redirects, a client request received as a follower to the leader.
+        """
+        leader = self.node.leader_address
+        # a forwarded request is not forwarded again, the leader it was forwarded to has stepped down
+        if leader is None or rest_client.FORWARDED_HEADER.lower() in headers:
+            return 403, {'content-type': 'text/html; charset=utf-8'}, LEADER_ONLY.encode('utf-8')
+        forwarded_by = {rest_client.FORWARDED_HEADER: self.__server.address}
+        return await self.__forward(leader, method, path, query, args, body, headers, forwarded_by,
+                                    'Leader could not be reached.')
+
+    async def __forward(self, target_node, method, path, query, args, body, headers, extra_headers, unreachable_error):
+        """
+        Forwards, or redirects, a client request to another node.
+        """
+        target = path.lstrip('/') + ('?' + query if query else '')
+        if not self.__server.FORWARD_REQUESTS:
+            return 307, {'content-type': 'text/html; charset=utf-8', 'location': f'http://{target_node}/{target}'}, b''
+        timeout = self.__server.FORWARD_TIMEOUT + args.get('wait', 0, type=float)
+        try:
+            status, response_headers, payload = await self.__client.forward(
+                target_node, method, target, body, headers.get('content-type', wire.JSON), extra_headers, timeout)
+        except Exception as e:
+            print(f'Forwarding {method} {path} to {target_node} failed with: {e}.')
+            output = {'success': False, 'error': unreachable_error}
+            return 503, {'content-type': 'application/json'}, json.dumps(output).encode('utf-8')
+        return status, {'content-type': response_headers.get('content-type', 'application/json')}, payload
+
+    def dispatch(self, method, path, query, body, headers):
+        """
+        Serves a request with the Flask app. Only used for the routes which never wait, like the Raft RPCs.
+        """
+        app = self.__server.app
+        with app.test_request_context(path, method=method, query_string=query, data=body, headers=headers):
+            response = app.full_dispatch_request()
+        # the request may have committed, truncated or replaced log entries, or changed the role of the node
+        self.apply()
+        return response.status_code, {'content-type': response.content_type}, response.get_data()
+
+    async def put_topic(self, args, body):
+        command = self.__server.put_topic_command(json.loads(body.decode('utf-8')))
+        return await self.submit_command(command, self.__request_timeout(args))
+
+    async def get_topics(self, args, body):
+        if not await self.linearizable_read(self.__request_timeout(args)):
+            return 503, {'success': False, 'error': 'Leadership could not be confirmed.'}
+        server = self.__server
+        if server.placement.group_count == 1 or server.LOCAL_LISTING_ARG in args:
+            return 200, server.list_topics()
+        timeout = server.FORWARD_TIMEOUT + self.__request_timeout(args)
+        try:
+            outputs = await asyncio.gather(*[self.__list_group_topics(other, timeout) for other in
+                                             range(server.placement.group_count) if other != server.group])
+        except Exception as e:
+            print(f'Listing the topics of another Raft group failed with: {e!r}.')
+            return 503, {'success': False, 'error': 'Raft group could not be reached.'}
+        return 200, server.merge_topic_listings([server.list_topics()] + outputs)
+
+    async def __list_group_topics(self, other_group, timeout):
+        """
+        Lists the topics of another Raft group through its node on this host, which forwards the request to its leader.
+        """
+        server = self.__server
+        status, _, payload = await self.__client.forward(server.group_nodes[other_group], 'GET',
+                                                         f'topic?{server.LOCAL_LISTING_ARG}', b'', wire.JSON, {},
+                                                         timeout)
+        if status != 200:
+            raise Exception(f'Raft group {other_group} replied with status {status}.')
+        return json.loads(payload)
+
+    async def peek_topic(self, args, body, topic):
+        if not await self.linearizable_read(self.__request_timeout(args)):
+            return 503, {'success': False, 'error': 'Leadership could not be confirmed.'}
+        return 200, self.__server.topic_details(topic, args.get('peek', 0, type=int), args.get('partition', type=int))
+
+    async def put_message(self, args, body):
+        command = self.__server.put_message_command(body.decode('utf-8'))
+        return await self.submit_command(command, self.__request_timeout(args))
+
+    async def put_messages(self, args, body):
+        command = self.__server.put_messages_command(json.loads(body.decode('utf-8')))
+        return await self.submit_command(command, self.__request_timeout(args))
+
+    async def get_message(self, args, body, topic):
+        max_messages = args.get('max', type=int)
+        partition = args.get('partition', type=int)
+        visibility = args.get('visibility', type=float)
+        wait = min(args.get('wait', 0, type=float), self.__server.MAX_LONG_POLL_WAIT)
+        deadline = time.time() + wait
+        if self.__server.is_log_topic(topic):
+            return await self.get_log_messages(args, topic, max_messages, wait)
+        empty = {'success': False} if max_messages is None else {'success': False, 'messages': []}
+        while True:
+            if wait > 0 and not await self.wait_for(lambda: self.__server.has_messages(topic, partition),
+                                                    deadline - time.time()):
+                return 200, empty
+            command = self.__server.get_message_command(topic, max_messages, partition, visibility)
+            status, output = await self.submit_command(command, self.__request_timeout(args))
+            # another consumer may have drained the topic in the meantime, wait again
+            if wait <= 0 or status != 200 or output['success'] or time.time() >= deadline:
+                return status, output
+
+    async def get_log_messages(self, args, topic, max_messages, wait):
+        group = args.get('group')
+        offset = args.get('offset', type=int)
+        if not await self.linearizable_read(self.__request_timeout(args)):
+            return 503, {'success': False, 'error': 'Leadership could not be confirmed.'}
+        if wait > 0:
+            await self.wait_for(lambda: self.__server.has_log_messages(topic, group, offset), wait)
+        return 200, self.__server.read_log(topic, group, offset, max_messages)
+
+    async def ack_messages(self, args, body):
+        command = self.__server.ack_messages_command(json.loads(body.decode('utf-8')))
+        return await self.submit_command(command, self.__request_timeout(args))
+
+    async def commit_offset(self, args, body):
+        command = self.__server.commit_offset_command(json.loads(body.decode('utf-8')))
+        return await self.submit_command(command, self.__request_timeout(args))
+
+    def __request_timeout(self, args):
+        return args.get('timeout', self.__server.REQUEST_TIMEOUT, type=float)
+
+    async def wait_for(self, predicate, timeout):
+        """
+        Waits until the predicate holds. It is checked every time the applied state or the role of the node changes.
+        :return: False if the timeout expired before
+        """
+        if predicate():
+            return True
+        future = self.__loop.create_future()
+        self.__waiters[future] = predicate
+        try:
+            await asyncio.wait_for(future, max(timeout, 0))
+            return True
+        except asyncio.TimeoutError:
+            return predicate()
+        finally:
+            self.__waiters.pop(future, None)
+
+    def notify(self):
+        """
+        Wakes up the waiters whose condition holds.
+        """
+        for future, predicate in list(self.__waiters.items()):
+            if not future.done() and predicate():
+                future.set_result(True)
+
+    async def append(self, command):
+        """
+        Adds the command to the next log entry. The commands submitted within GROUP_COMMIT_WINDOW share one entry.
+        :return: term and index of the log entry
+        """
+        if self.__pending is None:
+            timer = self.__loop.call_later(self.__server.GROUP_COMMIT_WINDOW, self.__flush)
+            self.__pending = ([], self.__loop.create_future(), timer)
+        commands, future, _ = self.__pending
+        commands.append(command)
+        if len(commands) >= self.__server.GROUP_COMMIT_MAX_SIZE:
+            self.__flush()
+        return await future
+
+    def __flush(self):
+        if self.__pending is None:
+            return
+        commands, future, timer = self.__pending
+        self.__pending = None
+        timer.cancel()
+        try:
+            future.set_result(self.__server.append_commands(commands))
+        except Exception as e:
+            future.set_exception(e)
+        self.__advance()
+
+    async def submit_command(self, command, timeout):
+        """
+        Appends the command to the log and waits until it is applied to the state machine.
+        :return: status code and result of the command
+        """
+        results = self.__server.results
+        results.expect(command.id)
+        try:
+            try:
+                term, log_index = await self.append(command)
+            except self.__server.NotLeaderError as e:
+                return 503, {'success': False, 'error': str(e)}
+
+            def is_done():
+                if self.node.last_applied >= log_index:
+                    return True
+                # the entry was overwritten by a new leader, it will never be applied
+                return self.node.logs.log_size <= log_index or self.node.logs.term_at(log_index) != term
+
+            applied = await self.wait_for(is_done, timeout)
+        finally:
+            result = results.pop(command.id)
+        if not applied:
+            return 504, {'success': False, 'error': 'Request timed out.'}
+        if result is None:
+            return 503, {'success': False, 'error': 'Request was not committed.'}
+        return 200, result
+
+    async def linearizable_read(self, timeout):
+        """
+        Raft ReadIndex, as in the Flask runtime.
+        :return: True if the local state can be read
+        """
+        node = self.node
+        deadline = time.time() + timeout
+        # the commit index is only known once an entry of the current term is committed
+        if not await self.wait_for(lambda: not node.is_leader() or (
+                node.term_start_index is not None and node.last_applied >= node.term_start_index), timeout):
+            return False
+        if not node.is_leader():
+            return False
+        read_index = node.committed_index
+        if not (self.__server.READ_MODE == self.__server.LEASE and self.__server.leader_lease_valid()) and \
+                not await self.confirm_leadership(deadline - time.time()):
+            return False
+        return await self.wait_for(lambda: node.last_applied >= read_index, deadline - time.time())
+
+    async def __ask(self, follower, service_url, data, timeout):
+        try:
+            return follower, await self.__client.post(follower, service_url, data, timeout)
+        except Exception as e:
+            print(f'Call to {follower}/{service_url} failed with: {e!r}.')
+            return follower, None
+
+    async def confirm_leadership(self, timeout):
+        """
+        Sends a heartbeat to every follower and waits for a quorum to acknowledge this node as the leader.
+        :return: True if a quorum acknowledged
+        """
+        node = self.node
+        acks = 1
+        if acks > node.total_nodes / 2:
+            return True
+        sent_time = time.monotonic()
+        tasks = [spawn(self.__ask(follower, 'logs/append', self.__server.build_heartbeat(follower), timeout))
+                 for follower in node.sibling_nodes]
+        try:
+            for request in asyncio.as_completed(tasks, timeout=max(timeout, 0)):
+                follower, response = await request
+                if response is None:
+                    continue
+                if response['term'] > node.term:
+                    self.__server.update_term_return_to_follower(response['term'])
+                    self.notify()
+                    return False
+                self.__server.record_ack(follower, sent_time)
+                acks += 1
+                if acks > node.total_nodes / 2:
+                    return True
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+        return False
+
+    def apply(self):
+        """
+        Applies the committed entries and wakes up the requests waiting for them.
+        """
+        if self.node.last_applied < self.node.committed_index:
+            self.__server.apply_state_machine()
+        self.notify()
+
+    def __advance(self):
+        self.__server.update_committed_index()
+        self.apply()
+
+    def __schedule_housekeeping(self):
+        self.__housekeeping_timer = self.__loop.call_later(self.__server.HEARTBEAT_INTERVAL, self.__housekeeping)
+
+    def __housekeeping(self):
+        self.apply()
+        self.__server.take_snapshot_if_due()
+        if self.node.logs.sync_if_due() and self.node.is_leader():
+            self.__advance()
+        for expiry in (self.__server.lease_expiry_command(), self.__server.retention_command()):
+            if expiry is not None:
+                self.__loop.create_task(self.__append_expiry(expiry))
+        self.__server.results.evict()
+        self.__schedule_housekeeping()
+
+    async def __append_expiry(self, command):
+        try:
+            await self.append(command)
+        except self.__server.NotLeaderError:
+            pass  # the new leader checks the deadlines again
+
+    def __schedule_election_timer(self):
+        if self.node.is_leader():
+            delay = MIN_ELECTION_TIMEOUT
+        else:
+            delay = max(self.node.time_until_heartbeat_timeout(), 0)
+        self.__election_timer = self.__loop.call_later(delay / 1000, self.__on_election_timer)
+
+    def __on_election_timer(self):
+        if self.node.check_heartbeat_timeout() and (self.__election is None or self.__election.done()):
+            self.__election = spawn(self.__elect())
+        self.__schedule_election_timer()
+
+    async def __elect(self):
+        """
+        Runs a leader election, as a candidate of a new term.
+        """
+        node = self.node
+        print(f'Initiating leader election.')
+        node.transition_to_new_role(Role.CANDIDATE)
+        node.increment_term()
+        term = node.term
+        votes = 1  # vote for itself
+        data = self.__server.build_vote_request()
+        timeout = max(node.time_until_heartbeat_timeout(), 0) / 1000
+        tasks = [spawn(self.__ask(follower, 'election/vote', data, timeout)) for follower in node.sibling_nodes]
+        try:
+            for request in asyncio.as_completed(tasks):
+                _, response = await request
+                if node.role != Role.CANDIDATE or node.term != term:
+                    return
+                if response is None:
+                    continue
+                if response['vote']:
+                    votes += 1
+                elif response['term'] > node.term:
+                    self.__server.update_term_return_to_follower(response['term'])
+                    self.notify()
+                    return
+                print(f'Received {votes}/{node.total_nodes} votes.')
+                if votes > node.total_nodes / 2:
+                    break
+        finally:
+            for task in tasks:
+                task.cancel()
+        if votes > node.total_nodes / 2 and node.role == Role.CANDIDATE and node.term == term:
+            self.__become_leader()
+        elif node.role == Role.CANDIDATE:
+            node.transition_to_new_role(Role.FOLLOWER)
+
+    def __become_leader(self):
+        self.__server.become_leader()
+        for follower in self.node.sibling_nodes:
+            self.__replicators[follower] = spawn(self.__replicate(follower, self.node.term))
+        self.__advance()  # a single node commits the no-op entry right away
+
+    async def __replicate(self, follower, term):
+        """
+        Replication loop of one follower, runs while the node is the leader of the given term. Entries are sent as
+        soon as they are appended, a heartbeat is sent after HEARTBEAT_INTERVAL without any.
+        """
+        print(f'Starting replication to {follower} for term {term}.')
+        wakeup = self.__server.replication_events[follower] = asyncio.Event()
+        while self.node.is_leader() and self.node.term == term:
+            wakeup.clear()
+            try:
+                lagging = await self.__replicate_to(follower, term)
+            except Exception as e:
+                print(f'Replication to {follower} failed with: {e!r}.')
+                lagging = False
+            if not lagging:
+                try:
+                    await asyncio.wait_for(wakeup.wait(), self.__server.HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+        print(f'Stopped replication to {follower} for term {term}.')
+
+    async def __replicate_to(self, follower, term):
+        """
+        Sends the snapshot or up to MAX_INFLIGHT_APPENDS batches of entries to a follower and records the replies.
+        :return: True if the follower is still missing entries and replied, False to wait before the next round
+        """
+        server = self.__server
+        node = self.node
+        sent_time = time.monotonic()
+        start_index = node.next_index[follower]
+        requests = []
+        if start_index < node.logs.first_index:  # the entries were compacted, send the snapshot instead
+            snapshot = node.snapshot
+            requests.append((spawn(self.__send_snapshot(follower, snapshot)), snapshot.last_index, 0))
+        else:
+            for _ in range(server.MAX_INFLIGHT_APPENDS):
+                data, count = server.build_append_request(start_index)
+                request = spawn(self.__client.post(follower, 'logs/append', data, server.APPEND_TIMEOUT))
+                requests.append((request, data['prevLogIndex'], count))
+                start_index += count
+                if count == 0 or start_index >= node.logs.log_size:
+                    break
+        replied = False
+        try:
+            for request, prev_index, count in requests:
+                try:
+                    response = await request
+                except Exception as e:
+                    print(f'Sending heartbeats to {follower} failed with: {e!r}.')
+                    continue
+                replied = True
+                if not server.handle_append_response(follower, term, sent_time, prev_index, count, response):
+                    self.notify()
+                    return False
+        finally:
+            for request, _, _ in requests:
+                request.cancel()
+        self.__advance()
+        return replied and node.next_index[follower] < node.logs.log_size  # retry an unreachable follower later
+
+    async def __send_snapshot(self, follower, snapshot):
+        offset = 0
+        while True:
+            data = self.__server.build_snapshot_request(snapshot, offset)
+            response = await self.__client.post(follower, 'snapshot/install', data, 1)
+            if response['term'] > self.node.term or not response['success'] or data['done']:
+                return response
+            offset += self.__server.SNAPSHOT_CHUNK_SIZE
+
+
+def serve(server, host, port):
+    """
+    Serves the node with the asyncio runtime. Needs uvicorn as the ASGI server.
+    :param server: the node module, with its node already created
+    """
+    try:
+        import uvicorn
+    except ImportError:
+        raise SystemExit('The asyncio runtime needs an ASGI server, install it with: pip install uvicorn')
+    uvicorn.run(AsyncRuntime(server), host=host, port=port, lifespan='on', log_level='warning')
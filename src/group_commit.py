@@ -0,0 +1,61 @@
+import threading
+
+
+class PendingBatch:
+    """
+    Commands collected by the group committer, waiting to be appended to the log as one entry.
+    """
+
+    def __init__(self):
+        self.commands = []
+        self.appended = threading.Event()
+        self.position = None  # value returned by the append function
+        self.error = None
+
+
+class GroupCommitter:
+    """
+    Coalesces the commands submitted concurrently into batches. A batch is appended to the log when it reaches
+    max_size commands, or when the window has elapsed since its first command arrived.
+    """
+
+    def __init__(self, append, window, max_size):
+        self.__append = append  # appends a list of commands to the log
+        self.__window = window  # seconds
+        self.__max_size = max_size
+        self.__thread_lock = threading.Lock()
+        self.__pending = None
+
+    def submit(self, command):
+        """
+        Adds the command to the pending batch and waits until the batch is appended.
+        :return: the value returned by the append function for the batch
+        """
+        with self.__thread_lock:
+            batch = self.__pending
+            opened = batch is None
+            if opened:
+                batch = self.__pending = PendingBatch()
+            batch.commands.append(command)
+            if len(batch.commands) >= self.__max_size:
+                self.__flush(batch)
+        if opened and not batch.appended.wait(self.__window):
+            with self.__thread_lock:
+                if self.__pending is batch:
+                    self.__flush(batch)
+        batch.appended.wait()
+        if batch.error:
+            raise batch.error
+        return batch.position
+
+    def __flush(self, batch):
+        """
+        Appends the batch. Called with the lock held so the batches reach the log in the order they were opened.
+        """
+        self.__pending = None
+        try:
+            batch.position = self.__append(batch.commands)
+        except Exception as e:
+            batch.error = e
+        finally:
+            batch.appended.set()
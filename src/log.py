@@ -1,15 +1,40 @@
+import json
+import struct
 import threading
+from array import array
 from enum import Enum
 
+from src.wal import SegmentedLog, FsyncPolicy
+
+SEGMENT_BYTES = 64 * 1024 * 1024  # size after which a new log segment file is started
+FSYNC_INTERVAL = 10  # milliseconds between two fsync calls with the batch fsync policy
+ENTRY_HEADER = struct.Struct('>qB')  # term, operation of the command or 0 for an entry without command
+LENGTH = struct.Struct('>I')
+ID_UUID = 0  # the command id is a uuid, packed as 16 bytes
+ID_TEXT = 1  # the command id is any other string, packed length prefixed
+NO_MESSAGE = 0xFFFFFFFF  # length of a missing message
+UUID_PREFIX = bytes([ID_UUID])
+TEXT_PREFIX = bytes([ID_TEXT])
+
 
 class Operation(Enum):
     GET_MESSAGE = 1
     PUT_MESSAGE = 2
     GET_TOPICS = 3
     PUT_TOPIC = 4
+    BATCH = 5
+    PUT_MESSAGES = 6
+    GET_MESSAGES = 7
+    NOOP = 8
+    COMMIT_OFFSET = 9
+    ACK_MESSAGES = 10
+    EXPIRE_LEASES = 11
+    RETAIN_MESSAGES = 12
 
 
 class Command():
+    __slots__ = ('__id', '__operation', '__message')
+
     def __init__(self, id, operation, message=None):
         self.__id = id
         self.__operation = operation
@@ -30,6 +55,17 @@ class Command():
     def message(self):
         return self.__message
 
+    @property
+    def commands(self):
+        """
+        Commands carried by a BATCH command.
+        """
+        return [Command.json_decode(command) for command in self.__message]
+
+    @classmethod
+    def batch(cls, id, commands):
+        return Command(id, Operation.BATCH, [command.json_encode() for command in commands])
+
     # json serialization
     def json_encode(self):
         return {
@@ -46,6 +82,8 @@ class Command():
 
 
 class LogEntry():
+    __slots__ = ('__term', '__command')
+
     def __init__(self, term, command):
         self.__term = term
         self.__command = command
@@ -75,16 +113,240 @@ class LogEntry():
         return LogEntry(json_dict['term'], Command.json_decode(json_dict['command']))
 
 
-class NodeLog:
+def encode_entry(entry):
+    return json.dumps(entry.json_encode()).encode('utf-8')
+
+
+def decode_entry(payload):
+    return LogEntry.json_decode(json.loads(payload.decode('utf-8')))
+
+
+def pack_id(id, parts):
+    if isinstance(id, str) and len(id) == 36 and id[8] == id[13] == id[18] == id[23] == '-' and id == id.lower():
+        try:
+            parts.append(UUID_PREFIX + bytes.fromhex(id.replace('-', '')))
+            return
+        except ValueError:
+            pass
+    text = str(id).encode('utf-8')
+    parts.append(TEXT_PREFIX + LENGTH.pack(len(text)) + text)
+
+
+def unpack_uuid(raw):
+    text = raw.hex()
+    return f'{text[:8]}-{text[8:12]}-{text[12:16]}-{text[16:20]}-{text[20:]}'
+
+
+def pack_command(command, parts):
+    """
+    Appends the id and the message of the command. BATCH commands carry their commands, each prefixed with its
+    operation.
+    """
+    pack_id(command.id, parts)
+    if command.operation is Operation.BATCH:
+        parts.append(LENGTH.pack(len(command.message)))
+        for inner in command.commands:
+            parts.append(bytes([inner.operation.value]))
+            pack_command(inner, parts)
+    elif command.message is None:
+        parts.append(LENGTH.pack(NO_MESSAGE))
+    else:
+        message = command.message.encode('utf-8')
+        parts.append(LENGTH.pack(len(message)))
+        parts.append(message)
+
+
+def unpack_command(payload, offset, operation):
+    """
+    Reads a command packed by pack_command.
+    :return: the command and the offset following it
+    """
+    kind = payload[offset]
+    offset += 1
+    if kind == ID_UUID:
+        id = unpack_uuid(payload[offset:offset + 16])
+        offset += 16
+    else:
+        length, = LENGTH.unpack_from(payload, offset)
+        offset += LENGTH.size
+        id = payload[offset:offset + length].decode('utf-8')
+        offset += length
+    length, = LENGTH.unpack_from(payload, offset)
+    offset += LENGTH.size
+    if operation is Operation.BATCH:
+        commands = []
+        for _ in range(length):
+            command, offset = unpack_command(payload, offset + 1, Operation(payload[offset]))
+            commands.append(command)
+        return Command.batch(id, commands), offset
+    if length == NO_MESSAGE:
+        return Command(id, operation), offset
+    return Command(id, operation, payload[offset:offset + length].decode('utf-8')), offset + length
+
+
+def pack_entry(entry):
+    """
+    Compact binary encoding of the entry, used by the in-memory log and by the binary wire format.
+    """
+    command = entry.command
+    parts = [ENTRY_HEADER.pack(entry.term, 0 if not command else command.operation.value)]
+    if command:
+        pack_command(command, parts)
+    return b''.join(parts)
+
+
+def unpack_entry(payload, offset=0):
+    """
+    Reads an entry packed by pack_entry.
+    :return: the entry and the offset following it
+    """
+    term, operation = ENTRY_HEADER.unpack_from(payload, offset)
+    offset += ENTRY_HEADER.size
+    command = None
+    if operation:
+        command, offset = unpack_command(payload, offset, Operation(operation))
+    return LogEntry(term, command), offset
+
+
+class MemoryLog:
+    """
+    In-memory counterpart of SegmentedLog. Entries are packed back to back in a bytearray arena, with their terms and
+    arena offsets in parallel arrays; entry objects are only built when read. Compacted entries are dropped.
+    """
+
     def __init__(self):
         self.__thread_lock = threading.Lock()
-        self.__entries = []
+        self.__arena = bytearray()
+        self.__arena_start = 0  # offset of the first byte of the arena, offsets are not rebased on compaction
+        self.__offsets = array('q')  # offset of every entry
+        self.__terms = array('q')
+        self.__start_index = 0
+
+    @property
+    def start_index(self):
+        return self.__start_index
+
+    @property
+    def size_bytes(self):
+        return len(self.__arena)
+
+    def __len__(self):
+        return self.__start_index + len(self.__terms)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        with self.__thread_lock:
+            if not self.__start_index <= index < len(self):
+                raise IndexError('log index out of range')
+            offset = self.__offsets[index - self.__start_index] - self.__arena_start
+            return unpack_entry(self.__arena, offset)[0]
+
+    def __iter__(self):
+        for index in range(self.__start_index, len(self)):
+            yield self[index]
+
+    def term(self, index):
+        if index < 0:
+            index += len(self)
+        if index < self.__start_index:
+            raise IndexError('log index out of range')
+        return self.__terms[index - self.__start_index]
+
+    def size(self, index):
+        if index < 0:
+            index += len(self)
+        position = index - self.__start_index
+        if position < 0:
+            raise IndexError('log index out of range')
+        with self.__thread_lock:
+            end = self.__offsets[position + 1] if position + 1 < len(self.__offsets) else \
+                self.__arena_start + len(self.__arena)
+            return end - self.__offsets[position]
+
+    def size_from(self, index):
+        """
+        Encoded size of the entries from index on.
+        """
+        position = max(index - self.__start_index, 0)
+        with self.__thread_lock:
+            if position >= len(self.__offsets):
+                return 0
+            return self.__arena_start + len(self.__arena) - self.__offsets[position]
+
+    def extend(self, entries):
+        payloads = [pack_entry(entry) for entry in entries]
+        with self.__thread_lock:
+            for entry, payload in zip(entries, payloads):
+                self.__offsets.append(self.__arena_start + len(self.__arena))
+                self.__arena.extend(payload)
+                self.__terms.append(entry.term)
+
+    def truncate(self, index):
+        with self.__thread_lock:
+            position = max(index - self.__start_index, 0)
+            if position >= len(self.__terms):
+                return
+            del self.__arena[self.__offsets[position] - self.__arena_start:]
+            del self.__offsets[position:]
+            del self.__terms[position:]
+
+    def compact(self, index):
+        with self.__thread_lock:
+            position = min(index, len(self)) - self.__start_index
+            if position <= 0:
+                return
+            cut = len(self.__arena) if position == len(self.__terms) else \
+                self.__offsets[position] - self.__arena_start
+            del self.__arena[:cut]
+            self.__arena_start += cut
+            del self.__offsets[:position]
+            del self.__terms[:position]
+            self.__start_index += position
+
+    def reset(self, index):
+        with self.__thread_lock:
+            self.__arena = bytearray()
+            self.__arena_start = 0
+            del self.__offsets[:]
+            del self.__terms[:]
+            self.__start_index = index
+
+    @property
+    def durable_length(self):
+        return len(self)
+
+    def sync_if_due(self):
+        return False
+
+    def close(self):
+        return
+
+
+class NodeLog:
+    """
+    Log entries of a node. Entries are kept in memory, or in segment files under log_dir if one is given.
+    Entries up to snapshot_index are compacted into a snapshot and are no longer available.
+    """
+
+    def __init__(self, log_dir=None, fsync_policy=FsyncPolicy.BATCH):
+        self.__thread_lock = threading.Lock()
+        self.__durable = log_dir is not None
+        if self.__durable:
+            self.__entries = SegmentedLog(log_dir, decode_entry, encode_entry, SEGMENT_BYTES, fsync_policy,
+                                          FSYNC_INTERVAL)
+        else:
+            self.__entries = MemoryLog()
+        self.__snapshot_index = -1  # index of the last entry included in the snapshot
+        self.__snapshot_term = -1
         self.__committed_index = -1
         self.__applied_index = -1
 
     def __str__(self):
         return f'NodeLog(committed_index="{self.__committed_index}", applied_index="{self.__applied_index}", ' \
-               f'entries={self.__entries})'
+               f'snapshot_index="{self.__snapshot_index}", log_size={self.log_size})'
 
     @property
     def committed_index(self):
@@ -102,11 +364,142 @@ class NodeLog:
     def entries(self):
         return self.__entries
 
+    @property
+    def durable(self):
+        return self.__durable
+
+    @property
+    def snapshot_index(self):
+        return self.__snapshot_index
+
+    @property
+    def snapshot_term(self):
+        return self.__snapshot_term
+
+    @property
+    def durable_index(self):
+        """
+        Index of the last entry written to disk according to the fsync policy, the last entry of an in-memory log.
+        """
+        return self.__entries.durable_length - 1
+
+    @property
+    def first_index(self):
+        """
+        Index of the first entry not compacted into the snapshot.
+        """
+        return self.__snapshot_index + 1
+
+    @property
+    def size_bytes(self):
+        """
+        Encoded size of the entries not compacted into the snapshot.
+        """
+        return self.__entries.size_bytes
+
+    def size_bytes_until(self, idx):
+        """
+        Encoded size of the entries not compacted into the snapshot, up to idx included.
+        """
+        return self.__entries.size_bytes - self.__entries.size_from(idx + 1)
+
+    def term_at(self, idx):
+        """
+        Returns the term of the entry at idx without reading the entry from disk.
+        """
+        if idx < 0:
+            idx += self.log_size
+        if idx == self.__snapshot_index:
+            return self.__snapshot_term
+        return self.__entries.term(idx)
+
+    def first_index_of_term(self, idx):
+        """
+        Returns the index of the first entry having the term of the entry at idx, among the entries not compacted.
+        Terms never decrease along the log, so it is found by bisection.
+        """
+        term = self.term_at(idx)
+        low, high = self.first_index, idx
+        while low < high:
+            middle = (low + high) // 2
+            if self.term_at(middle) < term:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def last_index_of_term(self, term, idx):
+        """
+        Returns the index of the last entry of the term up to idx, None if no such entry is left in the log.
+        """
+        low, high = self.first_index, min(idx, self.log_size - 1)
+        if high < low:
+            return None
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.term_at(middle) <= term:
+                low = middle
+            else:
+                high = middle - 1
+        return low if self.term_at(low) == term else None
+
+    def size_at(self, idx):
+        """
+        Returns the encoded size of the entry at idx.
+        """
+        return self.__entries.size(idx)
+
     def delete_entries_from(self, idx):
-        self.__entries = self.__entries[:idx]
+        with self.__thread_lock:
+            self.__entries.truncate(idx)
 
     def append(self, entry):
-        self.__entries.append(entry)
+        """
+        Appends the entry to the end of the log.
+        :return: index of the appended entry
+        """
+        with self.__thread_lock:
+            self.__entries.extend([entry])
+            return len(self.__entries) - 1
+
+    def extend(self, entries):
+        with self.__thread_lock:
+            self.__entries.extend(entries)
+
+    def compact(self, snapshot_index, snapshot_term):
+        """
+        Drops the entries up to snapshot_index, which are covered by a snapshot. If the log does not contain the
+        last entry of the snapshot, the whole log is discarded.
+        """
+        with self.__thread_lock:
+            if snapshot_index < len(self.__entries) and snapshot_index >= self.__entries.start_index and \
+                    self.__entries.term(snapshot_index) == snapshot_term:
+                self.__entries.compact(snapshot_index + 1)
+            else:
+                self.__entries.reset(snapshot_index + 1)
+            self.__snapshot_index = snapshot_index
+            self.__snapshot_term = snapshot_term
+
+    def sync(self):
+        """
+        Flushes the entries not written to disk yet, unless the fsync policy is never.
+        :return: True if the writes were synced
+        """
+        with self.__thread_lock:
+            if self.__entries.durable_length >= len(self.__entries):
+                return False
+            self.__entries.sync()
+            return True
+
+    def sync_if_due(self):
+        """
+        Flushes the buffered writes to disk according to the fsync policy.
+        :return: True if the writes were synced
+        """
+        return self.__entries.sync_if_due()
+
+    def close(self):
+        self.__entries.close()
 
 
 if __name__ == '__main__':
@@ -1,43 +1,313 @@
 import json
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlencode
+
+import requests
 
 from src import rest_client
+from src.placement import Placement, group_addresses
+
+REQUEST_TIMEOUT = 1  # seconds a node has to serve a request, besides the wait of a long poll
+PROBE_TIMEOUT = 0.2  # seconds a node has to answer the status probe looking for the leader
+RETRIES = 5  # attempts of a request failing on a node that is down, not the leader or timing out
+BACKOFF = 0.05  # seconds before the first retry, doubled after every failed attempt
+MAX_BACKOFF = 1.0  # seconds
+RETRY_STATUSES = (403, 503, 504)  # not the leader, leader unknown or unreachable, request timed out
+
+
+class NoLeaderError(Exception):
+    pass
+
+
+def is_retryable(error):
+    """
+    :return: True if the request failed because of a failover, a node being down or a timeout
+    """
+    if isinstance(error, (NoLeaderError, requests.exceptions.RequestException)):
+        return True
+    response = error.args[0] if error.args else None
+    return getattr(response, 'status_code', None) in RETRY_STATUSES
+
+
+def partition_query(partition):
+    return '' if partition is None else f'&partition={partition}'
+
+
+class MessageClient:
+    """
+    Client of the message queue. The leader is found by probing all the nodes in parallel, cached, and updated from
+    the leader named by every response. A request failing because of a failover is retried with an exponential backoff.
+    The messages produced carry the id of the client and a sequence number, so a retried produce is applied once.
+    A retried consume may lose the messages consumed by the attempt that timed out.
+    :param hosts: addresses of the nodes, as host:port
+    """
+
+    def __init__(self, hosts, client_id=None, timeout=REQUEST_TIMEOUT, retries=RETRIES, backoff=BACKOFF):
+        self.__hosts = list(hosts)
+        self.__client_id = client_id if client_id is not None else str(uuid.uuid4())
+        self.__timeout = timeout
+        self.__retries = retries
+        self.__backoff = backoff
+        self.__leader = None  # cached address of the leader
+        self.__sequence = 0  # sequence number of the latest produce request
+        self.__thread_lock = threading.Lock()
+        self.__executor = ThreadPoolExecutor(max_workers=max(len(self.__hosts), 4))  # probes and async requests
+
+    @property
+    def leader(self):
+        return self.__leader
+
+    @property
+    def client_id(self):
+        return self.__client_id
+
+    def find_leader(self):
+        """
+        Asks all the nodes for their status at once. The first node reporting itself as the leader wins, otherwise the
+        leader named by a follower is used.
+        :return: address of the leader
+        """
+        futures = {self.__executor.submit(rest_client.get, host, 'status', PROBE_TIMEOUT): host for host in
+                   self.__hosts}
+        leader = None
+        hint = None
+        for future in as_completed(futures):
+            host = futures[future]
+            try:
+                status = future.result()
+            except Exception as e:
+                print(f'Node {host} failed with {e}.')
+                continue
+            if status['role'] == 'Leader':
+                leader = host
+                break
+            hint = hint or rest_client.leaders.get(host)
+        leader = leader or hint
+        if leader is None:
+            raise NoLeaderError('No leader found!')
+        self.__leader = leader
+        return leader
+
+    def request(self, method, service_url, data=None, wait=0):
+        """
+        Sends the request to the leader, retrying it when the leader fails or changes.
+        :param wait: seconds the node may hold the request, added to its timeout
+        :return: the response
+        """
+        body = None if data is None else json.dumps(data)
+        backoff = self.__backoff
+        for attempt in range(self.__retries + 1):
+            try:
+                host = self.__leader or self.find_leader()
+                response = rest_client.send(method, host, service_url, body, self.__timeout + wait, None)
+            except Exception as e:
+                if attempt == self.__retries or not is_retryable(e):
+                    raise
+                self.__leader = None
+                time.sleep(backoff)
+                backoff = min(backoff * 2, MAX_BACKOFF)
+                continue
+            self.__leader = rest_client.leaders.get(host) or host
+            return response
+
+    def next_sequence(self):
+        with self.__thread_lock:
+            self.__sequence += 1
+            return self.__sequence
+
+    def create_topic(self, topic, capacity=None, partitions=None):
+        data = {'topic': topic}
+        if capacity is not None:
+            data['capacity'] = capacity
+        if partitions is not None:
+            data['partitions'] = partitions
+        return self.request('PUT', 'topic', data)
+
+    def create_log_topic(self, topic, retention_bytes=None, retention_seconds=None):
+        """
+        Creates a topic in log mode, whose messages are retained by offset and read by consumer groups.
+        """
+        data = {'topic': topic, 'mode': 'log', 'retentionBytes': retention_bytes, 'retentionSeconds': retention_seconds}
+        return self.request('PUT', 'topic', data)
+
+    def get_topics(self):
+        """
+        Lists the topics of every Raft group of the cluster.
+        """
+        return self.request('GET', 'topic')
+
+    def put_message(self, topic, message, key=None, partition=None):
+        """
+        Adds a message. The messages with the same key go to the same partition of a partitioned topic, in order.
+        """
+        data = {'topic': topic, 'message': message, 'clientId': self.__client_id, 'sequence': self.next_sequence()}
+        if key is not None:
+            data['key'] = key
+        if partition is not None:
+            data['partition'] = partition
+        return self.request('PUT', 'message', data)
+
+    def put_messages(self, messages):
+        """
+        Adds several messages in one request.
+        :param messages: list of (topic, message) pairs, or (topic, message, key) triples
+        """
+        data = {
+            'messages': [dict(zip(('topic', 'message', 'key'), message)) for message in messages],
+            'clientId': self.__client_id,
+            'sequence': self.next_sequence()
+        }
+        return self.request('PUT', 'messages', data)
+
+    def get_message(self, topic, wait=0, partition=None):
+        """
+        Consumes a message, from the given partition of a partitioned topic, otherwise from the one the leader picks.
+        """
+        return self.request('GET', f'message/{topic}?wait={wait}{partition_query(partition)}', wait=wait)
 
+    def get_messages(self, topic, max_messages, wait=0, partition=None):
+        """
+        Consumes up to max_messages messages in one request, waiting up to wait seconds for messages to arrive.
+        """
+        return self.request('GET', f'message/{topic}?max={max_messages}&wait={wait}{partition_query(partition)}',
+                            wait=wait)
 
-def find_leader(hosts):
-    for host in hosts:
-        try:
-            response = rest_client.get(host, 'status', timeout=1)
-            if response['role'] == 'Leader':
-                return host
-        except Exception as e:
-            print(f'Node {host} failed with {e}.')
-    raise Exception('No leader found!')
+    def receive(self, topic, max_messages, visibility, wait=0, partition=None):
+        """
+        Consumes up to max_messages messages, hidden from the other consumers for visibility seconds. They are consumed
+        again unless acknowledged with their receipts before.
+        """
+        query = f'max={max_messages}&visibility={visibility}&wait={wait}{partition_query(partition)}'
+        return self.request('GET', f'message/{topic}?{query}', wait=wait)
 
+    def ack(self, topic, receipts):
+        """
+        Deletes the received messages, acknowledging a whole batch in one request.
+        """
+        return self.request('PUT', 'ack', {'topic': topic, 'receipts': list(receipts)})
 
-def create_topic(host, topic):
-    message = {'topic': topic}
-    response = rest_client.put(host, 'topic', message, timeout=1)
-    print(response)
-    return
+    def read(self, topic, group, max_messages, offset=None, wait=0):
+        """
+        Reads up to max_messages messages of a topic in log mode, from the offset, otherwise from the committed offset
+        of the consumer group, without consuming them.
+        """
+        query = {'max': max_messages, 'wait': wait, 'group': group}
+        if offset is not None:
+            query['offset'] = offset
+        return self.request('GET', f'message/{topic}?{urlencode(query)}', wait=wait)
 
+    def commit_offset(self, topic, group, offset):
+        """
+        Commits the offset of the next message the consumer group reads from a topic in log mode.
+        """
+        return self.request('PUT', 'offset', {'topic': topic, 'group': group, 'offset': offset})
 
-def get_topics(host):
-    response = rest_client.get(host, 'topic', timeout=1)
-    print(response)
-    return
+    # async variants, returning a future of the response
+    def put_message_async(self, topic, message, key=None, partition=None):
+        return self.__executor.submit(self.put_message, topic, message, key, partition)
 
+    def put_messages_async(self, messages):
+        return self.__executor.submit(self.put_messages, messages)
 
-def put_message(host, topic, message):
-    message = {'topic': topic, 'message': message}
-    response = rest_client.put(host, 'message', message, timeout=1)
-    print(response)
-    return
+    def get_message_async(self, topic, wait=0, partition=None):
+        return self.__executor.submit(self.get_message, topic, wait, partition)
 
+    def get_messages_async(self, topic, max_messages, wait=0, partition=None):
+        return self.__executor.submit(self.get_messages, topic, max_messages, wait, partition)
 
-def get_message(host, topic):
-    response = rest_client.get(host, 'message/' + topic, timeout=1)
-    print(response)
-    return
+    def close(self):
+        self.__executor.shutdown(wait=False)
+
+
+class ShardedClient:
+    """
+    Client of a message queue whose topics are spread over several Raft groups. Each group is served by its own
+    MessageClient, the requests for a topic are sent to the group owning the topic.
+    :param groups: addresses of the nodes of every Raft group, as host:port, in group order
+    """
+
+    def __init__(self, groups, placement, client_id=None, **kwargs):
+        client_id = client_id if client_id is not None else str(uuid.uuid4())
+        self.__placement = placement
+        # the groups keep separate producer sessions, so the clients can share the id
+        self.__clients = [MessageClient(hosts, client_id, **kwargs) for hosts in groups]
+
+    @classmethod
+    def from_config(cls, config, **kwargs):
+        """
+        Creates a client of the cluster described by a server config.
+        """
+        placement = Placement.json_decode(config)
+        groups = [group_addresses(config, group) for group in range(placement.group_count)]
+        return ShardedClient(groups, placement, **kwargs)
+
+    @property
+    def clients(self):
+        return self.__clients
+
+    def client_of(self, topic):
+        return self.__clients[self.__placement.group_of(topic)]
+
+    def create_topic(self, topic, capacity=None, partitions=None):
+        return self.client_of(topic).create_topic(topic, capacity, partitions)
+
+    def create_log_topic(self, topic, retention_bytes=None, retention_seconds=None):
+        return self.client_of(topic).create_log_topic(topic, retention_bytes, retention_seconds)
+
+    def get_topics(self):
+        """
+        Lists the topics of every group, which the leader of the first group gathers from the other groups.
+        """
+        return self.__clients[0].get_topics()
+
+    def put_message(self, topic, message, key=None, partition=None):
+        return self.client_of(topic).put_message(topic, message, key, partition)
+
+    def put_messages(self, messages):
+        """
+        Adds several messages, sending one request per Raft group at once. The messages of a group are applied
+        together, but a group may fail while the others succeed.
+        :param messages: list of (topic, message) pairs, or (topic, message, key) triples
+        :return: overall success and the result of every message, in order
+        """
+        positions = dict()  # Raft group -> positions of its messages
+        for position, message in enumerate(messages):
+            positions.setdefault(self.__placement.group_of(message[0]), []).append(position)
+        futures = {group: self.__clients[group].put_messages_async([messages[position] for position in group_positions])
+                   for group, group_positions in positions.items()}
+        outputs = [None] * len(messages)
+        for group, future in futures.items():
+            output = future.result()
+            # a request failing as a whole, like a stale retry, has no result per message
+            group_outputs = output.get('results', [output] * len(positions[group]))
+            for position, group_output in zip(positions[group], group_outputs):
+                outputs[position] = group_output
+        return {'success': all(output['success'] for output in outputs), 'results': outputs}
+
+    def get_message(self, topic, wait=0, partition=None):
+        return self.client_of(topic).get_message(topic, wait, partition)
+
+    def get_messages(self, topic, max_messages, wait=0, partition=None):
+        return self.client_of(topic).get_messages(topic, max_messages, wait, partition)
+
+    def receive(self, topic, max_messages, visibility, wait=0, partition=None):
+        return self.client_of(topic).receive(topic, max_messages, visibility, wait, partition)
+
+    def ack(self, topic, receipts):
+        return self.client_of(topic).ack(topic, receipts)
+
+    def read(self, topic, group, max_messages, offset=None, wait=0):
+        return self.client_of(topic).read(topic, group, max_messages, offset, wait)
+
+    def commit_offset(self, topic, group, offset):
+        return self.client_of(topic).commit_offset(topic, group, offset)
+
+    def close(self):
+        for client in self.__clients:
+            client.close()
 
 
 if __name__ == '__main__':
@@ -47,24 +317,27 @@ if __name__ == '__main__':
         hosts = [server['ip'].removeprefix('http://') + ':' + str(server['port']) for server in server_config]
 
     print('hosts: ', hosts)
-    leader = find_leader(hosts)
-    print('leader: ', leader)
-
-    create_topic(leader, 'topic1')
-    create_topic(leader, 'topic2')
-    create_topic(leader, 'topic3')
-    create_topic(leader, 'topic2')
-    create_topic(leader, 'topic1')
-
-    get_topics(leader)
-
-    put_message(leader, 'topic9', 'msg1')
-    put_message(leader, 'topic1', 'msg2')
-    put_message(leader, 'topic2', 'msg3')
-    put_message(leader, 'topic3', 'msg4')
-    put_message(leader, 'topic1', 'msg5')
-
-    get_message(leader, 'topic1')
-    get_message(leader, 'topic2')
-    get_message(leader, 'topic3')
-    get_message(leader, 'topic4')
+    client = MessageClient(hosts)
+    print('leader: ', client.find_leader())
+
+    for topic in ['topic1', 'topic2', 'topic3', 'topic2', 'topic1']:
+        print(client.create_topic(topic))
+
+    print(client.get_topics())
+
+    print(client.put_message('topic9', 'msg1'))
+    print(client.put_message('topic1', 'msg2'))
+    print(client.put_message('topic2', 'msg3'))
+    print(client.put_message('topic3', 'msg4'))
+    print(client.put_message('topic1', 'msg5'))
+    print(client.put_messages([('topic1', 'msg6'), ('topic2', 'msg7'), ('topic9', 'msg8')]))
+    futures = [client.put_message_async('topic3', f'msg{i}') for i in range(9, 12)]
+    print([future.result() for future in futures])
+
+    print(client.get_message('topic1'))
+    print(client.get_message('topic2'))
+    print(client.get_message('topic3'))
+    print(client.get_message('topic4'))
+    print(client.get_messages('topic1', 10))
+    print(client.get_messages('topic3', 10, wait=2))
+    client.close()
@@ -1,196 +1,889 @@
 import argparse
+import base64
 import json
+import os
+import sys
 import threading
 import time
 import uuid
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
 from concurrent.futures import as_completed
 
 from flask import Flask
 from flask import Response
+from flask import redirect
 from flask import request
+from werkzeug.serving import WSGIRequestHandler
 
-from src import raft, rest_client
+from src import async_runtime, raft, rest_client, wire
+from src.group_commit import GroupCommitter
 from src.log import LogEntry, Operation, Command
+from src.placement import Placement, group_addresses
 from src.raft import Role
+from src.result_store import ResultStore
+from src.session_table import SessionTable
+from src.snapshot import Snapshot
+from src.topic_log import TopicLog
+from src.topic_queue import PartitionedTopic
+from src.wal import FsyncPolicy
 
 SCHEDULER_INTERVAL = 0.01  # 10 milliseconds
+MAX_APPEND_ENTRIES = 256  # maximum number of log entries sent in one append request
+MAX_APPEND_BYTES = 1024 * 1024  # maximum encoded size of the entries sent in one append request
+MAX_INFLIGHT_APPENDS = 4  # maximum number of append requests in flight per follower
+APPEND_TIMEOUT = 0.5  # seconds the leader waits for the reply to an append request
+HEARTBEAT_INTERVAL = 0.05  # seconds without new entries after which the leader sends a heartbeat
+APPLY_BATCH_LIMIT = 1000  # maximum number of log entries applied while holding the node lock
+REQUEST_TIMEOUT = 5.0  # seconds a client request waits for its log entry to be applied
+GROUP_COMMIT_WINDOW = 0.001  # seconds the leader collects concurrent requests into one log entry
+GROUP_COMMIT_MAX_SIZE = 128  # maximum number of commands in one log entry
+MAX_LONG_POLL_WAIT = 30.0  # maximum seconds a consumer can wait for messages in one request
+TOPIC_CAPACITY = None  # default maximum number of messages in a topic, None for unbounded
+QUEUE_MODE = 'queue'  # messages are removed when consumed
+LEASE_CHECK_INTERVAL = 0.1  # seconds between two checks of the leader for expired message leases
+RETENTION_CHECK_INTERVAL = 1.0  # seconds between two checks of the leader for messages older than their retention
+LOG_MODE = 'log'  # messages are retained by offset and read by consumer groups
+SNAPSHOT_THRESHOLD_ENTRIES = 100000  # number of applied entries in the log that triggers a snapshot
+SNAPSHOT_THRESHOLD_BYTES = 64 * 1024 * 1024  # size of the log that triggers a snapshot
+SNAPSHOT_CHUNK_SIZE = 1024 * 1024  # size of the snapshot chunks sent to followers
+READ_INDEX = 'read_index'  # reads confirm leadership with a heartbeat quorum
+LEASE = 'lease'  # reads are served without a heartbeat round while the leader lease is valid
+READ_MODE = READ_INDEX
+LEASE_DURATION = 0.8 * raft.MIN_ELECTION_TIMEOUT / 1000  # seconds, leaves a margin for clock drift
+RESULTS_CAPACITY = 100000  # maximum number of command results kept for the waiting requests
+RESULTS_TTL = 60.0  # seconds after which a result nobody read is dropped
+SESSION_CAPACITY = 10000  # maximum number of producers whose latest requests are deduplicated
+SESSION_WINDOW = 64  # number of latest requests of a producer whose results are kept for retries
+FORWARD_REQUESTS = True  # followers forward the client requests to the leader, with False they redirect them
+FORWARD_TIMEOUT = 10  # seconds a follower waits for the leader to serve a forwarded request, besides its wait
+WIRE_FORMAT = wire.BINARY  # format of the Raft RPCs sent to the peers accepting it, JSON otherwise
 app = Flask(__name__)
 node = None
+address = None  # host:port the clients and the other nodes reach this node at
+group = 0  # Raft group this node belongs to
+placement = Placement()  # assigns the topics to the Raft groups
+group_nodes = dict()  # Raft group -> address of the node of that group on this host
 topic_queues = dict()
-results = dict()
+sessions = SessionTable(SESSION_CAPACITY, SESSION_WINDOW)  # producer sessions, part of the state machine
+results = ResultStore(RESULTS_CAPACITY, RESULTS_TTL)  # results of the commands waited for on this node
+incoming_snapshot = None  # snapshot chunks received from the leader so far
+rpc_executor = ThreadPoolExecutor(max_workers=16)  # sends the vote requests and the heartbeats confirming reads
+replicators = dict()  # follower -> (term, replication thread)
+replication_events = dict()  # follower -> event waking up its replication loop
+commit_lock = threading.Lock()
+commit_event = threading.Event()  # set when the commit index advances, wakes up the background loop to apply
+next_lease_check = 0  # time the leader next checks for expired message leases
+next_retention_check = 0  # time the leader next checks for messages older than their retention
+
+
+class NotLeaderError(Exception):
+    pass
+
+
+LOCAL_LISTING_ARG = 'local'  # query parameter of GET /topic listing the topics of the receiving Raft group only
+TOPIC_ENDPOINTS = ('put_topic', 'peek_topic', 'put_message', 'put_messages', 'get_message', 'commit_offset',
+                   'ack_messages')  # routed by topic
+
+
+@app.before_request
+def group_check():
+    if placement.group_count == 1 or request.endpoint not in TOPIC_ENDPOINTS:
+        return None
+    try:
+        owner = request_group(request.view_args.get('topic'), request.get_data(), request.endpoint == 'put_messages')
+    except (ValueError, KeyError) as e:
+        return error_response(f'Raft group of the request could not be found: {e}', 400)
+    if owner == group:
+        return None
+    # the node of the other group on this host forwards the request to its own leader if needed
+    if not FORWARD_REQUESTS:
+        return redirect(f'http://{group_nodes[owner]}{request.full_path.rstrip("?")}', 307)
+    return forward_request(group_nodes[owner], {}, 'Raft group could not be reached.')
 
 
 @app.before_request
 def leader_check():
-    if not node.is_leader() and request.endpoint not in ('get_status', 'vote_leader', 'sync_logs'):
+    if node.is_leader() or request.endpoint in (
+            'get_status', 'get_metrics', 'vote_leader', 'sync_logs', 'install_snapshot'):
+        return None
+    # a forwarded request is not forwarded again, the leader it was forwarded to has stepped down
+    if node.leader_address is None or rest_client.FORWARDED_HEADER in request.headers:
         return "Only leader node can serve requests.", 403
+    if not FORWARD_REQUESTS:
+        return redirect(f'http://{node.leader_address}{request.full_path.rstrip("?")}', 307)
+    return forward_request(node.leader_address, {rest_client.FORWARDED_HEADER: address},
+                           'Leader could not be reached.')
+
+
+@app.after_request
+def advertise_wire_formats(response):
+    response.headers['Accept-Post'] = wire.ACCEPT_POST
+    leader = known_leader()
+    if leader is not None:
+        response.headers[rest_client.LEADER_HEADER] = leader
+    return response
+
+
+def known_leader():
+    """
+    :return: address of the leader of the current term, None if it is not known yet
+    """
+    return address if node.is_leader() else node.leader_address
+
+
+def request_group(topic, body, batch):
+    """
+    Finds the Raft group owning the topic of a client request, given by its path, otherwise by its body.
+    :param batch: True if the body holds a list of messages, which must all belong to the same group
+    :return: the Raft group
+    """
+    if topic is not None:
+        return placement.group_of(topic)
+    data = json.loads(body.decode('utf-8'))
+    if not batch:
+        return placement.group_of(data['topic'])
+    messages = data['messages'] if isinstance(data, dict) else data
+    groups = {placement.group_of(message['topic']) for message in messages}
+    if len(groups) > 1:
+        raise ValueError('messages of a batch must belong to the topics of a single Raft group')
+    return groups.pop() if groups else group
 
 
-def run_background_tasks():
+def forward_request(target, headers, unreachable_error):
     """
-    1. if node is leader, it needs to send heartbeats and log entries for syncing followers' logs with its own.
+    Forwards the client request to another node, over the pooled connections to it.
+    :param headers: headers added to the forwarded request
+    :return: the response of the node
+    """
+    timeout = FORWARD_TIMEOUT + request.args.get('wait', 0, type=float)
+    headers = dict(headers, **{'Content-Type': request.content_type})
+    try:
+        response = rest_client.forward(request.method, target, request.full_path.rstrip('?'), request.get_data(),
+                                       headers, timeout)
+    except Exception as e:
+        print(f'Forwarding {request.method} {request.path} to {target} failed with: {e}.')
+        return error_response(unreachable_error, 503)
+    return Response(response.content, status=response.status_code,
+                    content_type=response.headers.get('Content-Type', 'application/json'))
+
+
+def run_background_tasks(stop_event=None):
+    """
+    1. if node is leader, it runs a replication loop per follower sending heartbeats and log entries for syncing
+       followers' logs with its own.
     2. if node is follower and didn't receive any heartbeat with the timeout period, it starts leader election process.
-    3. Apply committed logs to the state machines
-    4. Leaders need to increase it's committed index once more than half of the nodes replicate a log entry.
+    3. Apply committed logs to the state machines, as soon as the commit index advances instead of on the next tick.
+    4. Leaders increase their committed index as the followers acknowledge entries, and here once their own batch
+       fsync makes more entries durable.
+    5. Leaders return the messages whose lease expired to their queues, and drop the messages of the topics in log
+       mode older than their retention.
+    Runs until stop_event is set, forever if no event is given.
     """
-    while True:
+    while stop_event is None or not stop_event.is_set():
+        commit_event.clear()  # the entries committed from now on are applied by this round or wake up the next one
         if node.is_leader():
-            append_entries()
-            update_committed_index()
+            start_replicators()
 
         if node.check_heartbeat_timeout():
             initiate_leader_election()
 
         apply_state_machine()
-        time.sleep(SCHEDULER_INTERVAL)
+        take_snapshot_if_due()
+        if node.logs.sync_if_due() and node.is_leader():
+            update_committed_index()
+        for expiry in (lease_expiry_command(), retention_command()):
+            if expiry is None:
+                continue
+            try:
+                committer.submit(expiry)
+            except NotLeaderError:
+                pass  # the new leader checks the deadlines again
+        results.evict()
+        commit_event.wait(SCHEDULER_INTERVAL)
     return
 
 
 def apply_put_topic(command):
-    topic = command.message
+    data = json.loads(command.message)
+    topic = data['topic']
     id = command.id
+    partitions = data.get('partitions', 1)
+    mode = data.get('mode', QUEUE_MODE)
     if topic in topic_queues.keys():
         results[id] = {'success': False}
-    else:
-        topic_queues[topic] = []
+    elif not isinstance(partitions, int) or partitions < 1:
+        results[id] = {'success': False, 'error': 'Number of partitions must be a positive integer.'}
+    elif mode == LOG_MODE and partitions != 1:
+        results[id] = {'success': False, 'error': 'Topics in log mode have a single partition.'}
+    elif mode == LOG_MODE:
+        topic_queues[topic] = TopicLog(data['capacity'], data.get('retentionBytes'), data.get('retentionSeconds'))
         results[id] = {'success': True}
+    elif mode == QUEUE_MODE:
+        topic_queues[topic] = PartitionedTopic(partitions, data['capacity'])
+        results[id] = {'success': True}
+    else:
+        results[id] = {'success': False, 'error': f'Unknown topic mode: {mode}.'}
     return
 
 
 def apply_get_topic(command):
-    results[command.id] = {'success': True, 'topics': list(topic_queues.keys())}
+    results[command.id] = list_topics()
     return
 
 
+def list_topics():
+    """
+    Returns the topics, and the number of partitions of the topics having more than one.
+    """
+    output = {'success': True, 'topics': list(topic_queues.keys())}
+    partitions = {topic: queue.partition_count for topic, queue in list(topic_queues.items()) if
+                  queue.partition_count > 1}
+    if partitions:
+        output['partitions'] = partitions
+    return output
+
+
+def merge_topic_listings(outputs):
+    """
+    Merges the topic lists of several Raft groups, as returned by list_topics.
+    """
+    output = {'success': all(output['success'] for output in outputs),
+              'topics': [topic for output in outputs for topic in output.get('topics', [])]}
+    partitions = {topic: count for output in outputs for topic, count in output.get('partitions', {}).items()}
+    if partitions:
+        output['partitions'] = partitions
+    return output
+
+
+def list_group_topics(other_group, timeout):
+    """
+    Lists the topics of another Raft group through its node on this host, which forwards the request to its leader.
+    """
+    return rest_client.send('GET', group_nodes[other_group], f'topic?{LOCAL_LISTING_ARG}', None, timeout, None)
+
+
+def has_partition(queue, partition):
+    return partition is None or (isinstance(partition, int) and 0 <= partition < queue.partition_count)
+
+
+def push_message(topic, message, key=None, partition=None, timestamp=0):
+    """
+    Adds the message to the end of a partition of the topic: the given one, otherwise the one of the key, otherwise
+    the next one. A topic in log mode retains the message at the next offset.
+    :param timestamp: time the leader received the message, drives the retention of the topics in log mode
+    :return: result of the operation, with the partition for a partitioned topic or the offset for a log
+    """
+    if topic not in topic_queues.keys():
+        return {'success': False}
+    queue = topic_queues[topic]
+    if not has_partition(queue, partition):
+        return {'success': False, 'error': 'Partition does not exist.'}
+    if isinstance(queue, TopicLog):
+        offset = queue.append(message, timestamp)
+        return {'success': False, 'error': 'Topic is full.'} if offset is None else {'success': True, 'offset': offset}
+    partition = queue.push(message, key, partition)
+    if partition is None:
+        return {'success': False, 'error': 'Topic is full.'}
+    return {'success': True} if queue.partition_count == 1 else {'success': True, 'partition': partition}
+
+
+def pop_messages(topic, max_messages, partition=None, lease=None):
+    """
+    Removes the first message, or up to max_messages messages, of a partition of the topic: the given one, otherwise
+    the next one holding messages. The messages of a request all come from one partition, in order.
+    :param lease: (receipt prefix, deadline) to keep the messages in flight until they are acknowledged or the
+                  deadline passes, None to delete them
+    :return: result of the operation, with the partition for a partitioned topic and the receipts of leased messages
+    """
+    queue = topic_queues.get(topic)
+    empty = {'success': False} if max_messages is None else {'success': False, 'messages': []}
+    if queue is None:
+        return empty
+    if isinstance(queue, TopicLog):
+        return dict(empty, error='Topic is in log mode, it is read by offset.')
+    if not has_partition(queue, partition):
+        return dict(empty, error='Partition does not exist.')
+    partition = queue.assign(partition)
+    if partition is None:
+        return empty
+    if lease is not None:
+        messages, receipts = queue.pop_leased(1 if max_messages is None else max_messages, partition, *lease)
+        if max_messages is None:
+            output = {'success': True, 'message': messages[0], 'receipt': receipts[0]}
+        else:
+            output = {'success': bool(messages), 'messages': messages, 'receipts': receipts}
+    elif max_messages is None:
+        output = {'success': True, 'message': queue.pop(partition)}
+    else:
+        messages = queue.pop_many(max_messages, partition)
+        output = {'success': bool(messages), 'messages': messages}
+    if queue.partition_count > 1:
+        output['partition'] = partition
+    return output
+
+
+def apply_once(data, apply):
+    """
+    Applies a producer request unless the session table shows it was applied already. Requests without a `clientId`
+    are always applied.
+    :return: result of the request, the recorded one for a retry
+    """
+    client_id = data.get('clientId')
+    if client_id is None:
+        return apply()
+    sequence = data['sequence']
+    output = sessions.lookup(client_id, sequence)
+    if output is None:
+        output = apply()
+        sessions.record(client_id, sequence, output)
+    return output
+
+
 def apply_put_message(command):
     data = json.loads(command.message)
-    topic = data['topic']
-    message = data['message']
-    id = command.id
-    if topic not in topic_queues.keys():
-        results[id] = {'success': False}
-        return
-    topic_queues[topic].append(message)
-    results[id] = {'success': True}
+    results[command.id] = apply_once(data, lambda: push_message(data['topic'], data['message'], data.get('key'),
+                                                                data.get('partition'), data.get('timestamp', 0)))
+    return
+
+
+def apply_put_messages(command):
+    data = json.loads(command.message)
+    if isinstance(data, list):
+        data = {'messages': data}
+
+    def push_messages():
+        outputs = [push_message(message['topic'], message['message'], message.get('key'), message.get('partition'),
+                                data.get('timestamp', 0)) for message in data['messages']]
+        return {'success': all(output['success'] for output in outputs), 'results': outputs}
+
+    results[command.id] = apply_once(data, push_messages)
     return
 
 
 def apply_get_message(command):
-    topic = command.message
-    id = command.id
-    if topic not in topic_queues.keys() or not topic_queues[topic]:
-        results[id] = {'success': False}
+    results[command.id] = pop_messages(command.message, None)
+    return
+
+
+def apply_get_messages(command):
+    data = json.loads(command.message)
+    lease = None
+    if data.get('visibility') is not None:
+        # the leases which expired by the time of the request are consumed again first
+        expire_leases(data['timestamp'], data['topic'])
+        lease = (command.id, data['timestamp'] + data['visibility'])
+    results[command.id] = pop_messages(data['topic'], data['max'], data.get('partition'), lease)
+    return
+
+
+def expire_leases(timestamp, topic=None):
+    """
+    Returns the messages whose lease expired at the time to their queues, of the topic or of all the topics.
+    :return: number of messages returned
+    """
+    queues = [topic_queues.get(topic)] if topic is not None else list(topic_queues.values())
+    return sum(queue.expire(timestamp) for queue in queues if isinstance(queue, PartitionedTopic))
+
+
+def apply_ack_messages(command):
+    data = json.loads(command.message)
+    queue = topic_queues.get(data['topic'])
+    if not isinstance(queue, PartitionedTopic):
+        results[command.id] = {'success': False, 'acked': 0}
         return
-    results[id] = {'success': True, 'message': topic_queues[topic].pop(0)}
+    acked = sum(queue.ack(receipt) for receipt in data['receipts'])
+    results[command.id] = {'success': acked == len(data['receipts']), 'acked': acked}
+    return
+
+
+def apply_expire_leases(command):
+    data = json.loads(command.message)
+    results[command.id] = {'success': True, 'expired': expire_leases(data['timestamp'])}
+    return
+
+
+def apply_retain_messages(command):
+    data = json.loads(command.message)
+    dropped = sum(queue.retain(data['timestamp']) for queue in list(topic_queues.values()) if
+                  isinstance(queue, TopicLog))
+    results[command.id] = {'success': True, 'dropped': dropped}
+    return
+
+
+def apply_commit_offset(command):
+    data = json.loads(command.message)
+    queue = topic_queues.get(data['topic'])
+    if not isinstance(queue, TopicLog):
+        results[command.id] = {'success': False, 'error': 'Topic does not exist or is not in log mode.'}
+    elif not queue.commit(data['group'], data['offset']):
+        results[command.id] = {'success': False, 'error': 'Offset is past the end of the topic.'}
+    else:
+        results[command.id] = {'success': True}
+    return
+
+
+def apply_command(command):
+    """
+    Applies a single command to the state machine and records its result.
+    :param command:
+    :return:
+    """
+    try:
+        if command.operation is Operation.PUT_TOPIC:
+            apply_put_topic(command)
+        elif command.operation is Operation.GET_TOPICS:
+            apply_get_topic(command)
+        elif command.operation is Operation.PUT_MESSAGE:
+            apply_put_message(command)
+        elif command.operation is Operation.GET_MESSAGE:
+            apply_get_message(command)
+        elif command.operation is Operation.PUT_MESSAGES:
+            apply_put_messages(command)
+        elif command.operation is Operation.GET_MESSAGES:
+            apply_get_messages(command)
+        elif command.operation is Operation.COMMIT_OFFSET:
+            apply_commit_offset(command)
+        elif command.operation is Operation.ACK_MESSAGES:
+            apply_ack_messages(command)
+        elif command.operation is Operation.EXPIRE_LEASES:
+            apply_expire_leases(command)
+        elif command.operation is Operation.RETAIN_MESSAGES:
+            apply_retain_messages(command)
+        elif command.operation is Operation.NOOP:
+            pass
+        elif command.operation is Operation.BATCH:
+            for batched_command in command.commands:
+                apply_command(batched_command)
+        else:
+            raise Exception(f'Unknown command: {command.operation}.')
+    except Exception as e:
+        results[command.id] = {'error_stack': str(e)}
+        print(f'Error occurred while applying {command.operation}. Error: {e}.')
     return
 
 
 def apply_state_machine():
     """
-    Apply commands to the state machine i.e. get/put messages from/into queue
+    Apply commands to the state machine i.e. get/put messages from/into queue.
+    Applies every committed entry, releasing the lock after each batch of APPLY_BATCH_LIMIT entries.
+    :return:
+    """
+    while node.committed_index > node.last_applied:
+        with node.thread_lock:
+            end_index = min(node.committed_index, node.last_applied + APPLY_BATCH_LIMIT)
+            while node.last_applied < end_index:
+                log_entry = node.logs.entries[node.last_applied + 1]
+                if log_entry.command:
+                    apply_command(log_entry.command)
+                node.last_applied += 1
+            node.apply_condition.notify_all()
+    return
+
+
+def serialize_state():
+    """
+    Serializes the state machine i.e. the topic queues.
+    :return: bytes
+    """
+    state = {
+        'topics': {topic: queue.json_encode() for topic, queue in topic_queues.items()},
+        'sessions': sessions.json_encode()
+    }
+    return json.dumps(state).encode('utf-8')
+
+
+def restore_state(data):
+    """
+    Replaces the state machine with the one serialized in data.
+    :return:
+    """
+    global topic_queues, sessions
+    state = json.loads(data.decode('utf-8'))
+    topic_queues = {topic: TopicLog.json_decode(queue) if queue.get('mode') == LOG_MODE else
+                    PartitionedTopic.json_decode(queue) for topic, queue in state['topics'].items()}
+    sessions = SessionTable.json_decode(state.get('sessions', []), SESSION_CAPACITY, SESSION_WINDOW)
+    return
+
+
+def take_snapshot_if_due():
+    """
+    Takes a snapshot of the state machine and compacts the log once the log grows past SNAPSHOT_THRESHOLD_ENTRIES
+    applied entries or SNAPSHOT_THRESHOLD_BYTES of applied entries. The entries not applied yet are left out, they
+    cannot be compacted.
     :return:
     """
+    applied_entries = node.last_applied - node.logs.snapshot_index
+    if applied_entries <= 0 or (applied_entries < SNAPSHOT_THRESHOLD_ENTRIES and (
+            node.logs.size_bytes < SNAPSHOT_THRESHOLD_BYTES or
+            node.logs.size_bytes_until(node.last_applied) < SNAPSHOT_THRESHOLD_BYTES)):
+        return
     with node.thread_lock:
-        if node.committed_index > node.last_applied:
-            try:
-                next_idx = node.last_applied + 1
-                log_entry = node.logs.entries[next_idx]
-                command = log_entry.command
-                if command.operation is Operation.PUT_TOPIC:
-                    apply_put_topic(command)
-                elif command.operation is Operation.GET_TOPICS:
-                    apply_get_topic(command)
-                elif command.operation is Operation.PUT_MESSAGE:
-                    apply_put_message(command)
-                elif command.operation is Operation.GET_MESSAGE:
-                    apply_get_message(command)
-                else:
-                    raise Exception(f'Unknown command: {command.operation}.')
-            except Exception as e:
-                results[command.id] = {'error_stack': str(e)}
-                print(f'Error occurred while applying {command.operation}. Error: {e}.')
-            node.last_applied += 1
+        index = node.last_applied
+        node.snapshot = Snapshot(index, node.logs.term_at(index), serialize_state())
+    print(f'Took {node.snapshot}.')
     return
 
 
+def send_snapshot(server, snapshot):
+    """
+    Streams the snapshot to a follower in chunks of SNAPSHOT_CHUNK_SIZE.
+    :return: response to the last chunk sent
+    """
+    offset = 0
+    while True:
+        data = build_snapshot_request(snapshot, offset)
+        response = rest_client.post(server, 'snapshot/install', data, timeout=1)
+        if response['term'] > node.term or not response['success'] or data['done']:
+            return response
+        offset += SNAPSHOT_CHUNK_SIZE
+
+
+def build_snapshot_request(snapshot, offset):
+    """
+    Builds the install snapshot request carrying the chunk of the snapshot starting at offset.
+    """
+    chunk = snapshot.chunk(offset, SNAPSHOT_CHUNK_SIZE)
+    return {
+        'term': node.term,
+        'leaderId': node.index,
+        'leaderAddress': address,
+        'lastIncludedIndex': snapshot.last_index,
+        'lastIncludedTerm': snapshot.last_term,
+        'offset': offset,
+        'data': base64.b64encode(chunk).decode('ascii'),
+        'done': offset + len(chunk) >= snapshot.size
+    }
+
+
+def build_append_request(start_index):
+    """
+    Builds an append request carrying the log entries starting at start_index. Entries are added until either
+    MAX_APPEND_ENTRIES or MAX_APPEND_BYTES is reached, but at least one entry is sent if there is any.
+    :param start_index: index of the first entry to send
+    :return: request data and number of entries in it
+    """
+    data = {
+        'term': node.term,
+        'leaderId': node.index,
+        'leaderAddress': address,
+        'prevLogTerm': -1,
+        'prevLogIndex': -1,
+        'entries': [],
+        'leaderCommit': node.committed_index
+    }
+    if start_index > 0:
+        prev_index = start_index - 1
+        data['prevLogTerm'] = node.logs.term_at(prev_index)
+        data['prevLogIndex'] = prev_index
+    batch_bytes = 0
+    end_index = min(node.logs.log_size, start_index + MAX_APPEND_ENTRIES)
+    for index in range(start_index, end_index):
+        batch_bytes += node.logs.size_at(index)
+        if data['entries'] and batch_bytes > MAX_APPEND_BYTES:
+            break
+        data['entries'].append(node.logs.entries[index])
+    return data, len(data['entries'])
+
+
+def post_rpc(server, service_url, data, timeout):
+    """
+    Sends a Raft RPC to a peer, in the binary wire format once the peer advertised that it accepts it.
+    :return: response of the peer
+    """
+    content_type = wire.BINARY if WIRE_FORMAT == wire.BINARY and wire.BINARY in rest_client.accepted_types.get(
+        server, ()) else wire.JSON
+    body, content_type = wire.encode_request(service_url, data, content_type)
+    return rest_client.send('POST', server, service_url, body, timeout, None, content_type)
+
+
+def replicate_to(server, executor):
+    """
+    Runs one replication round to a follower: sends the snapshot if the entries it needs were compacted, otherwise
+    up to MAX_INFLIGHT_APPENDS consecutive batches without waiting for the previous ones, and records the replies.
+    :param executor: executor sending the requests to the follower
+    :return: True if the follower is still missing entries and replied, False to wait before the next round
+    """
+    term = node.term
+    sent_time = time.monotonic()
+    start_index = node.next_index[server]
+    requests = []
+    if start_index < node.logs.first_index:  # the entries were compacted, send the snapshot instead
+        snapshot = node.snapshot
+        requests.append((executor.submit(send_snapshot, server, snapshot), snapshot.last_index, 0))
+    else:
+        for _ in range(MAX_INFLIGHT_APPENDS):
+            data, count = build_append_request(start_index)
+            promise = executor.submit(post_rpc, server, 'logs/append', data, APPEND_TIMEOUT)
+            requests.append((promise, data['prevLogIndex'], count))
+            start_index += count
+            if count == 0 or start_index >= node.logs.log_size:
+                break
+    replied = False
+    for promise, prev_index, count in requests:
+        try:
+            response = promise.result()
+        except Exception as e:
+            print(f'Sending heartbeats to {server} failed with: {e}.')
+            continue
+        replied = True
+        if not handle_append_response(server, term, sent_time, prev_index, count, response):
+            return False
+    return replied and node.next_index[server] < node.logs.log_size  # retry an unreachable follower later
+
+
+def handle_append_response(server, term, sent_time, prev_index, count, response):
+    """
+    Records the reply of a follower to an append request of the given term, carrying count entries after prev_index.
+    :return: False if the node is no longer the leader of that term
+    """
+    if response['term'] > node.term:  # received response from node with higher term
+        update_term_return_to_follower(response['term'])
+        return False
+    if node.term != term:
+        return False
+    record_ack(server, sent_time)
+    if response['success']:
+        last_index = prev_index + count
+        node.next_index[server] = max(node.next_index[server], last_index + 1)
+        if last_index > node.match_index.get(server, -1):
+            node.match_index[server] = last_index
+            update_committed_index()
+    elif prev_index > node.match_index.get(server, -1):
+        next_index = min(node.next_index[server], prev_index, conflict_next_index(prev_index, response))
+        node.next_index[server] = max(next_index, node.match_index.get(server, -1) + 1)
+    return True
+
+
+def conflict_next_index(prev_index, response):
+    """
+    Picks the next index to send to a follower which rejected an append request, from the conflict it reported:
+    after the last entry of the conflicting term in the leader's log, or the first index of that term in the
+    follower's log if the leader has no entry of that term.
+    :return: the next index, prev_index for a follower which reported no conflict
+    """
+    conflict_index = response.get('conflictIndex')
+    if conflict_index is None:
+        return prev_index
+    conflict_term = response['conflictTerm']
+    if conflict_term == -1:
+        return conflict_index
+    last_index = node.logs.last_index_of_term(conflict_term, prev_index)
+    return conflict_index if last_index is None else last_index + 1
+
+
 def append_entries():
     """
-    Send requests for appending log entries to follower nodes. Ignore failures.
+    Runs one replication round to every follower in parallel and waits for all of them. Ignore failures.
+    The leader replicates through the per follower replication loops, this round is meant for tests and tools.
     :return:
     """
     print(f'Sending append messages to the follower nodes.')
-    with ThreadPoolExecutor(max_workers=5) as executor:
-        futures = {}
+    with ThreadPoolExecutor(max_workers=max(len(node.sibling_nodes), 1)) as executor:
         for sibling_server in node.sibling_nodes:
-            data = {
-                'term': node.term,
-                'leaderId': node.index,
-                'prevLogTerm': -1,
-                'prevLogIndex': -1,
-                'entry': None,
-                'leaderCommit': node.committed_index
-            }
-            curr_index = node.next_index[sibling_server]
-            if curr_index > 0:
-                prev_index = curr_index - 1
-                data['prevLogTerm'] = node.logs.entries[prev_index].term
-                data['prevLogIndex'] = prev_index
-            if curr_index < node.logs.log_size:
-                data['entry'] = node.logs.entries[curr_index].json_encode()
-            promise = executor.submit(rest_client.post, sibling_server, 'logs/append', data, timeout=0.1)
-            futures[promise] = sibling_server
-        for promise in as_completed(futures):
+            executor.submit(replicate_to, sibling_server, rpc_executor)
+    return
+
+
+def run_replicator(server, term):
+    """
+    Replication loop of one follower, runs while the node is the leader of the given term. Entries are sent as soon
+    as they are appended, a heartbeat is sent after HEARTBEAT_INTERVAL without any. The loop has its own requests in
+    flight, so a slow follower does not delay the others.
+    """
+    print(f'Starting replication to {server} for term {term}.')
+    wakeup = replication_events[server]
+    with ThreadPoolExecutor(max_workers=MAX_INFLIGHT_APPENDS) as executor:
+        while node.is_leader() and node.term == term:
+            wakeup.clear()
             try:
-                response = promise.result()
-                server = futures[promise]
-                curr_index = node.next_index[server]
-                if response['term'] > node.term:  # received response from node with higher term
-                    update_term_return_to_follower(response['term'])
-                    break
-                if response['success']:
-                    node.match_index[server] = curr_index - 1
-                    if curr_index < node.logs.log_size:
-                        node.next_index[server] += 1
-                else:
-                    node.next_index[server] -= 1
+                lagging = replicate_to(server, executor)
             except Exception as e:
-                print(f'Sending heartbeats to {sibling_server} failed with: {e}.')
+                print(f'Replication to {server} failed with: {e}.')
+                lagging = False
+            if not lagging:
+                wakeup.wait(HEARTBEAT_INTERVAL)
+    print(f'Stopped replication to {server} for term {term}.')
     return
 
 
-def update_committed_index():
+def start_replicators():
     """
-    Update committed index.
+    Starts a replication loop for every follower which does not have a running one for the current term.
     :return:
     """
-    if node.logs.log_size - 1 == node.committed_index:
-        return
-    value = node.committed_index + 1
-    while value < node.logs.log_size:
-        count = 1
-        for val in node.match_index.values():
-            if val >= value:
-                count += 1
-        if count <= (node.total_nodes / 2):
-            return
-        if node.logs.entries[value].term == node.term:
-            node.committed_index = value
-        value += 1
+    for server in node.sibling_nodes:
+        term, thread = replicators.get(server, (None, None))
+        if term == node.term and thread.is_alive():
+            continue
+        replication_events.setdefault(server, threading.Event())
+        thread = threading.Thread(target=run_replicator, args=(server, node.term), daemon=True)
+        replicators[server] = (node.term, thread)
+        thread.start()
+    return
+
+
+def notify_replicators():
+    """
+    Wakes up the replication loops, either to send new entries or to stop after losing the leadership.
+    :return:
+    """
+    for event in list(replication_events.values()):
+        event.set()
     return
 
 
+def record_ack(server, sent_time):
+    """
+    Records that the follower acknowledged the leadership of this node with a request sent at sent_time.
+    """
+    node.ack_times[server] = max(node.ack_times.get(server, 0), sent_time)
+    return
+
+
+def leader_lease_valid():
+    """
+    Checks the leader lease: a quorum acknowledged a request sent less than LEASE_DURATION ago, so no other leader
+    can have been elected since.
+    :return: boolean
+    """
+    required_acks = node.total_nodes // 2
+    if required_acks == 0:
+        return True
+    ack_times = sorted((node.ack_times.get(server, 0) for server in node.sibling_nodes), reverse=True)
+    return time.monotonic() < ack_times[required_acks - 1] + LEASE_DURATION
+
+
+def confirm_leadership(timeout):
+    """
+    Sends a heartbeat to every follower and waits for a quorum to acknowledge this node as the leader.
+    :return: True if a quorum acknowledged
+    """
+    acks = 1
+    if acks > node.total_nodes / 2:
+        return True
+    futures = {}
+    sent_time = time.monotonic()
+    for server in node.sibling_nodes:
+        data = build_heartbeat(server)
+        promise = rpc_executor.submit(post_rpc, server, 'logs/append', data, timeout)
+        futures[promise] = server
+    try:
+        for promise in as_completed(futures, timeout=timeout):
+            try:
+                response = promise.result()
+            except Exception as e:
+                print(f'Heartbeat to {futures[promise]} failed with: {e}.')
+                continue
+            if response['term'] > node.term:
+                update_term_return_to_follower(response['term'])
+                return False
+            record_ack(futures[promise], sent_time)
+            acks += 1
+            if acks > node.total_nodes / 2:
+                return True
+    except FuturesTimeoutError:  # not the builtin TimeoutError before Python 3.11
+        pass
+    return False
+
+
+def build_heartbeat(server):
+    """
+    Builds an append request without entries, checking only that the follower still accepts this node as the leader.
+    """
+    data = {
+        'term': node.term,
+        'leaderId': node.index,
+        'leaderAddress': address,
+        'prevLogTerm': -1,
+        'prevLogIndex': -1,
+        'entries': [],
+        'leaderCommit': -1
+    }
+    # a follower lagging behind the snapshot is checked against the last compacted entry, whose term is kept
+    prev_index = max(node.next_index[server] - 1, node.logs.snapshot_index)
+    if prev_index >= 0:
+        data['prevLogTerm'] = node.logs.term_at(prev_index)
+        data['prevLogIndex'] = prev_index
+    return data
+
+
+def linearizable_read(timeout):
+    """
+    Raft ReadIndex: waits until the state machine reflects every entry committed before the read started, on a node
+    confirmed to still be the leader. With the lease read mode, a valid leader lease replaces the heartbeat round.
+    :return: True if the local state can be read
+    """
+    deadline = time.time() + timeout
+    # the commit index is only known once an entry of the current term is committed
+    with node.apply_condition:
+        if not node.apply_condition.wait_for(
+                lambda: not node.is_leader() or (
+                        node.term_start_index is not None and node.last_applied >= node.term_start_index),
+                timeout=timeout):
+            return False
+    if not node.is_leader():
+        return False
+    read_index = node.committed_index
+    if not (READ_MODE == LEASE and leader_lease_valid()) and not confirm_leadership(deadline - time.time()):
+        return False
+    with node.apply_condition:
+        return node.apply_condition.wait_for(lambda: node.last_applied >= read_index,
+                                             timeout=max(deadline - time.time(), 0))
+
+
+def update_committed_index():
+    """
+    Commits up to the highest index stored by a majority of the nodes, the quorum-th largest match index counting the
+    entries the leader stored durably. It is committed only if its entry is of the current term, committing the
+    older entries before it. Called whenever a match index or the durable index of the leader advances. The followers
+    are woken up right away to learn the new commit index.
+    :return: True if the commit index advanced
+    """
+    with commit_lock:
+        if not node.is_leader():
+            return False
+        match_indexes = sorted([node.logs.durable_index] + list(node.match_index.values()), reverse=True)
+        quorum_index = match_indexes[node.total_nodes // 2]
+        if quorum_index <= node.committed_index or node.logs.term_at(quorum_index) != node.term:
+            return False
+        node.committed_index = quorum_index
+    commit_event.set()
+    notify_replicators()
+    return True
+
+
 def update_term_return_to_follower(term):
     """
     Return to follower state and update term.
     :param term:
     :return:
     """
-    node.reset_last_heartbeat()
-    node.term = term
-    if node.role != Role.FOLLOWER:
-        node.transition_to_new_role(Role.FOLLOWER)
-        print(f'Received response from a higher term node. Returning to follower state.')
+    with node.thread_lock:  # the leader appends its entries under the same lock, never with a newer term
+        node.reset_last_heartbeat()
+        node.term = term
+        if node.role != Role.FOLLOWER:
+            node.transition_to_new_role(Role.FOLLOWER)
+            print(f'Received response from a higher term node. Returning to follower state.')
+            node.apply_condition.notify_all()  # wake up the waiting requests, their entries may never be committed
+            notify_replicators()
+    return
+
+
+def become_leader():
+    """
+    Promotes the node to leader and appends a no-op entry, whose commit tells the commit index of the new term.
+    Nothing is done if a higher term turned the candidate back into a follower meanwhile.
+    :return:
+    """
+    with node.thread_lock:
+        if node.role != Role.CANDIDATE:
+            return
+        node.transition_to_new_role(raft.Role.LEADER)
+        node.prepare_for_leadership()
+        node.term_start_index = node.logs.append(LogEntry(node.term, Command(get_uuid(), Operation.NOOP)))
+    notify_replicators()
+    update_committed_index()
+    print(f'Became leader of term {node.term}.')
     return
 
 
@@ -205,120 +898,419 @@ def initiate_leader_election():
     # change to candidate role
     node.transition_to_new_role(raft.Role.CANDIDATE)
     node.increment_term()
-    node.voted_for = None
-
-    with ThreadPoolExecutor(max_workers=5) as executor:
-        futures = {}
-        data = {
-            'term': node.term,
-            'candidateId': node.index,
-            'lastLogTerm': -1 if not node.logs.entries else node.logs.entries[-1].term,
-            'lastLogIndex': node.logs.log_size - 1
-        }
-        for sibling_server in node.sibling_nodes:
-            future = executor.submit(
-                rest_client.post, sibling_server, 'election/vote', data, timeout=0.01)
-            futures[future] = sibling_server
-
-        while futures and not node.check_heartbeat_timeout():
-            retries = {}
-            for future in as_completed(futures):
-                try:
-                    response = future.result()
-                    if response['vote']:
-                        votes += 1
-                    elif response['term'] > node.term:
-                        update_term_return_to_follower(response['term'])
-                        return
-                except Exception as e:
-                    print(f'Vote call to {sibling_server} failed with: {e}.')
-                    retry = executor.submit(rest_client.post, futures[future], 'election/vote', data)
-                    retries[retry] = sibling_server
-                print(f'Received {votes}/{node.total_nodes} votes.')
-                if votes > node.total_nodes / 2 and node.role == Role.CANDIDATE:
-                    node.transition_to_new_role(raft.Role.LEADER)
-                    for sibling_server in node.sibling_nodes:
-                        node.next_index[sibling_server] = node.logs.log_size
-                        node.match_index[sibling_server] = -1
+
+    futures = {}
+    data = build_vote_request()
+    for sibling_server in node.sibling_nodes:
+        future = rpc_executor.submit(post_rpc, sibling_server, 'election/vote', data, 0.01)
+        futures[future] = sibling_server
+
+    while futures and not node.check_heartbeat_timeout():
+        retries = {}
+        for future in as_completed(futures):
+            try:
+                response = future.result()
+                if response['vote']:
+                    votes += 1
+                elif response['term'] > node.term:
+                    update_term_return_to_follower(response['term'])
                     return
-            futures = retries
+            except Exception as e:
+                print(f'Vote call to {futures[future]} failed with: {e}.')
+                retry = rpc_executor.submit(post_rpc, futures[future], 'election/vote', data, 10)
+                retries[retry] = futures[future]
+            print(f'Received {votes}/{node.total_nodes} votes.')
+            if votes > node.total_nodes / 2 and node.role == Role.CANDIDATE:
+                become_leader()
+                return
+        futures = retries
 
     # special case: 1 node system
     if votes > node.total_nodes / 2 and node.role == Role.CANDIDATE:
-        node.transition_to_new_role(raft.Role.LEADER)
-        for sibling_server in node.sibling_nodes:
-            node.next_index[sibling_server] = node.logs.log_size
-            node.match_index[sibling_server] = -1
+        become_leader()
     else:
         node.transition_to_new_role(raft.Role.FOLLOWER)
     return
 
 
+def build_vote_request():
+    """
+    Builds the vote request of this node as a candidate of the current term.
+    """
+    return {
+        'term': node.term,
+        'candidateId': node.index,
+        'lastLogTerm': -1 if not node.logs.log_size else node.logs.term_at(-1),
+        'lastLogIndex': node.logs.log_size - 1
+    }
+
+
 def get_uuid():
     return str(uuid.uuid4())
 
 
+def error_response(message, status):
+    output = {'success': False, 'error': message}
+    return Response(json.dumps(output), status=status, mimetype='application/json')
+
+
+def get_request_timeout():
+    """
+    Returns the deadline of the current request in seconds, overridable with the `timeout` query parameter.
+    """
+    return request.args.get('timeout', REQUEST_TIMEOUT, type=float)
+
+
+def append_commands(commands):
+    """
+    Appends the commands to the log as one entry, a BATCH entry if there are several of them. The role and the term
+    are checked under the lock changing them, the node may have stepped down since the requests were accepted.
+    :return: term and index of the log entry
+    :raise NotLeaderError: if the node is not the leader anymore
+    """
+    command = commands[0] if len(commands) == 1 else Command.batch(get_uuid(), commands)
+    with node.thread_lock:
+        if not node.is_leader():
+            raise NotLeaderError('Node is not the leader anymore.')
+        term = node.term
+        index = node.logs.append(LogEntry(term, command))
+    notify_replicators()
+    update_committed_index()  # the leader's own entry counts once durable, a single node commits right away
+    return term, index
+
+
+committer = GroupCommitter(append_commands, GROUP_COMMIT_WINDOW, GROUP_COMMIT_MAX_SIZE)
+
+
+def submit_command(command):
+    """
+    Appends the command to the log through the group committer and waits until it is applied to the state machine.
+    :param command: command to replicate
+    :return: result of the command, or an error response if the command could not be applied before the deadline
+    """
+    timeout = get_request_timeout()
+    results.expect(command.id)
+    try:
+        try:
+            term, log_index = committer.submit(command)
+        except NotLeaderError as e:
+            return error_response(str(e), 503)
+
+        def is_done():
+            if node.last_applied >= log_index:
+                return True
+            # the entry was overwritten by a new leader, it will never be applied
+            return node.logs.log_size <= log_index or node.logs.term_at(log_index) != term
+
+        with node.apply_condition:
+            applied = node.apply_condition.wait_for(is_done, timeout=timeout)
+    finally:
+        result = results.pop(command.id)
+    if not applied:
+        return error_response('Request timed out.', 504)
+    if result is None:
+        return error_response('Request was not committed.', 503)
+    return result
+
+
+def put_topic_command(body):
+    data = {'topic': body['topic'], 'capacity': body.get('capacity', TOPIC_CAPACITY)}
+    for field in ('partitions', 'mode', 'retentionBytes', 'retentionSeconds'):
+        if body.get(field) is not None:
+            data[field] = body[field]
+    return Command(get_uuid(), Operation.PUT_TOPIC, json.dumps(data))
+
+
+def put_message_command(body):
+    data = json.loads(body)
+    data['timestamp'] = time.time()  # the clock of the leader, the same for the state machines of all the nodes
+    return Command(get_uuid(), Operation.PUT_MESSAGE, json.dumps(data))
+
+
+def put_messages_command(body):
+    messages = [dict({'topic': data['topic'], 'message': data['message']},
+                     **{field: data[field] for field in ('key', 'partition') if data.get(field) is not None})
+                for data in body['messages']]
+    data = {'messages': messages, 'timestamp': time.time()}
+    if 'clientId' in body:
+        data.update(clientId=body['clientId'], sequence=body['sequence'])
+    return Command(get_uuid(), Operation.PUT_MESSAGES, json.dumps(data))
+
+
+def get_message_command(topic, max_messages, partition=None, visibility=None):
+    """
+    Creates the command consuming from the topic. A max of None consumes a single message.
+    :param visibility: seconds the messages stay in flight until they are acknowledged, None to delete them right away
+    """
+    if max_messages is None and partition is None and visibility is None:
+        return Command(get_uuid(), Operation.GET_MESSAGE, topic)
+    data = {'topic': topic, 'max': max_messages}
+    if partition is not None:
+        data['partition'] = partition
+    if visibility is not None:
+        # the leases expire by the clock of the leader, the same for the state machines of all the nodes
+        data.update(visibility=visibility, timestamp=time.time())
+    return Command(get_uuid(), Operation.GET_MESSAGES, json.dumps(data))
+
+
+def ack_messages_command(body):
+    return Command(get_uuid(), Operation.ACK_MESSAGES, json.dumps({'topic': body['topic'],
+                                                                   'receipts': body['receipts']}))
+
+
+def lease_expiry_command():
+    """
+    Creates, on the leader, the command returning the messages whose lease expired by the clock of the leader to their
+    queues. The command carries that time, so every node expires the same leases. Checked every LEASE_CHECK_INTERVAL.
+    :return: the command, None if no lease expired
+    """
+    global next_lease_check
+    now = time.time()
+    if not node.is_leader() or now < next_lease_check:
+        return None
+    next_lease_check = now + LEASE_CHECK_INTERVAL
+    with node.thread_lock:
+        deadlines = [queue.next_deadline for queue in list(topic_queues.values()) if
+                     isinstance(queue, PartitionedTopic) and queue.next_deadline is not None]
+    if not deadlines or min(deadlines) > now:
+        return None
+    return Command(get_uuid(), Operation.EXPIRE_LEASES, json.dumps({'timestamp': now}))
+
+
+def retention_command():
+    """
+    Creates, on the leader, the command dropping the messages of the topics in log mode which got older than their
+    retention by the clock of the leader. The command carries that time, so every node drops the same messages.
+    Checked every RETENTION_CHECK_INTERVAL.
+    :return: the command, None if no message is out of its retention
+    """
+    global next_retention_check
+    now = time.time()
+    if not node.is_leader() or now < next_retention_check:
+        return None
+    next_retention_check = now + RETENTION_CHECK_INTERVAL
+    with node.thread_lock:
+        expiries = [queue.next_expiry for queue in list(topic_queues.values()) if
+                    isinstance(queue, TopicLog) and queue.next_expiry is not None]
+    if not expiries or min(expiries) > now:
+        return None
+    return Command(get_uuid(), Operation.RETAIN_MESSAGES, json.dumps({'timestamp': now}))
+
+
+def commit_offset_command(body):
+    data = {'topic': body['topic'], 'group': body['group'], 'offset': body['offset']}
+    return Command(get_uuid(), Operation.COMMIT_OFFSET, json.dumps(data))
+
+
+def read_position(topic, group, offset):
+    """
+    Returns the offset a read of a topic in log mode starts at: the given offset, otherwise the committed offset of
+    the consumer group.
+    """
+    return offset if offset is not None else topic_queues[topic].committed_offset(group)
+
+
+def has_log_messages(topic, group, offset):
+    queue = topic_queues.get(topic)
+    return isinstance(queue, TopicLog) and queue.end_offset > read_position(topic, group, offset)
+
+
+def read_log(topic, group, offset, max_messages):
+    """
+    Reads the messages of a topic in log mode from the given offset, otherwise from the committed offset of the
+    consumer group. Nothing is written to the log, the group commits the offsets it has processed separately.
+    :return: the message, or up to max_messages messages, with the offset of the first one and the next offset
+    """
+    with node.thread_lock:
+        queue = topic_queues.get(topic)
+        if not isinstance(queue, TopicLog):
+            return {'success': False}
+        first_offset, messages = queue.read(read_position(topic, group, offset),
+                                            1 if max_messages is None else max_messages)
+    output = {'success': bool(messages), 'offset': first_offset, 'nextOffset': first_offset + len(messages)}
+    if max_messages is None:
+        if messages:
+            output['message'] = messages[0]
+    else:
+        output['messages'] = messages
+    return output
+
+
+def is_log_topic(topic):
+    return isinstance(topic_queues.get(topic), TopicLog)
+
+
+def topic_details(topic, peek, partition=None):
+    """
+    Returns the depth of the topic and the first peek messages of the partition, of all partitions if not given.
+    """
+    with node.thread_lock:
+        queue = topic_queues.get(topic)
+        if queue is None:
+            return {'success': False}
+        if not has_partition(queue, partition):
+            return {'success': False, 'error': 'Partition does not exist.'}
+        output = {
+            'success': True,
+            'depth': queue.depth,
+            'bytes': queue.size_bytes,
+            'capacity': queue.capacity,
+            'messages': queue.peek(peek, partition)
+        }
+        if queue.partition_count > 1:
+            output['partitions'] = queue.partition_count
+            output['partitionDepths'] = queue.depths
+        if isinstance(queue, PartitionedTopic) and queue.in_flight:
+            output['inFlight'] = queue.in_flight
+        if isinstance(queue, TopicLog):
+            output.update(mode=LOG_MODE, startOffset=queue.start_offset, endOffset=queue.end_offset,
+                          groups=queue.offsets)
+        return output
+
+
 @app.route('/topic', methods=['PUT'])
 def put_topic():
     """
-    Creates a new topic.
+    Creates a new topic. The optional `capacity` limits the number of messages the topic can hold, and the optional
+    `partitions` splits it into that many partitions consumed in parallel.
     :return boolean: True if topic was created, False if topic exists already or not created.
     """
     body = json.loads(request.get_data().decode('utf-8'))
-    topic = body['topic']
-    id = get_uuid()
-    log_entry = LogEntry(node.term, Command(id, Operation.PUT_TOPIC, topic))
-    node.logs.append(log_entry)
-    log_index = node.logs.log_size - 1
-    while node.last_applied < log_index:
-        time.sleep(0.01)
-    return results[id]
+    return submit_command(put_topic_command(body))
 
 
 @app.route('/topic', methods=['GET'])
 def get_topics():
     """
-    Returns the list of topics
+    Returns the list of topics, and the number of partitions of the partitioned ones. The read is linearizable but
+    writes nothing to the log. With several Raft groups the topics of every group are listed, unless the `local`
+    query parameter asks for the ones of this group only.
     :return list:
     """
-    id = get_uuid()
-    log_entry = LogEntry(node.term, Command(id, Operation.GET_TOPICS, ''))
-    node.logs.append(log_entry)
-    log_index = node.logs.log_size - 1
-    while node.last_applied < log_index:
-        time.sleep(0.01)
-    return results[id]
+    if not linearizable_read(get_request_timeout()):
+        return error_response('Leadership could not be confirmed.', 503)
+    if placement.group_count == 1 or LOCAL_LISTING_ARG in request.args:
+        return list_topics()
+    others = [rpc_executor.submit(list_group_topics, other, FORWARD_TIMEOUT + get_request_timeout())
+              for other in range(placement.group_count) if other != group]
+    try:
+        outputs = [promise.result() for promise in others]
+    except Exception as e:
+        print(f'Listing the topics of another Raft group failed with: {e}.')
+        return error_response('Raft group could not be reached.', 503)
+    return merge_topic_listings([list_topics()] + outputs)
+
+
+@app.route('/topic/<topic>', methods=['GET'])
+def peek_topic(topic):
+    """
+    Returns the depth of the topic and, with the `peek` query parameter, its first messages without consuming them.
+    The `partition` query parameter peeks into a single partition.
+    :return:
+    """
+    if not linearizable_read(get_request_timeout()):
+        return error_response('Leadership could not be confirmed.', 503)
+    return topic_details(topic, request.args.get('peek', 0, type=int), request.args.get('partition', type=int))
 
 
 @app.route('/message', methods=['PUT'])
 def put_message():
     """
-    Adds the message to end of the queue.
+    Adds the message to end of the queue. A producer retrying safely gives its `clientId` and the `sequence` number
+    of the request, a retry with the same ones is not applied again and returns the result of the first attempt.
+    For a partitioned topic, the optional `key` keeps the messages with the same key in one partition, in order, and
+    the optional `partition` picks the partition, otherwise the messages are spread round-robin.
     :return:
     """
-    body = request.get_data().decode('utf-8')
-    id = get_uuid()
-    log_entry = LogEntry(node.term, Command(id, Operation.PUT_MESSAGE, body))
-    node.logs.append(log_entry)
-    log_index = node.logs.log_size - 1
-    while node.last_applied < log_index:
-        time.sleep(0.01)
-    return results[id]
+    return submit_command(put_message_command(request.get_data().decode('utf-8')))
+
+
+@app.route('/messages', methods=['PUT'])
+def put_messages():
+    """
+    Adds a list of messages, possibly to different topics, as a single log entry. Takes the same optional `clientId`
+    and `sequence` as PUT /message, and every message the same optional `key` and `partition`.
+    :return: overall success and the result of every message, in order
+    """
+    body = json.loads(request.get_data().decode('utf-8'))
+    return submit_command(put_messages_command(body))
+
+
+def wait_for_messages(topic, timeout, partition=None):
+    """
+    Waits until the topic, or its partition, holds messages in the applied state.
+    :return: False if the timeout expired before
+    """
+    with node.apply_condition:
+        return node.apply_condition.wait_for(lambda: has_messages(topic, partition), timeout=timeout)
+
+
+def has_messages(topic, partition=None):
+    return topic in topic_queues and topic_queues[topic].has_messages(partition)
+
+
+def get_log_messages(topic, max_messages, wait):
+    """
+    Reads a topic in log mode on the leader, once the read is linearizable, waiting up to wait seconds for messages
+    past the read offset.
+    """
+    group = request.args.get('group')
+    offset = request.args.get('offset', type=int)
+    if not linearizable_read(get_request_timeout()):
+        return error_response('Leadership could not be confirmed.', 503)
+    if wait > 0:
+        with node.apply_condition:
+            node.apply_condition.wait_for(lambda: has_log_messages(topic, group, offset), timeout=wait)
+    return read_log(topic, group, offset, max_messages)
 
 
 @app.route('/message/<topic>', methods=['GET'])
 def get_message(topic):
     """
-    Returns first message from the topic
+    Returns first message from the topic. With the `max` query parameter, returns up to max messages as a list.
+    With the `wait` query parameter, holds the request for up to wait seconds until messages arrive; no log entry is
+    written while the topic is empty. For a partitioned topic, the messages come from the partition given by the
+    `partition` query parameter, otherwise from the next partition holding messages, named in the response.
+    A topic in log mode is read without consuming the messages, from the `offset` query parameter, otherwise from the
+    committed offset of the consumer `group`. With the `visibility` query parameter, the messages are hidden for that
+    many seconds instead of deleted, and deleted once acknowledged with their receipts by PUT /ack.
+    :return:
+    """
+    max_messages = request.args.get('max', type=int)
+    partition = request.args.get('partition', type=int)
+    visibility = request.args.get('visibility', type=float)
+    wait = min(request.args.get('wait', 0, type=float), MAX_LONG_POLL_WAIT)
+    deadline = time.time() + wait
+    if is_log_topic(topic):
+        return get_log_messages(topic, max_messages, wait)
+    empty = {'success': False} if max_messages is None else {'success': False, 'messages': []}
+    while True:
+        if wait > 0 and not wait_for_messages(topic, deadline - time.time(), partition):
+            return empty
+        output = submit_command(get_message_command(topic, max_messages, partition, visibility))
+        # another consumer may have drained the topic in the meantime, wait again
+        if wait <= 0 or not isinstance(output, dict) or output['success'] or time.time() >= deadline:
+            return output
+
+
+@app.route('/offset', methods=['PUT'])
+def commit_offset():
+    """
+    Commits the offset of a consumer group in a topic in log mode: the offset of the next message the group reads.
     :return:
     """
-    id = get_uuid()
-    log_entry = LogEntry(node.term, Command(id, Operation.GET_MESSAGE, topic))
-    node.logs.append(log_entry)
-    log_index = node.logs.log_size - 1
-    while node.last_applied < log_index:
-        time.sleep(0.01)
-    return results[id]
+    body = json.loads(request.get_data().decode('utf-8'))
+    return submit_command(commit_offset_command(body))
+
+
+@app.route('/ack', methods=['PUT'])
+def ack_messages():
+    """
+    Deletes the messages in flight given by their `receipts`, a list acknowledging a whole batch in one log entry.
+    :return: overall success, False if a lease expired already, and the number of messages deleted
+    """
+    body = json.loads(request.get_data().decode('utf-8'))
+    return submit_command(ack_messages_command(body))
 
 
 @app.route('/status', methods=['GET'])
@@ -330,36 +1322,122 @@ def get_status():
     return {'role': node.role.value, 'term': node.term}
 
 
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Returns counters describing the replication and apply progress of the node
+    :return:
+    """
+    return {
+        'group': group,
+        'logSize': node.logs.log_size,
+        'committedIndex': node.committed_index,
+        'lastApplied': node.last_applied,
+        'applyBacklog': node.apply_backlog,
+        'snapshotIndex': node.logs.snapshot_index,
+        'logBytes': node.logs.size_bytes,
+        'connectionPools': rest_client.pool_stats(),
+        'results': results.json_encode(),
+        'replication': {server: {'nextIndex': node.next_index.get(server), 'matchIndex': node.match_index.get(server)}
+                        for server in node.sibling_nodes} if node.is_leader() else {},
+        'topics': {topic: {'depth': queue.depth, 'bytes': queue.size_bytes, 'partitions': queue.partition_count}
+                   for topic, queue in list(topic_queues.items())}
+    }
+
+
 @app.route('/logs/append', methods=['POST'])
 def sync_logs():
     """
     Leader sends logs data for syncing.
     :return:
     """
-    message = json.loads(request.get_data().decode('utf-8'))
+    message = wire.decode_append_request(request.get_data(), request.mimetype)
     term = message['term']
     leader_id = message['leaderId']
     prev_log_term = message['prevLogTerm']
     prev_log_index = message['prevLogIndex']
-    entry = LogEntry.json_decode(message['entry'])
+    entries = message['entries']
     leader_commit = message['leaderCommit']
+    # concurrent append requests, pipelined or retried, must not both append the same entries
+    with node.thread_lock:
+        output = {'term': node.term}
+        if term < node.term:
+            output['success'] = False
+            return output
+        node.reset_last_heartbeat()
+        node.leader = leader_id
+        update_term_return_to_follower(term)
+        node.leader_address = message.get('leaderAddress')
+        if prev_log_index < node.logs.snapshot_index:  # the entries up to the snapshot are committed, so they match
+            entries = entries[node.logs.snapshot_index - prev_log_index:]
+            prev_log_index = node.logs.snapshot_index
+            prev_log_term = node.logs.snapshot_term
+        if prev_log_index != -1 and node.logs.log_size <= prev_log_index:
+            # the leader goes straight back to the end of the log
+            output.update(success=False, conflictTerm=-1, conflictIndex=node.logs.log_size)
+            return output
+        if prev_log_index != -1 and node.logs.term_at(prev_log_index) != prev_log_term:
+            # the leader skips the whole conflicting term at once
+            output.update(success=False, conflictTerm=node.logs.term_at(prev_log_index),
+                          conflictIndex=node.logs.first_index_of_term(prev_log_index))
+            return output
+        # skip the entries already present, drop the conflicting suffix and append the rest in one step
+        for offset, entry in enumerate(entries):
+            index = prev_log_index + 1 + offset
+            if index < node.logs.log_size:
+                if node.logs.term_at(index) == entry.term:
+                    continue
+                node.logs.delete_entries_from(index)
+                node.apply_condition.notify_all()  # wake up the requests waiting for the deleted entries
+            node.logs.extend(entries[offset:])
+            break
+        # the leader counts the entries acknowledged towards a quorum, they must survive a crash of this node
+        node.logs.sync()
+        if leader_commit > node.committed_index:
+            node.committed_index = min(leader_commit, prev_log_index + len(entries))
+            commit_event.set()
+        output['success'] = True
+        return output
+
+
+@app.route('/snapshot/install', methods=['POST'])
+def install_snapshot():
+    """
+    Leader streams its snapshot to a follower lagging behind the compacted part of its log.
+    :return:
+    """
+    global incoming_snapshot
+    message = json.loads(request.get_data().decode('utf-8'))
+    term = message['term']
+    last_index = message['lastIncludedIndex']
+    last_term = message['lastIncludedTerm']
+    offset = message['offset']
     output = {'term': node.term}
     if term < node.term:
         output['success'] = False
         return output
     node.reset_last_heartbeat()
-    node.leader = leader_id
+    node.leader = message['leaderId']
     update_term_return_to_follower(term)
-    if prev_log_index != -1 and (
-            node.logs.log_size <= prev_log_index or node.logs.entries[prev_log_index].term != prev_log_term):
+    node.leader_address = message.get('leaderAddress')
+    if offset == 0:
+        incoming_snapshot = {'lastIndex': last_index, 'data': bytearray()}
+    if not incoming_snapshot or incoming_snapshot['lastIndex'] != last_index or \
+            len(incoming_snapshot['data']) != offset:
         output['success'] = False
         return output
-    if node.logs.log_size > prev_log_index + 1 and node.logs.entries[prev_log_index + 1] != entry:
-        node.logs.delete_entries_from(prev_log_index + 1)
-    if entry:
-        node.logs.append(entry)
-    if leader_commit > node.committed_index:
-        node.committed_index = min(leader_commit, node.logs.log_size - 1)
+    incoming_snapshot['data'].extend(base64.b64decode(message['data']))
+    if message['done']:
+        snapshot = Snapshot(last_index, last_term, bytes(incoming_snapshot['data']))
+        incoming_snapshot = None
+        with node.thread_lock:
+            if snapshot.last_index > node.last_applied:
+                node.snapshot = snapshot
+                restore_state(snapshot.data)
+                node.last_applied = snapshot.last_index
+                node.committed_index = max(node.committed_index, snapshot.last_index)
+                node.apply_condition.notify_all()
+                print(f'Installed {snapshot}.')
     output['success'] = True
     return output
 
@@ -370,53 +1448,86 @@ def vote_leader():
     A candidate calls this api for requesting votes for leader election.
     :return:
     """
-    message = json.loads(request.get_data().decode('utf-8'))
+    message = wire.decode_vote_request(request.get_data(), request.mimetype)
     requester_term = message['term']
     candidate_id = message['candidateId']
     last_log_idx = message['lastLogIndex']
     last_log_term = message['lastLogTerm']
 
-    # Log inconsistency
-    if node.logs.entries and (node.logs.entries[-1].term > last_log_term or (
-            node.logs.entries[-1].term == last_log_term and node.logs.log_size > last_log_idx + 1)):
-        output = {'vote': False, 'term': node.term}
-        return Response(json.dumps(output), status=200, mimetype='application/json')
+    # concurrent vote requests of two candidates must not both be granted
+    with node.thread_lock:
+        # Log inconsistency
+        if node.logs.log_size and (node.logs.term_at(-1) > last_log_term or (
+                node.logs.term_at(-1) == last_log_term and node.logs.log_size > last_log_idx + 1)):
+            output = {'vote': False, 'term': node.term}
+            return Response(json.dumps(output), status=200, mimetype='application/json')
 
-    # found current leader
-    if node.term == requester_term and node.is_leader():
-        output = {'vote': False, 'term': node.term}
-        return Response(json.dumps(output), status=200, mimetype='application/json')
+        # a leader holding a lease relies on its followers not electing another leader before the lease expires
+        if READ_MODE == LEASE and node.leader != candidate_id and \
+                node.time_since_last_heartbeat() < raft.MIN_ELECTION_TIMEOUT:
+            output = {'vote': False, 'term': node.term}
+            return Response(json.dumps(output), status=200, mimetype='application/json')
 
-    # update term and move to follower state
-    if requester_term > node.term:
-        update_term_return_to_follower(requester_term)
-        node.voted_for = candidate_id
-        output = {'vote': True, 'term': node.term}
-        return Response(json.dumps(output), status=200, mimetype='application/json')
-    elif requester_term == node.term and (not node.voted_for or node.voted_for == candidate_id):
-        update_term_return_to_follower(requester_term)
-        node.voted_for = candidate_id
-        output = {'vote': True, 'term': node.term}
-        return Response(json.dumps(output), status=200, mimetype='application/json')
+        # found current leader
+        if node.term == requester_term and node.is_leader():
+            output = {'vote': False, 'term': node.term}
+            return Response(json.dumps(output), status=200, mimetype='application/json')
+
+        # update term and move to follower state
+        if requester_term > node.term:
+            update_term_return_to_follower(requester_term)
+            node.voted_for = candidate_id
+            output = {'vote': True, 'term': node.term}
+            return Response(json.dumps(output), status=200, mimetype='application/json')
+        elif requester_term == node.term and (node.voted_for is None or node.voted_for == candidate_id):
+            update_term_return_to_follower(requester_term)
+            node.voted_for = candidate_id
+            output = {'vote': True, 'term': node.term}
+            return Response(json.dumps(output), status=200, mimetype='application/json')
 
-    # vote no
-    output = {'vote': False, 'term': node.term}
-    return Response(json.dumps(output), status=200, mimetype='application/json')
+        # vote no
+        output = {'vote': False, 'term': node.term}
+        return Response(json.dumps(output), status=200, mimetype='application/json')
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument("path_to_config", type=str, help="path to server config file")
     parser.add_argument("index", type=int, help="index of the server to start")
+    parser.add_argument("--data-dir", type=str, default=None,
+                        help="directory where the term, vote and log are persisted, in memory if not given")
+    parser.add_argument("--fsync", type=str, default=FsyncPolicy.BATCH.value,
+                        choices=[policy.value for policy in FsyncPolicy], help="fsync policy of the log")
+    parser.add_argument("--wire-format", type=str, default=WIRE_FORMAT, choices=[wire.JSON, wire.BINARY],
+                        help="format of the Raft RPCs sent to the other nodes, binary only to the nodes accepting it")
+    parser.add_argument("--runtime", type=str, default='threaded', choices=['threaded', 'asyncio'],
+                        help="threaded Flask server, or a single asyncio event loop served by an ASGI server")
+    parser.add_argument("--group", type=int, default=0,
+                        help="Raft group served by this process, when the servers of the config list several ports")
     args = parser.parse_args()
+    WIRE_FORMAT = args.wire_format
     with open(args.path_to_config, 'r') as config_file:
-        server_config = json.load(config_file)['addresses']
-        nodes = [(server['ip'].removeprefix('http://'), server['port']) for server in server_config]
-        sibling_nodes = [f'{node[0]}:{node[1]}' for idx, node in enumerate(nodes) if idx != args.index]
-        node = raft.Node(args.index, sibling_nodes)
-        print(
-            f'Starting server {args.index} on {nodes[args.index][0]}:{nodes[args.index][1]} with sibling nodes as '
-            f'{sibling_nodes}.')
-        background_thread = threading.Thread(target=run_background_tasks, daemon=True)
-        background_thread.start()
-        app.run(host=nodes[args.index][0], port=nodes[args.index][1])
+        config = json.load(config_file)
+        placement = Placement.json_decode(config)
+        group = args.group
+        nodes = group_addresses(config, group)
+        group_nodes = {other: group_addresses(config, other)[args.index] for other in range(placement.group_count)}
+        sibling_nodes = [node for idx, node in enumerate(nodes) if idx != args.index]
+        address = nodes[args.index]
+        host, port = address.rsplit(':', 1)
+        data_dir = args.data_dir
+        if data_dir is not None and placement.group_count > 1:
+            data_dir = os.path.join(data_dir, f'group{group}')
+        # the groups prefer different nodes as their leader, so the leaders and their load are spread over the hosts
+        preferred_leader = placement.group_count > 1 and args.index == group % len(nodes)
+        node = raft.Node(args.index, sibling_nodes, data_dir, FsyncPolicy(args.fsync), preferred_leader)
+        if node.snapshot:
+            restore_state(node.snapshot.data)
+        print(f'Starting server {args.index} of Raft group {group} on {address} with sibling nodes as {sibling_nodes}.')
+        if args.runtime == 'asyncio':
+            async_runtime.serve(sys.modules[__name__], host, int(port))
+        else:
+            background_thread = threading.Thread(target=run_background_tasks, daemon=True)
+            background_thread.start()
+            WSGIRequestHandler.protocol_version = 'HTTP/1.1'  # keep connections alive for the pooled peer clients
+            app.run(host=host, port=int(port))
@@ -0,0 +1,47 @@
+import zlib
+
+
+class Placement:
+    """
+    Assigns every topic to one of the Raft groups of the cluster: the group given by the placement table, otherwise
+    the hash of the topic modulo the number of groups. All the nodes and the clients must use the same placement.
+    """
+
+    def __init__(self, group_count=1, table=None):
+        self.__group_count = group_count
+        self.__table = dict(table or {})  # topic -> group, overrides the hash
+
+    @property
+    def group_count(self):
+        return self.__group_count
+
+    def group_of(self, topic):
+        group = self.__table.get(topic)
+        if group is not None:
+            return group
+        return zlib.crc32(topic.encode('utf-8')) % self.__group_count
+
+    # json serialization
+    def json_encode(self):
+        return {'groups': self.__group_count, 'placement': self.__table}
+
+    @classmethod
+    def json_decode(cls, config):
+        """
+        Reads the placement of a server config. The number of groups is the number of ports of each server.
+        """
+        return Placement(len(group_ports(config['addresses'][0])), config.get('placement'))
+
+
+def group_ports(server):
+    """
+    Returns the port of every Raft group on the server, from its `ports` list, or its single `port`.
+    """
+    return server['ports'] if 'ports' in server else [server['port']]
+
+
+def group_addresses(config, group):
+    """
+    Returns the address of every node of the Raft group, as host:port, in the order of the servers of the config.
+    """
+    return [f"{server['ip'].removeprefix('http://')}:{group_ports(server)[group]}" for server in config['addresses']]
@@ -1,9 +1,17 @@
+import json
+import os
 import random
 import threading
 import time
 from enum import Enum
 
 from src.log import NodeLog
+from src.snapshot import Snapshot
+from src.wal import FsyncPolicy
+
+STATE_FILE = 'raft_state.json'
+SNAPSHOT_FILE = 'snapshot'
+LOG_DIR = 'log'
 
 
 class Role(Enum):
@@ -12,8 +20,15 @@ class Role(Enum):
     LEADER = 'Leader'
 
 
-def get_timeout():
-    return random.uniform(500, 1000)  # milliseconds
+MIN_ELECTION_TIMEOUT = 500  # milliseconds
+MAX_ELECTION_TIMEOUT = 1000  # milliseconds
+PREFERRED_MIN_ELECTION_TIMEOUT = 250  # milliseconds, the preferred leader times out first and usually wins
+
+
+def get_timeout(preferred_leader=False):
+    if preferred_leader:
+        return random.uniform(PREFERRED_MIN_ELECTION_TIMEOUT, MIN_ELECTION_TIMEOUT)  # milliseconds
+    return random.uniform(MIN_ELECTION_TIMEOUT, MAX_ELECTION_TIMEOUT)  # milliseconds
 
 
 def get_time_millis():
@@ -21,22 +36,30 @@ def get_time_millis():
 
 
 class Node:
-    def __init__(self, index, sibling_nodes):
-        self.__thread_lock = threading.Lock()
+    def __init__(self, index, sibling_nodes, data_dir=None, fsync_policy=FsyncPolicy.BATCH, preferred_leader=False):
+        self.__thread_lock = threading.RLock()  # reentrant, the Raft handlers holding it also change the term
+        self.__apply_condition = threading.Condition(self.__thread_lock)  # notified when log entries are applied
         self.__index = index  # server index
         self.__term = -1  # term of the election
         self.__role = Role.FOLLOWER
         self.__voted_for = None  # voted for in current term
         self.__leader = None
+        self.__leader_address = None  # host:port of the leader of the current term, from its requests
         self.__committed_index = -1
         self.__last_applied = -1
         self.__last_heartbeat = get_time_millis()
-        self.__timeout = get_timeout()
+        self.__preferred_leader = preferred_leader  # spreads the leaders of the Raft groups over the nodes
+        self.__timeout = get_timeout(preferred_leader)
         self.__sibling_nodes = sibling_nodes
-        self.__logs = NodeLog()
+        self.__data_dir = data_dir  # term, vote and log entries are persisted here if set
+        self.__logs = NodeLog(None if data_dir is None else os.path.join(data_dir, LOG_DIR), fsync_policy)
+        self.__snapshot = None  # latest snapshot of the state machine
+        self.__load_state()
         # these two are used when node becomes leader
         self.__next_index = {}
         self.__match_index = {}
+        self.__ack_times = {}  # monotonic send time of the latest request acknowledged by each follower
+        self.__term_start_index = None  # index of the first entry appended in the current leadership term
 
     @property
     def leader(self):
@@ -47,10 +70,34 @@ class Node:
         self.__leader = leader
         return
 
+    @property
+    def leader_address(self):
+        return self.__leader_address
+
+    @leader_address.setter
+    def leader_address(self, leader_address):
+        self.__leader_address = leader_address
+        return
+
     @property
     def logs(self):
         return self.__logs
 
+    @property
+    def snapshot(self):
+        return self.__snapshot
+
+    @snapshot.setter
+    def snapshot(self, snapshot):
+        """
+        Stores the snapshot, persisting it first, and drops the log entries it covers.
+        """
+        if self.__data_dir is not None:
+            snapshot.save(os.path.join(self.__data_dir, SNAPSHOT_FILE))
+        self.__snapshot = snapshot
+        self.__logs.compact(snapshot.last_index, snapshot.last_term)
+        return
+
     @property
     def next_index(self):
         return self.__next_index
@@ -59,6 +106,19 @@ class Node:
     def match_index(self):
         return self.__match_index
 
+    @property
+    def ack_times(self):
+        return self.__ack_times
+
+    @property
+    def term_start_index(self):
+        return self.__term_start_index
+
+    @term_start_index.setter
+    def term_start_index(self, term_start_index):
+        self.__term_start_index = term_start_index
+        return
+
     @property
     def committed_index(self):
         return self.__committed_index
@@ -67,6 +127,13 @@ class Node:
     def last_applied(self):
         return self.__last_applied
 
+    @property
+    def apply_backlog(self):
+        """
+        Number of committed log entries not yet applied to the state machine.
+        """
+        return self.__committed_index - self.__last_applied
+
     @property
     def voted_for(self):
         return self.__voted_for
@@ -81,12 +148,18 @@ class Node:
 
     @term.setter
     def term(self, term):
-        self.__term = term
+        if term != self.__term:
+            self.__term = term
+            self.__voted_for = None  # no vote cast in the new term yet
+            self.__leader_address = None
+            self.__save_state()
         return
 
     @voted_for.setter
     def voted_for(self, voted_for):
-        self.__voted_for = voted_for
+        if voted_for != self.__voted_for:
+            self.__voted_for = voted_for
+            self.__save_state()
         return
 
     @property
@@ -105,13 +178,59 @@ class Node:
     def thread_lock(self):
         return self.__thread_lock
 
+    @property
+    def apply_condition(self):
+        return self.__apply_condition
+
     @committed_index.setter
     def committed_index(self, committed_index):
         self.__committed_index = committed_index
         return
 
     def increment_term(self):
+        """
+        Starts a new term as a candidate, voting for itself. The term and the vote are persisted together.
+        """
         self.__term += 1
+        self.__voted_for = self.__index
+        self.__leader_address = None
+        self.__save_state()
+        return
+
+    def __load_state(self):
+        """
+        Restores the term, the vote and the latest snapshot of the node from the data directory.
+        """
+        if self.__data_dir is None:
+            return
+        path = os.path.join(self.__data_dir, STATE_FILE)
+        if os.path.exists(path):
+            with open(path, 'r') as state_file:
+                state = json.load(state_file)
+            self.__term = state['term']
+            self.__voted_for = state['votedFor']
+            print(f'Restored term {self.__term} and vote {self.__voted_for} from {path}.')
+        snapshot = Snapshot.load(os.path.join(self.__data_dir, SNAPSHOT_FILE))
+        if snapshot is not None:
+            self.__snapshot = snapshot
+            self.__logs.compact(snapshot.last_index, snapshot.last_term)
+            self.__committed_index = self.__last_applied = snapshot.last_index
+            print(f'Restored {snapshot}.')
+        return
+
+    def __save_state(self):
+        """
+        Persists the term and the vote of the node before they are acted upon. The state file is replaced atomically.
+        """
+        if self.__data_dir is None:
+            return
+        path = os.path.join(self.__data_dir, STATE_FILE)
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w') as state_file:
+            json.dump({'term': self.__term, 'votedFor': self.__voted_for}, state_file)
+            state_file.flush()
+            os.fsync(state_file.fileno())
+        os.replace(temp_path, path)
         return
 
     def transition_to_new_role(self, role):
@@ -123,7 +242,8 @@ class Node:
 
     def prepare_for_leadership(self):
         self.__match_index = {server: -1 for server in self.__sibling_nodes}
-        self.__next_index = {server: self.__logs.log_size() for server in self.__sibling_nodes}
+        self.__next_index = {server: self.__logs.log_size for server in self.__sibling_nodes}
+        self.__ack_times = {}
 
     def check_heartbeat_timeout(self):
         """
@@ -141,12 +261,24 @@ class Node:
             return True
         return False
 
+    def time_since_last_heartbeat(self):
+        """
+        Milliseconds elapsed since the last heartbeat was received.
+        """
+        return get_time_millis() - self.__last_heartbeat
+
+    def time_until_heartbeat_timeout(self):
+        """
+        Milliseconds left before the heartbeat timeout expires.
+        """
+        return self.__timeout - self.time_since_last_heartbeat()
+
     def reset_last_heartbeat(self):
         """
         Resets last heartbeat received time to current time.
         """
         self.__last_heartbeat = get_time_millis()
-        self.__timeout = get_timeout()
+        self.__timeout = get_timeout(self.__preferred_leader)
 
     @last_applied.setter
     def last_applied(self, val):
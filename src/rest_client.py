@@ -1,32 +1,121 @@
 import json
+import threading
 
 import requests as requests
+from requests.adapters import HTTPAdapter
 
+POOL_SIZE = 10  # maximum number of keep-alive connections kept open to each peer
+LEADER_HEADER = 'X-Raft-Leader'  # response header naming the address of the leader known to the node
+FORWARDED_HEADER = 'X-Raft-Forwarded-By'  # request header set by a follower forwarding a client request
 
-def get(hostname, service_url, timeout=10):
-    URL = f'http://{hostname}/{service_url}'
-    response = requests.get(URL, timeout=timeout)
-    if response.status_code not in [200, 201]:
-        raise Exception(response)
-    return response.json()
+sessions = dict()  # hostname -> keep-alive session
+stats = dict()  # hostname -> request counters
+accepted_types = dict()  # hostname -> media types the host accepts in request bodies, from its Accept-Post header
+leaders = dict()  # hostname -> address of the leader named by the latest response of the host
+sessions_lock = threading.Lock()
+stats_lock = threading.Lock()  # the counters are updated from the replication and forwarding threads at once
 
 
-def post(hostname, service_url, data, timeout=10):
-    URL = f'http://{hostname}/{service_url}'
-    response = requests.post(URL, json.dumps(data), timeout=timeout)
-    if response.status_code not in [200, 201]:
-        raise Exception(response)
-    return response.json()
+def get_session(hostname):
+    """
+    Returns the keep-alive session of the host, creating it on first use. Connections to the host are pooled and
+    reused across requests, up to POOL_SIZE of them.
+    """
+    session = sessions.get(hostname)
+    if session is None:
+        with sessions_lock:
+            session = sessions.get(hostname)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, max_retries=0)
+                session.mount('http://', adapter)
+                stats[hostname] = {'requests': 0, 'failures': 0}
+                sessions[hostname] = session
+    return session
 
 
-def put(hostname, service_url, data, timeout=10):
+def send(method, hostname, service_url, data, timeout, connect_timeout, content_type=None):
+    """
+    Sends a request through the pooled session of the host.
+    :param timeout: read timeout in seconds
+    :param connect_timeout: connect timeout in seconds, same as the read timeout if not given
+    :param content_type: media type of the body, not sent if not given
+    """
     URL = f'http://{hostname}/{service_url}'
-    response = requests.put(URL, json.dumps(data), timeout=timeout)
+    session = get_session(hostname)
+    count(hostname, 'requests')
+    headers = None if content_type is None else {'Content-Type': content_type}
+    try:
+        response = session.request(method, URL, data=data, headers=headers,
+                                   timeout=(timeout if connect_timeout is None else connect_timeout, timeout))
+    except Exception:
+        count(hostname, 'failures')
+        raise
+    record_headers(hostname, response)
     if response.status_code not in [200, 201]:
+        count(hostname, 'failures')
         raise Exception(response)
     return response.json()
 
 
+def count(hostname, counter):
+    """
+    Increments a request counter of the host.
+    """
+    with stats_lock:
+        stats[hostname][counter] += 1
+
+
+def record_headers(hostname, response):
+    accept_post = response.headers.get('Accept-Post')
+    if accept_post is not None:
+        accepted_types[hostname] = {media_type.strip() for media_type in accept_post.split(',')}
+    leaders[hostname] = response.headers.get(LEADER_HEADER)
+
+
+def forward(method, hostname, path, data, headers, timeout):
+    """
+    Sends a request on to the host as it is, through the pooled session of the host.
+    :param path: path of the request, with its query string
+    :return: the response, whatever its status code
+    """
+    session = get_session(hostname)
+    count(hostname, 'requests')
+    try:
+        response = session.request(method, f'http://{hostname}{path}', data=data, headers=headers, timeout=timeout)
+    except Exception:
+        count(hostname, 'failures')
+        raise
+    record_headers(hostname, response)
+    return response
+
+
+def get(hostname, service_url, timeout=10, connect_timeout=None):
+    return send('GET', hostname, service_url, None, timeout, connect_timeout)
+
+
+def post(hostname, service_url, data, timeout=10, connect_timeout=None):
+    return send('POST', hostname, service_url, json.dumps(data), timeout, connect_timeout)
+
+
+def put(hostname, service_url, data, timeout=10, connect_timeout=None):
+    return send('PUT', hostname, service_url, json.dumps(data), timeout, connect_timeout)
+
+
+def pool_stats():
+    """
+    Returns the request counters and the number of connections opened so far for every host.
+    """
+    output = {}
+    for hostname, session in list(sessions.items()):
+        pools = session.get_adapter('http://').poolmanager.pools
+        connections = sum(pools[key].num_connections for key in pools.keys())
+        with stats_lock:
+            host_stats = dict(stats[hostname])
+        output[hostname] = dict(host_stats, connections=connections)
+    return output
+
+
 if __name__ == '__main__':
     print(put('localhost:3441', '/messageQueue/message', {}))
     print(get('localhost:3441', '/messageQueue/message'))
@@ -0,0 +1,94 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResultStore:
+    """
+    Results of the applied commands, kept until the request waiting for a result reads it. Only the results of the
+    commands expected by a request on this node are stored. Results nobody reads are dropped once they are ttl
+    seconds old, or oldest first when more than capacity results are stored.
+    """
+
+    def __init__(self, capacity, ttl):
+        self.__capacity = capacity
+        self.__ttl = ttl  # seconds
+        self.__thread_lock = threading.Lock()
+        self.__expected = set()  # ids of the commands a local request waits for
+        self.__results = OrderedDict()  # command id -> (result, monotonic time it was stored), oldest first
+        self.__evictions = 0  # results dropped because the store was full
+        self.__expirations = 0  # results dropped because they were older than the ttl
+
+    @property
+    def evictions(self):
+        return self.__evictions
+
+    @property
+    def expirations(self):
+        return self.__expirations
+
+    def __len__(self):
+        return len(self.__results)
+
+    def __contains__(self, command_id):
+        return command_id in self.__results
+
+    def __getitem__(self, command_id):
+        return self.__results[command_id][0]
+
+    def __setitem__(self, command_id, result):
+        """
+        Stores the result of an applied command, if a request on this node waits for it.
+        """
+        with self.__thread_lock:
+            if command_id not in self.__expected:
+                return
+            self.__expected.discard(command_id)
+            self.__results[command_id] = (result, time.monotonic())
+            self.__evict()
+
+    def expect(self, command_id):
+        """
+        Registers that a request waits for the result of the command.
+        """
+        with self.__thread_lock:
+            self.__expected.add(command_id)
+
+    def pop(self, command_id):
+        """
+        Removes the result of the command, and stops expecting it.
+        :return: the result, None if there is none
+        """
+        with self.__thread_lock:
+            self.__expected.discard(command_id)
+            entry = self.__results.pop(command_id, None)
+        return None if entry is None else entry[0]
+
+    def clear(self):
+        with self.__thread_lock:
+            self.__expected.clear()
+            self.__results.clear()
+
+    def evict(self):
+        """
+        Drops the expired results. Also done whenever a result is stored.
+        """
+        with self.__thread_lock:
+            self.__evict()
+
+    def __evict(self):
+        expired_time = time.monotonic() - self.__ttl
+        while self.__results and next(iter(self.__results.values()))[1] <= expired_time:
+            self.__results.popitem(last=False)
+            self.__expirations += 1
+        while len(self.__results) > self.__capacity:
+            self.__results.popitem(last=False)
+            self.__evictions += 1
+
+    def json_encode(self):
+        return {
+            'size': len(self.__results),
+            'waiting': len(self.__expected),
+            'evictions': self.__evictions,
+            'expirations': self.__expirations
+        }
@@ -0,0 +1,61 @@
+from collections import OrderedDict
+
+
+class SessionTable:
+    """
+    Sequence numbers and results of the latest requests of every producer, used to apply a retried request only once.
+    The table is only changed by applying commands, so it is the same on every node, and it is part of the snapshots.
+    It holds up to capacity clients, the least recently active one is dropped first, and the results of the last
+    window requests of each client. Requests older than the window are reported as duplicates without their result.
+    """
+
+    def __init__(self, capacity, window):
+        self.__capacity = capacity
+        self.__window = window
+        self.__sessions = OrderedDict()  # client id -> (highest sequence, {sequence: result}), least recent first
+
+    def __len__(self):
+        return len(self.__sessions)
+
+    def lookup(self, client_id, sequence):
+        """
+        :return: the result of the request if it was applied already, None if it is a new request
+        """
+        session = self.__sessions.get(client_id)
+        if session is None:
+            return None
+        highest, outputs = session
+        if sequence in outputs:
+            return dict(outputs[sequence], duplicate=True)
+        if sequence <= highest - self.__window:
+            return {'success': False, 'duplicate': True, 'error': 'Request is older than the deduplication window.'}
+        return None
+
+    def record(self, client_id, sequence, result):
+        """
+        Records the result of an applied request of the client.
+        """
+        session = self.__sessions.pop(client_id, None)
+        highest, outputs = session if session is not None else (sequence, {})
+        highest = max(highest, sequence)
+        outputs[sequence] = result
+        for old_sequence in [old for old in outputs if old <= highest - self.__window]:
+            del outputs[old_sequence]
+        self.__sessions[client_id] = (highest, outputs)
+        while len(self.__sessions) > self.__capacity:
+            self.__sessions.popitem(last=False)
+
+    def clear(self):
+        self.__sessions.clear()
+
+    # json serialization
+    def json_encode(self):
+        return [[client_id, highest, [[sequence, result] for sequence, result in outputs.items()]]
+                for client_id, (highest, outputs) in self.__sessions.items()]
+
+    @classmethod
+    def json_decode(cls, json_list, capacity, window):
+        table = SessionTable(capacity, window)
+        for client_id, highest, outputs in json_list:
+            table.__sessions[client_id] = (highest, {sequence: result for sequence, result in outputs})
+        return table
@@ -0,0 +1,59 @@
+import json
+import os
+
+
+class Snapshot:
+    """
+    Serialized state machine including every log entry up to last_index.
+    """
+
+    def __init__(self, last_index, last_term, data):
+        self.__last_index = last_index  # index of the last entry applied to the state
+        self.__last_term = last_term
+        self.__data = data  # bytes
+
+    def __str__(self):
+        return f'Snapshot(last_index="{self.__last_index}", last_term="{self.__last_term}", size={len(self.__data)})'
+
+    @property
+    def last_index(self):
+        return self.__last_index
+
+    @property
+    def last_term(self):
+        return self.__last_term
+
+    @property
+    def data(self):
+        return self.__data
+
+    @property
+    def size(self):
+        return len(self.__data)
+
+    def chunk(self, offset, size):
+        return self.__data[offset:offset + size]
+
+    def save(self, path):
+        """
+        Writes the snapshot to path, replacing the previous snapshot atomically.
+        The first line holds the metadata as json, the state follows as is.
+        """
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as snapshot_file:
+            header = {'lastIndex': self.__last_index, 'lastTerm': self.__last_term}
+            snapshot_file.write(json.dumps(header).encode('utf-8') + b'\n')
+            snapshot_file.write(self.__data)
+            snapshot_file.flush()
+            os.fsync(snapshot_file.fileno())
+        os.replace(temp_path, path)
+        return
+
+    @classmethod
+    def load(cls, path):
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as snapshot_file:
+            header = json.loads(snapshot_file.readline().decode('utf-8'))
+            data = snapshot_file.read()
+        return Snapshot(header['lastIndex'], header['lastTerm'], data)
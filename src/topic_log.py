@@ -0,0 +1,158 @@
+from src.topic_queue import message_size
+
+COMPACT_THRESHOLD = 1024  # dropped messages after which the retained ones are moved to the front of the list
+
+
+class TopicLog:
+    """
+    Messages of a topic retained by offset instead of being removed when consumed. Every consumer group has its own
+    committed offset, so several groups read all the messages. The oldest messages are dropped once the topic holds
+    more than retention_bytes, or once they are retention_seconds older than the latest message. The timestamps are
+    the ones of the leader appending the commands, so every node drops the same messages.
+    """
+
+    def __init__(self, capacity=None, retention_bytes=None, retention_seconds=None):
+        self.__messages = []  # (message, timestamp) from the offset start_offset - head on
+        self.__head = 0  # position of the first retained message in the list
+        self.__start_offset = 0  # offset of the first retained message
+        self.__size_bytes = 0
+        self.__capacity = capacity  # maximum number of messages, None for unbounded
+        self.__retention_bytes = retention_bytes  # None to keep the messages whatever their size
+        self.__retention_seconds = retention_seconds  # None to keep the messages whatever their age
+        self.__offsets = dict()  # consumer group -> committed offset, the next message the group reads
+
+    def __str__(self):
+        return f'TopicLog(start_offset="{self.__start_offset}", end_offset="{self.end_offset}", ' \
+               f'groups="{len(self.__offsets)}")'
+
+    def __len__(self):
+        return len(self.__messages) - self.__head
+
+    @property
+    def partition_count(self):
+        return 1
+
+    @property
+    def depth(self):
+        return len(self)
+
+    @property
+    def size_bytes(self):
+        return self.__size_bytes
+
+    @property
+    def capacity(self):
+        return self.__capacity
+
+    @property
+    def start_offset(self):
+        return self.__start_offset
+
+    @property
+    def end_offset(self):
+        """
+        Offset of the next message appended.
+        """
+        return self.__start_offset + len(self)
+
+    @property
+    def offsets(self):
+        return dict(self.__offsets)
+
+    @property
+    def next_expiry(self):
+        """
+        Time at which the first retained message gets older than the retention time, None if it never does.
+        """
+        if self.__retention_seconds is None or len(self) == 0:
+            return None
+        return self.__messages[self.__head][1] + self.__retention_seconds
+
+    def is_full(self):
+        return self.__capacity is not None and len(self) >= self.__capacity
+
+    def append(self, message, timestamp):
+        """
+        Adds the message to the end of the log and drops the messages out of the retention.
+        :return: offset of the message, None if the log is full
+        """
+        if self.is_full():
+            return None
+        offset = self.end_offset
+        self.__messages.append((message, timestamp))
+        self.__size_bytes += message_size(message)
+        self.retain(timestamp)
+        return offset
+
+    def retain(self, timestamp):
+        """
+        Drops the oldest messages while the log is larger than the retention size, or older than the retention time
+        at the given time.
+        :return: number of messages dropped
+        """
+        start_offset = self.__start_offset
+        expired_time = None if self.__retention_seconds is None else timestamp - self.__retention_seconds
+        while len(self) > 0:
+            message, message_timestamp = self.__messages[self.__head]
+            too_large = self.__retention_bytes is not None and self.__size_bytes > self.__retention_bytes
+            if not too_large and (expired_time is None or message_timestamp > expired_time):
+                break
+            self.__head += 1
+            self.__start_offset += 1
+            self.__size_bytes -= message_size(message)
+        if self.__head >= COMPACT_THRESHOLD and self.__head * 2 >= len(self.__messages):
+            del self.__messages[:self.__head]
+            self.__head = 0
+        return self.__start_offset - start_offset
+
+    def read(self, offset, count):
+        """
+        Returns up to count messages from the offset on, from the first retained one if the offset was dropped.
+        :return: offset of the first message returned, and the messages
+        """
+        offset = max(offset, self.__start_offset)
+        start = self.__head + offset - self.__start_offset
+        return offset, [message for message, _ in self.__messages[start:start + count]]
+
+    def peek(self, count, partition=None):
+        """
+        Returns the first count retained messages.
+        """
+        return self.read(self.__start_offset, count)[1]
+
+    def committed_offset(self, group):
+        """
+        Returns the committed offset of the consumer group, the first retained offset for a new group.
+        """
+        return self.__offsets.get(group, self.__start_offset)
+
+    def commit(self, group, offset):
+        """
+        Moves the committed offset of the consumer group, forward or back to read messages again.
+        :return: False if the offset is past the end of the log
+        """
+        if not 0 <= offset <= self.end_offset:
+            return False
+        self.__offsets[group] = offset
+        return True
+
+    # json serialization
+    def json_encode(self):
+        return {
+            'mode': 'log',
+            'capacity': self.__capacity,
+            'retentionBytes': self.__retention_bytes,
+            'retentionSeconds': self.__retention_seconds,
+            'startOffset': self.__start_offset,
+            'messages': [list(entry) for entry in self.__messages[self.__head:]],
+            'offsets': self.__offsets
+        }
+
+    @classmethod
+    def json_decode(cls, json_dict):
+        topic = TopicLog(json_dict['capacity'], json_dict['retentionBytes'], json_dict['retentionSeconds'])
+        topic.__messages = [(message, timestamp) for message, timestamp in json_dict['messages']]
+        topic.__start_offset = json_dict['startOffset']
+        topic.__size_bytes = sum(message_size(message) for message, _ in topic.__messages)
+        topic.__offsets = dict(json_dict['offsets'])
+        return topic
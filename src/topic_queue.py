@@ -0,0 +1,292 @@
+import heapq
+import zlib
+from collections import deque
+from itertools import islice
+
+
+def message_size(message):
+    """
+    Returns the number of bytes used by the message payload.
+    """
+    if isinstance(message, bytes):
+        return len(message)
+    return len(str(message).encode('utf-8'))
+
+
+class TopicQueue:
+    """
+    FIFO queue of the messages of a topic with O(1) enqueue and dequeue.
+    """
+
+    def __init__(self, capacity=None):
+        self.__messages = deque()
+        self.__size_bytes = 0
+        self.__capacity = capacity  # maximum number of messages, None for unbounded
+
+    def __str__(self):
+        return f'TopicQueue(depth="{self.depth}", size_bytes="{self.__size_bytes}", capacity="{self.__capacity}")'
+
+    def __len__(self):
+        return len(self.__messages)
+
+    @property
+    def depth(self):
+        return len(self.__messages)
+
+    @property
+    def size_bytes(self):
+        return self.__size_bytes
+
+    @property
+    def capacity(self):
+        return self.__capacity
+
+    def is_full(self):
+        return self.__capacity is not None and len(self.__messages) >= self.__capacity
+
+    def push(self, message):
+        """
+        Adds the message to the end of the queue.
+        :return: False if the queue is full, True otherwise
+        """
+        if self.is_full():
+            return False
+        self.__messages.append(message)
+        self.__size_bytes += message_size(message)
+        return True
+
+    def push_front(self, message):
+        """
+        Adds the message to the start of the queue, whatever the capacity.
+        """
+        self.__messages.appendleft(message)
+        self.__size_bytes += message_size(message)
+
+    def pop(self):
+        """
+        Removes and returns the first message of the queue.
+        """
+        message = self.__messages.popleft()
+        self.__size_bytes -= message_size(message)
+        return message
+
+    def peek(self, count):
+        """
+        Returns the first count messages without removing them.
+        """
+        return list(islice(self.__messages, count))
+
+    # json serialization
+    def json_encode(self):
+        return {
+            'capacity': self.__capacity,
+            'messages': list(self.__messages)
+        }
+
+    @classmethod
+    def json_decode(cls, json_dict):
+        queue = TopicQueue(json_dict['capacity'])
+        for message in json_dict['messages']:
+            queue.push(message)
+        return queue
+
+
+class PartitionedTopic:
+    """
+    Messages of a topic, spread over partitions which are each a FIFO TopicQueue. The messages with the same key go to
+    the same partition and keep their order, the other ones are spread round-robin. Consumers of different partitions
+    drain the topic in parallel. The round-robin positions are part of the state, so every node picks the same
+    partitions. Messages consumed with a lease stay in flight until they are acknowledged, or return to the start of
+    their partition once the lease expires.
+    """
+
+    def __init__(self, partitions=1, capacity=None):
+        self.__partitions = [TopicQueue() for _ in range(partitions)]
+        self.__capacity = capacity  # maximum number of messages of the topic, in flight included, None for unbounded
+        self.__next_push = 0  # partition of the next message without key
+        self.__next_pop = 0  # first partition tried by the next consumer without partition
+        self.__leases = dict()  # receipt -> (partition, message, deadline, sequence) of the messages in flight
+        self.__deadlines = []  # heap of (deadline, sequence, receipt), acknowledged receipts are skipped
+        self.__lease_sequence = 0  # order in which the leased messages were consumed
+
+    def __str__(self):
+        return f'PartitionedTopic(partitions="{self.partition_count}", depth="{self.depth}", ' \
+               f'capacity="{self.__capacity}")'
+
+    def __len__(self):
+        return self.depth
+
+    @property
+    def partition_count(self):
+        return len(self.__partitions)
+
+    @property
+    def depth(self):
+        return sum(partition.depth for partition in self.__partitions)
+
+    @property
+    def size_bytes(self):
+        return sum(partition.size_bytes for partition in self.__partitions)
+
+    @property
+    def capacity(self):
+        return self.__capacity
+
+    @property
+    def depths(self):
+        return [partition.depth for partition in self.__partitions]
+
+    @property
+    def in_flight(self):
+        return len(self.__leases)
+
+    @property
+    def next_deadline(self):
+        """
+        Deadline of the first lease to expire, None if no message is in flight.
+        """
+        while self.__deadlines and self.__deadlines[0][2] not in self.__leases:
+            heapq.heappop(self.__deadlines)
+        return self.__deadlines[0][0] if self.__deadlines else None
+
+    def is_full(self):
+        # the messages in flight count too, they return to the topic once their lease expires
+        return self.__capacity is not None and self.depth + self.in_flight >= self.__capacity
+
+    def partition_of(self, key):
+        """
+        Returns the partition of the messages with the key.
+        """
+        return zlib.crc32(str(key).encode('utf-8')) % len(self.__partitions)
+
+    def push(self, message, key=None, partition=None):
+        """
+        Adds the message to the end of a partition: the one given, otherwise the one of the key, otherwise the next one.
+        :return: the partition, None if the topic is full
+        :raise IndexError: if the partition does not exist
+        """
+        if partition is None:
+            if key is not None:
+                partition = self.partition_of(key)
+            else:
+                partition = self.__next_push
+                self.__next_push = (self.__next_push + 1) % len(self.__partitions)
+        queue = self.__partitions[partition]
+        if self.is_full():
+            return None
+        queue.push(message)
+        return partition
+
+    def assign(self, partition=None):
+        """
+        Picks the partition a consumer reads from: the one given, otherwise the next partition holding messages.
+        :return: the partition, None if the topic is empty
+        :raise IndexError: if the partition does not exist
+        """
+        if partition is not None:
+            return partition if self.__partitions[partition] else None
+        for offset in range(len(self.__partitions)):
+            candidate = (self.__next_pop + offset) % len(self.__partitions)
+            if self.__partitions[candidate]:
+                self.__next_pop = (candidate + 1) % len(self.__partitions)
+                return candidate
+        return None
+
+    def has_messages(self, partition=None):
+        if partition is None:
+            return self.depth > 0
+        return 0 <= partition < len(self.__partitions) and self.__partitions[partition].depth > 0
+
+    def pop(self, partition=None):
+        """
+        Removes and returns the first message of the partition, of the next partition holding messages if not given.
+        """
+        return self.__partitions[self.assign(partition)].pop()
+
+    def pop_many(self, count, partition):
+        """
+        Removes and returns up to count messages from the start of the partition.
+        """
+        queue = self.__partitions[partition]
+        return [queue.pop() for _ in range(min(count, len(queue)))]
+
+    def pop_leased(self, count, partition, receipt_prefix, deadline):
+        """
+        Removes up to count messages from the start of the partition and keeps them in flight until the deadline.
+        :param receipt_prefix: unique prefix of the receipts of the messages
+        :return: the messages and the receipts acknowledging them
+        """
+        messages = self.pop_many(count, partition)
+        receipts = []
+        for position, message in enumerate(messages):
+            receipt = f'{receipt_prefix}:{position}'
+            self.__lease(receipt, partition, message, deadline)
+            receipts.append(receipt)
+        return messages, receipts
+
+    def __lease(self, receipt, partition, message, deadline):
+        self.__lease_sequence += 1
+        self.__leases[receipt] = (partition, message, deadline, self.__lease_sequence)
+        heapq.heappush(self.__deadlines, (deadline, self.__lease_sequence, receipt))
+
+    def ack(self, receipt):
+        """
+        Deletes the message in flight.
+        :return: False if the receipt is unknown, or its lease expired
+        """
+        return self.__leases.pop(receipt, None) is not None
+
+    def expire(self, timestamp):
+        """
+        Returns the messages whose lease expired at the time to the start of their partition, in the order they were
+        consumed.
+        :return: number of messages returned
+        """
+        expired = []
+        while self.__deadlines and self.__deadlines[0][0] <= timestamp:
+            _, _, receipt = heapq.heappop(self.__deadlines)
+            lease = self.__leases.pop(receipt, None)
+            if lease is not None:
+                expired.append(lease)
+        for partition, message, _, _ in sorted(expired, key=lambda lease: lease[3], reverse=True):
+            self.__partitions[partition].push_front(message)
+        return len(expired)
+
+    def peek(self, count, partition=None):
+        """
+        Returns the first count messages of the partition without removing them, of all the partitions in order if
+        not given.
+        """
+        if partition is not None:
+            return self.__partitions[partition].peek(count)
+        messages = []
+        for queue in self.__partitions:
+            messages.extend(queue.peek(count - len(messages)))
+        return messages
+
+    # json serialization
+    def json_encode(self):
+        return {
+            'capacity': self.__capacity,
+            'partitions': [queue.json_encode()['messages'] for queue in self.__partitions],
+            'nextPush': self.__next_push,
+            'nextPop': self.__next_pop,
+            'leases': [[receipt] + list(lease) for receipt, lease in self.__leases.items()]
+        }
+
+    @classmethod
+    def json_decode(cls, json_dict):
+        """
+        Reads a topic, also from the snapshots taken before the partitions, which hold a single list of messages.
+        """
+        partitions = json_dict.get('partitions', [json_dict.get('messages', [])])
+        topic = PartitionedTopic(len(partitions), json_dict['capacity'])
+        for queue, messages in zip(topic.__partitions, partitions):
+            for message in messages:
+                queue.push(message)
+        topic.__next_push = json_dict.get('nextPush', 0)
+        topic.__next_pop = json_dict.get('nextPop', 0)
+        for receipt, partition, message, deadline, sequence in json_dict.get('leases', []):
+            topic.__lease_sequence = sequence - 1
+            topic.__lease(receipt, partition, message, deadline)
+        return topic
@@ -0,0 +1,320 @@
+import os
+import struct
+import threading
+import time
+import zlib
+from array import array
+from bisect import bisect_right
+from enum import Enum
+
+RECORD_HEADER = struct.Struct('>II')  # payload length, crc32 of the payload
+SEGMENT_SUFFIX = '.log'
+
+
+class FsyncPolicy(Enum):
+    ALWAYS = 'always'  # fsync after every append
+    BATCH = 'batch'  # fsync at most once every fsync interval
+    NEVER = 'never'  # leave flushing to the operating system
+
+
+def encode_record(payload):
+    return RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def segment_name(first_index):
+    return f'{first_index:020d}{SEGMENT_SUFFIX}'
+
+
+class Segment:
+    """
+    Append-only file holding consecutive log records, starting at log index first_index.
+    """
+
+    def __init__(self, path, first_index):
+        self.__path = path
+        self.__first_index = first_index
+        self.__file = open(path, 'a+b', buffering=0)
+        self.__offsets = array('q')  # file offset of every record in the segment
+        self.__size = 0
+
+    @property
+    def path(self):
+        return self.__path
+
+    @property
+    def first_index(self):
+        return self.__first_index
+
+    @property
+    def size(self):
+        return self.__size
+
+    @property
+    def entry_count(self):
+        return len(self.__offsets)
+
+    def recover(self):
+        """
+        Scans the segment and indexes its records. A torn or corrupted tail is cut off.
+        :return: list of the payloads read from the segment, and whether the segment was intact
+        """
+        payloads = []
+        self.__file.seek(0)
+        data = self.__file.read()
+        offset = 0
+        while offset + RECORD_HEADER.size <= len(data):
+            length, checksum = RECORD_HEADER.unpack_from(data, offset)
+            payload = data[offset + RECORD_HEADER.size:offset + RECORD_HEADER.size + length]
+            if len(payload) != length or zlib.crc32(payload) != checksum:
+                break
+            self.__offsets.append(offset)
+            payloads.append(payload)
+            offset += RECORD_HEADER.size + length
+        intact = offset == len(data)
+        if not intact:
+            print(f'Truncating corrupted tail of {self.__path} at offset {offset}.')
+            self.__file.truncate(offset)
+        self.__size = offset
+        return payloads, intact
+
+    def append(self, payloads):
+        records = []
+        for payload in payloads:
+            self.__offsets.append(self.__size)
+            record = encode_record(payload)
+            self.__size += len(record)
+            records.append(record)
+        self.__file.write(b''.join(records))
+
+    def read(self, index):
+        offset = self.__offsets[index - self.__first_index]
+        self.__file.seek(offset)
+        length, _ = RECORD_HEADER.unpack(self.__file.read(RECORD_HEADER.size))
+        return self.__file.read(length)
+
+    def truncate(self, index):
+        """
+        Deletes the records starting at the given log index.
+        """
+        position = index - self.__first_index
+        if position >= len(self.__offsets):
+            return
+        self.__size = self.__offsets[position]
+        del self.__offsets[position:]
+        self.__file.truncate(self.__size)
+
+    def sync(self):
+        os.fsync(self.__file.fileno())
+
+    def close(self):
+        self.__file.close()
+
+    def delete(self):
+        self.close()
+        os.remove(self.__path)
+
+
+class SegmentedLog:
+    """
+    Durable log made of append-only segment files with length-prefixed records.
+    Entries are read from disk through an in-memory index of the record offsets; the terms are kept in memory.
+    """
+
+    def __init__(self, log_dir, decode, encode, segment_bytes, fsync_policy=FsyncPolicy.BATCH, fsync_interval=50):
+        self.__log_dir = log_dir
+        self.__decode = decode  # payload bytes -> entry
+        self.__encode = encode  # entry -> payload bytes
+        self.__segment_bytes = segment_bytes
+        self.__fsync_policy = fsync_policy
+        self.__fsync_interval = fsync_interval  # milliseconds
+        self.__thread_lock = threading.RLock()
+        self.__segments = []
+        self.__first_indexes = []
+        self.__start_index = 0  # index of the first entry kept, older entries were compacted
+        self.__terms = array('q')
+        self.__sizes = array('q')  # record size of every entry
+        self.__size_bytes = 0
+        self.__last_sync = time.time() * 1000
+        self.__dirty = False
+        os.makedirs(log_dir, exist_ok=True)
+        self.__recover()
+        self.__synced_length = len(self)  # log length at the latest fsync
+
+    def __recover(self):
+        """
+        Rebuilds the index from the segment files. Segments after a gap or a corrupted record are deleted.
+        """
+        names = sorted(name for name in os.listdir(self.__log_dir) if name.endswith(SEGMENT_SUFFIX))
+        intact = True
+        for name in names:
+            path = os.path.join(self.__log_dir, name)
+            first_index = int(name[:-len(SEGMENT_SUFFIX)])
+            if self.__segments and (not intact or first_index != len(self)):
+                print(f'Deleting segment {path} following a gap or a corrupted segment.')
+                os.remove(path)
+                continue
+            segment = Segment(path, first_index)
+            payloads, intact = segment.recover()
+            if not self.__segments:
+                self.__start_index = first_index
+            self.__segments.append(segment)
+            self.__first_indexes.append(first_index)
+            self.__terms.extend(self.__decode(payload).term for payload in payloads)
+            self.__sizes.extend(RECORD_HEADER.size + len(payload) for payload in payloads)
+        self.__size_bytes = sum(self.__sizes)
+        print(f'Recovered {len(self.__terms)} log entries from {len(self.__segments)} segments in {self.__log_dir}.')
+
+    @property
+    def start_index(self):
+        return self.__start_index
+
+    @property
+    def size_bytes(self):
+        """
+        Size of the records of the entries kept in the log.
+        """
+        return self.__size_bytes
+
+    def __len__(self):
+        return self.__start_index + len(self.__terms)
+
+    @property
+    def durable_length(self):
+        """
+        Length of the log written to disk, fsynced unless the fsync policy is never.
+        """
+        return len(self) if self.__fsync_policy is FsyncPolicy.NEVER else self.__synced_length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not self.__start_index <= index < len(self):
+            raise IndexError('log index out of range')
+        with self.__thread_lock:
+            segment = self.__segments[bisect_right(self.__first_indexes, index) - 1]
+            return self.__decode(segment.read(index))
+
+    def __iter__(self):
+        for index in range(self.__start_index, len(self)):
+            yield self[index]
+
+    def term(self, index):
+        if index < 0:
+            index += len(self)
+        if index < self.__start_index:
+            raise IndexError('log index out of range')
+        return self.__terms[index - self.__start_index]
+
+    def size(self, index):
+        if index < 0:
+            index += len(self)
+        if index < self.__start_index:
+            raise IndexError('log index out of range')
+        return self.__sizes[index - self.__start_index]
+
+    def size_from(self, index):
+        """
+        Encoded size of the entries from index on.
+        """
+        return sum(self.__sizes[max(index - self.__start_index, 0):])
+
+    def extend(self, entries):
+        if not entries:
+            return
+        with self.__thread_lock:
+            payloads = [self.__encode(entry) for entry in entries]
+            if not self.__segments or self.__segments[-1].size >= self.__segment_bytes:
+                self.__roll_segment()
+            self.__segments[-1].append(payloads)
+            self.__terms.extend(entry.term for entry in entries)
+            sizes = [RECORD_HEADER.size + len(payload) for payload in payloads]
+            self.__sizes.extend(sizes)
+            self.__size_bytes += sum(sizes)
+            self.__dirty = True
+            if self.__fsync_policy is FsyncPolicy.ALWAYS:
+                self.sync()
+            else:
+                self.sync_if_due()
+
+    def __roll_segment(self):
+        first_index = len(self)
+        if self.__segments:
+            self.__segments[-1].sync()
+        path = os.path.join(self.__log_dir, segment_name(first_index))
+        self.__segments.append(Segment(path, first_index))
+        self.__first_indexes.append(first_index)
+
+    def truncate(self, index):
+        """
+        Deletes the entries starting at the given index.
+        """
+        with self.__thread_lock:
+            while self.__segments and self.__segments[-1].first_index >= index:
+                self.__segments.pop().delete()
+                self.__first_indexes.pop()
+            if self.__segments:
+                self.__segments[-1].truncate(index)
+            position = max(index - self.__start_index, 0)
+            self.__size_bytes -= sum(self.__sizes[position:])
+            del self.__terms[position:]
+            del self.__sizes[position:]
+            self.sync()
+
+    def compact(self, index):
+        """
+        Drops the entries before the given index. Only the segments holding no entry from index on are deleted.
+        """
+        with self.__thread_lock:
+            position = min(index, len(self)) - self.__start_index
+            if position <= 0:
+                return
+            while len(self.__segments) > 1 and self.__first_indexes[1] <= index:
+                self.__segments.pop(0).delete()
+                self.__first_indexes.pop(0)
+            self.__size_bytes -= sum(self.__sizes[:position])
+            del self.__terms[:position]
+            del self.__sizes[:position]
+            self.__start_index += position
+
+    def reset(self, index):
+        """
+        Deletes every entry. The next entry appended gets the given index.
+        """
+        with self.__thread_lock:
+            while self.__segments:
+                self.__segments.pop().delete()
+                self.__first_indexes.pop()
+            del self.__terms[:]
+            del self.__sizes[:]
+            self.__size_bytes = 0
+            self.__start_index = index
+            self.__synced_length = index
+
+    def sync(self):
+        with self.__thread_lock:
+            if self.__segments:
+                self.__segments[-1].sync()
+            self.__dirty = False
+            self.__synced_length = len(self)
+            self.__last_sync = time.time() * 1000
+
+    def sync_if_due(self):
+        """
+        Applies the batch fsync policy: syncs the pending writes if the fsync interval has elapsed.
+        :return: True if the writes were synced
+        """
+        if not self.__dirty or self.__fsync_policy is not FsyncPolicy.BATCH:
+            return False
+        if time.time() * 1000 - self.__last_sync >= self.__fsync_interval:
+            self.sync()
+            return True
+        return False
+
+    def close(self):
+        with self.__thread_lock:
+            if self.__dirty and self.__fsync_policy is not FsyncPolicy.NEVER:
+                self.sync()
+            for segment in self.__segments:
+                segment.close()
@@ -0,0 +1,103 @@
+import json
+import struct
+
+from src.log import LENGTH, NO_MESSAGE, LogEntry, pack_entry, unpack_entry
+
+JSON = 'application/json'
+BINARY = 'application/x-raft'  # struct layouts below, entries packed back to back by log.pack_entry
+ACCEPT_POST = f'{JSON}, {BINARY}'  # advertised by the nodes in the Accept-Post response header
+
+APPEND_HEADER = struct.Struct('>qqqqqI')  # term, leader id, prev log term, prev log index, leader commit, entry count
+# followed by the length prefixed leader address, then the entries
+VOTE_REQUEST = struct.Struct('>qqqq')  # term, candidate id, last log term, last log index
+
+
+def encode_entries(entries, parts):
+    parts.extend(pack_entry(entry) for entry in entries)
+
+
+def decode_entries(payload, offset, count):
+    entries = []
+    for _ in range(count):
+        entry, offset = unpack_entry(payload, offset)
+        entries.append(entry)
+    return entries, offset
+
+
+def encode_text(text, parts):
+    if text is None:
+        parts.append(LENGTH.pack(NO_MESSAGE))
+        return
+    encoded = text.encode('utf-8')
+    parts.append(LENGTH.pack(len(encoded)))
+    parts.append(encoded)
+
+
+def decode_text(payload, offset):
+    length, = LENGTH.unpack_from(payload, offset)
+    offset += LENGTH.size
+    if length == NO_MESSAGE:
+        return None, offset
+    return bytes(payload[offset:offset + length]).decode('utf-8'), offset + length
+
+
+def encode_append_request(data, content_type):
+    """
+    Encodes an append request whose entries are LogEntry objects.
+    """
+    if content_type != BINARY:
+        return json.dumps(dict(data, entries=[entry.json_encode() for entry in data['entries']])).encode('utf-8')
+    parts = [APPEND_HEADER.pack(data['term'], data['leaderId'], data['prevLogTerm'], data['prevLogIndex'],
+                                data['leaderCommit'], len(data['entries']))]
+    encode_text(data.get('leaderAddress'), parts)
+    encode_entries(data['entries'], parts)
+    return b''.join(parts)
+
+
+def decode_append_request(payload, content_type):
+    """
+    Decodes an append request. The entries are returned as LogEntry objects.
+    """
+    if content_type != BINARY:
+        data = json.loads(payload.decode('utf-8'))
+        data['entries'] = [LogEntry.json_decode(entry) for entry in data['entries']]
+        return data
+    term, leader_id, prev_log_term, prev_log_index, leader_commit, count = APPEND_HEADER.unpack_from(payload, 0)
+    leader_address, offset = decode_text(payload, APPEND_HEADER.size)
+    entries, _ = decode_entries(payload, offset, count)
+    return {
+        'term': term,
+        'leaderId': leader_id,
+        'leaderAddress': leader_address,
+        'prevLogTerm': prev_log_term,
+        'prevLogIndex': prev_log_index,
+        'entries': entries,
+        'leaderCommit': leader_commit
+    }
+
+
+def encode_vote_request(data, content_type):
+    if content_type != BINARY:
+        return json.dumps(data).encode('utf-8')
+    return VOTE_REQUEST.pack(data['term'], data['candidateId'], data['lastLogTerm'], data['lastLogIndex'])
+
+
+def decode_vote_request(payload, content_type):
+    if content_type != BINARY:
+        return json.loads(payload.decode('utf-8'))
+    term, candidate_id, last_log_term, last_log_index = VOTE_REQUEST.unpack(payload)
+    return {'term': term, 'candidateId': candidate_id, 'lastLogTerm': last_log_term, 'lastLogIndex': last_log_index}
+
+
+ENCODERS = {'logs/append': encode_append_request, 'election/vote': encode_vote_request}
+
+
+def encode_request(service_url, data, content_type):
+    """
+    Encodes the body of a request between nodes. Only the Raft RPCs have a binary encoding, other requests are JSON.
+    :return: body and its content type
+    """
+    encode = ENCODERS.get(service_url)
+    if encode is None:
+        return json.dumps(data).encode('utf-8'), JSON
+    return encode(data, content_type), content_type if content_type == BINARY else JSON
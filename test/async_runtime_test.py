@@ -0,0 +1,246 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+import src.node as mq_server
+from src import raft
+from src.async_runtime import AsyncRuntime, PeerClient
+from src.placement import Placement
+
+
+@pytest.fixture(autouse=True)
+def set_up():
+    mq_server.topic_queues.clear()
+    mq_server.results.clear()
+
+
+async def call(runtime, method, path, body=None, query=''):
+    """
+    Sends a request to the ASGI application.
+    :return: status code and decoded body of the response
+    """
+    messages = [{'type': 'http.request', 'body': b'' if body is None else json.dumps(body).encode('utf-8')}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query.encode('latin-1'), 'headers': []}
+    await runtime(scope, receive, send)
+    payload = sent[1]['body'].decode('utf-8')
+    return sent[0]['status'], json.loads(payload) if sent[0]['status'] != 403 else payload
+
+
+async def start(sibling_nodes=()):
+    """
+    Starts a runtime on the running loop and waits until its node is elected.
+    """
+    mq_server.node = raft.Node(0, list(sibling_nodes))
+    runtime = AsyncRuntime(mq_server)
+    runtime.start()
+    assert await runtime.wait_for(lambda: mq_server.node.is_leader(), 3)
+    return runtime
+
+
+async def serve_follower(appends, connections=None):
+    """
+    Starts a fake follower which votes for every candidate and accepts every append request.
+    """
+
+    async def handle(reader, writer):
+        if connections is not None:
+            connections.append(writer)
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line == b'\r\n':
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            body = json.loads(await reader.readexactly(int(headers['content-length'])))
+            if b'/election/vote' in request_line:
+                output = {'vote': True, 'term': body['term']}
+            else:
+                appends.append(body)
+                output = {'success': True, 'term': body['term']}
+            payload = json.dumps(output).encode('utf-8')
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n%s' % (
+                len(payload), payload))
+            await writer.drain()
+        writer.close()
+
+    return await asyncio.start_server(handle, '127.0.0.1', 0)
+
+
+def test_topics_and_messages():
+    async def scenario():
+        runtime = await start()
+        assert await call(runtime, 'PUT', '/topic', {'topic': 'a'}) == (200, {'success': True})
+        assert await call(runtime, 'PUT', '/topic', {'topic': 'a'}) == (200, {'success': False})
+        assert await call(runtime, 'GET', '/topic') == (200, {'success': True, 'topics': ['a']})
+        assert await call(runtime, 'GET', '/message/a') == (200, {'success': False})
+        assert (await call(runtime, 'PUT', '/message', {'topic': 'a', 'message': '1'}))[1]['success']
+        messages = {'messages': [{'topic': 'a', 'message': '2'}, {'topic': 'a', 'message': '3'}]}
+        assert (await call(runtime, 'PUT', '/messages', messages))[1]['success']
+        status, output = await call(runtime, 'GET', '/topic/a', query='peek=1')
+        assert output['depth'] == 3 and output['messages'] == ['1']
+        assert await call(runtime, 'GET', '/message/a') == (200, {'success': True, 'message': '1'})
+        assert await call(runtime, 'GET', '/message/a', query='max=5') == (
+            200, {'success': True, 'messages': ['2', '3']})
+        await runtime.stop()
+
+    asyncio.run(scenario())
+
+
+def test_long_poll():
+    async def scenario():
+        runtime = await start()
+        await call(runtime, 'PUT', '/topic', {'topic': 'a'})
+        started = time.time()
+        consumer = asyncio.ensure_future(call(runtime, 'GET', '/message/a', query='wait=5'))
+        await asyncio.sleep(0.1)
+        assert not consumer.done()
+        await call(runtime, 'PUT', '/message', {'topic': 'a', 'message': 'late'})
+        assert await consumer == (200, {'success': True, 'message': 'late'})
+        assert time.time() - started < 1
+        # many consumers wait on the same loop without a thread each
+        consumers = [asyncio.ensure_future(call(runtime, 'GET', '/message/a', query='wait=0.2')) for _ in range(500)]
+        assert all(output == (200, {'success': False}) for output in await asyncio.gather(*consumers))
+        await runtime.stop()
+
+    asyncio.run(scenario())
+
+
+def test_follower_requests():
+    async def scenario():
+        mq_server.node = raft.Node(0, ['127.0.0.1:1'])
+        runtime = AsyncRuntime(mq_server)
+        assert await call(runtime, 'PUT', '/topic', {'topic': 'a'}) == (403, 'Only leader node can serve requests.')
+        # routes which never wait are served by the Flask app
+        assert await call(runtime, 'GET', '/status') == (200, {'role': 'Follower', 'term': -1})
+
+    asyncio.run(scenario())
+
+
+async def serve_recorder(requests):
+    """
+    Starts a fake node which records the requests it receives and answers them with a success.
+    """
+
+    async def handle(reader, writer):
+        request_line = await reader.readline()
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line == b'\r\n':
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        requests.append((request_line, headers, await reader.readexactly(int(headers['content-length']))))
+        writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: 17\r\n\r\n'
+                     b'{"success": true}')
+        await writer.drain()
+        writer.close()
+
+    server = await asyncio.start_server(handle, '127.0.0.1', 0)
+    return server, '127.0.0.1:%d' % server.sockets[0].getsockname()[1]
+
+
+def test_follower_forwards_to_leader():
+    async def scenario():
+        requests = []
+        leader, address = await serve_recorder(requests)
+        mq_server.node = raft.Node(1, [address])
+        mq_server.node.leader_address = address
+        runtime = AsyncRuntime(mq_server)
+        assert await call(runtime, 'PUT', '/topic', {'topic': 'a'}) == (200, {'success': True})
+        request_line, headers, body = requests[0]
+        assert request_line == b'PUT /topic HTTP/1.1\r\n'
+        assert json.loads(body) == {'topic': 'a'}
+        assert 'x-raft-forwarded-by' in headers
+        leader.close()
+        await leader.wait_closed()
+
+    asyncio.run(scenario())
+
+
+def test_request_routed_to_group():
+    async def scenario():
+        requests = []
+        other_group, address = await serve_recorder(requests)
+        mq_server.placement = Placement(2, {'a': 0, 'b': 1})
+        mq_server.group_nodes = {0: 'localhost:91', 1: address}
+        runtime = await start()
+        try:
+            assert await call(runtime, 'PUT', '/topic', {'topic': 'b'}) == (200, {'success': True})
+            request_line, headers, body = requests[0]
+            assert request_line == b'PUT /topic HTTP/1.1\r\n'
+            assert 'x-raft-forwarded-by' not in headers
+            assert await call(runtime, 'PUT', '/topic', {'topic': 'a'}) == (200, {'success': True})
+            assert list(mq_server.topic_queues) == ['a']
+            messages = {'messages': [{'topic': 'a', 'message': 'c'}, {'topic': 'b', 'message': 'd'}]}
+            status, output = await call(runtime, 'PUT', '/messages', messages)
+            assert status == 400
+            assert len(requests) == 1
+            # the topics of the other group are listed by its node, which does not ask this group in turn
+            assert await call(runtime, 'GET', '/topic') == (200, {'success': True, 'topics': ['a']})
+            assert requests[1][0] == b'GET /topic?local HTTP/1.1\r\n'
+            assert await call(runtime, 'GET', '/topic', query='local') == (200, {'success': True, 'topics': ['a']})
+            assert len(requests) == 2
+        finally:
+            mq_server.placement = Placement()
+            mq_server.group_nodes = {}
+            await runtime.stop()
+            other_group.close()
+            await other_group.wait_closed()
+
+    asyncio.run(scenario())
+
+
+def test_replication():
+    async def scenario():
+        appends = []
+        follower = await serve_follower(appends)
+        address = '127.0.0.1:%d' % follower.sockets[0].getsockname()[1]
+        runtime = await start([address])
+        assert await call(runtime, 'PUT', '/topic', {'topic': 'a'}) == (200, {'success': True})
+        entries = [entry for append in appends for entry in append['entries']]
+        assert len(entries) == 2  # the no-op entry of the term and the topic
+        assert mq_server.node.match_index[address] == 1
+        # idle followers get heartbeats
+        count = len(appends)
+        await asyncio.sleep(mq_server.HEARTBEAT_INTERVAL * 3)
+        assert len(appends) > count
+        await runtime.stop()
+        follower.close()
+        await follower.wait_closed()
+
+    asyncio.run(scenario())
+
+
+def test_peer_client_reuses_connections():
+    async def scenario():
+        appends = []
+        connections = []
+        follower = await serve_follower(appends, connections)
+        address = '127.0.0.1:%d' % follower.sockets[0].getsockname()[1]
+        client = PeerClient(2)
+        for term in range(5):
+            response = await client.post(address, 'logs/append', {'term': term, 'entries': []}, 1)
+            assert response == {'success': True, 'term': term}
+        assert len(appends) == 5
+        assert len(connections) == 1
+        client.close()
+        follower.close()
+        await follower.wait_closed()
+
+    asyncio.run(scenario())
@@ -0,0 +1,84 @@
+import json
+import threading
+import time
+
+import pytest
+
+import src.node as mq_server
+from src import raft
+from src.log import LogEntry, Command, Operation
+from src.raft import Role
+
+node = None
+
+
+@pytest.fixture
+def client():
+    mq_server.node = node
+    mq_server.topic_queues = {}
+    return mq_server.app.test_client()
+
+
+@pytest.fixture(autouse=True)
+def set_up():
+    global node
+    node = raft.Node(0, [])
+    node.term = 1
+    node.transition_to_new_role(Role.LEADER)
+
+
+def commit_and_apply(delay):
+    time.sleep(delay)
+    node.committed_index = node.logs.log_size - 1
+    mq_server.apply_state_machine()
+
+
+def test_request_wakes_up_when_applied(client):
+    applier = threading.Thread(target=commit_and_apply, args=(0.2,))
+    applier.start()
+    start = time.time()
+    response = client.put('/topic', json={'topic': 'topic1'})
+    applier.join()
+    assert response.status_code == 200
+    assert response.get_json() == {'success': True}
+    assert time.time() - start < 1
+
+
+def test_request_timeout(client):
+    response = client.put('/topic?timeout=0.1', json={'topic': 'topic1'})
+    assert response.status_code == 504
+    assert response.get_json() == {'success': False, 'error': 'Request timed out.'}
+
+
+def test_request_fails_when_entry_is_overwritten(client):
+    def overwrite_entry():
+        time.sleep(0.2)
+        message = {
+            'term': 2,
+            'leaderId': 1,
+            'prevLogTerm': -1,
+            'prevLogIndex': -1,
+            'entries': [LogEntry(2, None).json_encode()],
+            'leaderCommit': -1
+        }
+        mq_server.app.test_client().post('/logs/append', json=message)
+
+    overwriter = threading.Thread(target=overwrite_entry)
+    overwriter.start()
+    response = client.put('/topic', json={'topic': 'topic1'})
+    overwriter.join()
+    assert response.status_code == 503
+
+
+def test_apply_drains_committed_backlog(client, monkeypatch):
+    monkeypatch.setattr(mq_server, 'APPLY_BATCH_LIMIT', 3)
+    node.logs.append(LogEntry(1, Command('1', Operation.PUT_TOPIC, json.dumps({'topic': 'topic1', 'capacity': None}))))
+    for i in range(10):
+        node.logs.append(LogEntry(1, Command(str(i + 2), Operation.PUT_MESSAGE,
+                                             json.dumps({'topic': 'topic1', 'message': f'msg{i}'}))))
+    node.committed_index = 8
+    assert client.get('/metrics').get_json()['applyBacklog'] == 9
+    mq_server.apply_state_machine()
+    assert node.last_applied == 8
+    assert len(mq_server.topic_queues['topic1']) == 8
+    assert client.get('/metrics').get_json()['applyBacklog'] == 0
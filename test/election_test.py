@@ -15,8 +15,8 @@ PROGRAM_FILE_PATH = "src/node.py"
 
 
 @pytest.fixture
-def swarm(num_nodes):
-    swarm = Swarm(PROGRAM_FILE_PATH, num_nodes)
+def swarm(num_nodes, tmp_path):
+    swarm = Swarm(PROGRAM_FILE_PATH, num_nodes, str(tmp_path / 'config.json'))
     swarm.start(ELECTION_TIMEOUT)
     yield swarm
     swarm.clean()
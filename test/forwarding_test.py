@@ -0,0 +1,108 @@
+import json
+
+import pytest
+import requests_mock
+
+import src.node as mq_server
+from src import raft, rest_client, wire
+from src.placement import Placement
+
+
+@pytest.fixture
+def client():
+    return mq_server.app.test_client()
+
+
+@pytest.fixture(autouse=True)
+def set_up():
+    mq_server.node = raft.Node(1, ['localhost:90', 'localhost:92'])
+    mq_server.address = 'localhost:91'
+    yield
+    mq_server.address = None
+    mq_server.FORWARD_REQUESTS = True
+    mq_server.placement = Placement()
+    mq_server.group_nodes = {}
+
+
+def follow(client, leader_address):
+    data = {'term': 1, 'leaderId': 0, 'leaderAddress': leader_address, 'prevLogTerm': -1, 'prevLogIndex': -1,
+            'entries': [], 'leaderCommit': -1}
+    response = client.post('/logs/append', data=wire.encode_append_request(data, wire.BINARY),
+                           content_type=wire.BINARY)
+    assert response.json['success']
+
+
+def test_unknown_leader(client):
+    response = client.put('/message', data=json.dumps({'topic': 'a', 'message': 'b'}))
+    assert response.status_code == 403
+    assert rest_client.LEADER_HEADER not in response.headers
+
+
+def test_forward_to_leader(client):
+    follow(client, 'localhost:90')
+    assert mq_server.node.leader_address == 'localhost:90'
+    with requests_mock.Mocker() as mocker:
+        mocker.put('http://localhost:90/message', json={'success': True}, headers={'Content-Type': 'application/json'})
+        mocker.get('http://localhost:90/message/a?max=2&wait=1', json={'success': True, 'messages': ['b']})
+        body = json.dumps({'topic': 'a', 'message': 'b'})
+        response = client.put('/message', data=body, content_type='application/json')
+        assert response.status_code == 200
+        assert response.json == {'success': True}
+        assert response.headers[rest_client.LEADER_HEADER] == 'localhost:90'
+        assert mocker.request_history[0].text == body
+        assert mocker.request_history[0].headers[rest_client.FORWARDED_HEADER] == 'localhost:91'
+        response = client.get('/message/a?max=2&wait=1')
+        assert response.json == {'success': True, 'messages': ['b']}
+        # the leader could not serve it, a forwarded request is not forwarded again
+        response = client.put('/message', data=body, headers={rest_client.FORWARDED_HEADER: 'localhost:92'})
+        assert response.status_code == 403
+        assert mocker.call_count == 2
+    # the leader is down
+    with requests_mock.Mocker() as mocker:
+        mocker.put('http://localhost:90/message', exc=ConnectionError)
+        response = client.put('/message', data=body)
+        assert response.status_code == 503
+
+
+def test_redirect_to_leader(client):
+    mq_server.FORWARD_REQUESTS = False
+    follow(client, 'localhost:90')
+    response = client.get('/topic/a?peek=1')
+    assert response.status_code == 307
+    assert response.headers['Location'] == 'http://localhost:90/topic/a?peek=1'
+
+
+def test_leader_forgotten_in_new_term(client):
+    follow(client, 'localhost:90')
+    mq_server.update_term_return_to_follower(2)
+    assert mq_server.node.leader_address is None
+
+
+def test_route_to_group(client):
+    mq_server.placement = Placement(2, {'a': 0, 'b': 1, 'c': 1})
+    mq_server.group_nodes = {0: 'localhost:91', 1: 'localhost:191'}
+    with requests_mock.Mocker() as mocker:
+        mocker.put('http://localhost:191/message', json={'success': True})
+        mocker.put('http://localhost:191/messages', json={'success': True})
+        mocker.get('http://localhost:191/message/b?wait=1', json={'success': True, 'message': 'c'})
+        body = json.dumps({'topic': 'b', 'message': 'c'})
+        response = client.put('/message', data=body, content_type='application/json')
+        assert response.json == {'success': True}
+        # the node of the other group forwards it to its leader, so it is not marked as forwarded
+        assert rest_client.FORWARDED_HEADER not in mocker.request_history[0].headers
+        response = client.get('/message/b?wait=1')
+        assert response.json == {'success': True, 'message': 'c'}
+        body = json.dumps({'messages': [{'topic': 'b', 'message': 'd'}, {'topic': 'c', 'message': 'e'}]})
+        response = client.put('/messages', data=body, content_type='application/json')
+        assert response.json == {'success': True}
+        assert mocker.call_count == 3
+    # topics of this group are served by its own leader, which is not known yet
+    response = client.put('/message', data=json.dumps({'topic': 'a', 'message': 'b'}))
+    assert response.status_code == 403
+    body = json.dumps({'messages': [{'topic': 'a', 'message': 'd'}, {'topic': 'b', 'message': 'e'}]})
+    response = client.put('/messages', data=body)
+    assert response.status_code == 400
+    mq_server.FORWARD_REQUESTS = False
+    response = client.get('/topic/c?peek=1')
+    assert response.status_code == 307
+    assert response.headers['Location'] == 'http://localhost:191/topic/c?peek=1'
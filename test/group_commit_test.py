@@ -0,0 +1,92 @@
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import src.node as mq_server
+from src import raft
+from src.group_commit import GroupCommitter
+from src.log import Command, Operation
+from src.raft import Role
+
+
+def test_concurrent_commands_are_batched():
+    batches = []
+
+    def append(commands):
+        batches.append(list(commands))
+        return len(batches) - 1
+
+    committer = GroupCommitter(append, window=0.05, max_size=1000)
+    with ThreadPoolExecutor(max_workers=20) as executor:
+        positions = list(executor.map(committer.submit, range(20)))
+    assert len(batches) < 20
+    assert sorted(command for batch in batches for command in batch) == list(range(20))
+    for command, position in enumerate(positions):
+        assert command in batches[position]
+
+
+def test_batch_size_limit():
+    batches = []
+    barrier = threading.Barrier(10)
+
+    def submit(command):
+        barrier.wait()
+        return committer.submit(command)
+
+    committer = GroupCommitter(lambda commands: batches.append(list(commands)), window=1, max_size=5)
+    with ThreadPoolExecutor(max_workers=10) as executor:
+        list(executor.map(submit, range(10)))
+    assert [len(batch) for batch in batches] == [5, 5]
+
+
+def test_commands_keep_their_order_within_a_batch():
+    committer = GroupCommitter(lambda commands: list(commands), window=0.01, max_size=100)
+    order = []
+
+    def produce(producer):
+        for i in range(5):
+            batch = committer.submit((producer, i))
+            order.extend(command for command in batch if command[0] == producer and command[1] == i)
+
+    threads = [threading.Thread(target=produce, args=(producer,)) for producer in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for producer in range(4):
+        assert [i for p, i in order if p == producer] == list(range(5))
+
+
+def test_apply_batch_entry():
+    node = raft.Node(0, [])
+    node.term = 1
+    node.transition_to_new_role(Role.LEADER)
+    mq_server.node = node
+    mq_server.topic_queues = {}
+    commands = [Command('t', Operation.PUT_TOPIC, json.dumps({'topic': 'topic1', 'capacity': None}))]
+    commands += [Command(f'm{i}', Operation.PUT_MESSAGE, json.dumps({'topic': 'topic1', 'message': f'msg{i}'}))
+                 for i in range(3)]
+    commands.append(Command('g', Operation.GET_MESSAGE, 'topic1'))
+    for command in commands:
+        mq_server.results.expect(command.id)
+    term, log_index = mq_server.append_commands(commands)
+    assert node.logs.entries[log_index].command.operation is Operation.BATCH
+    node.committed_index = log_index
+    mq_server.apply_state_machine()
+    assert mq_server.results['t'] == {'success': True}
+    assert mq_server.results['m2'] == {'success': True}
+    assert mq_server.results['g'] == {'success': True, 'message': 'msg0'}
+    assert mq_server.topic_queues['topic1'].depth == 2
+
+
+def test_no_append_after_stepping_down():
+    node = raft.Node(0, ['localhost:91', 'localhost:92'])
+    node.term = 1
+    node.transition_to_new_role(Role.LEADER)
+    mq_server.node = node
+    # a higher term arrives while the requests wait in the group commit window
+    mq_server.update_term_return_to_follower(2)
+    with mq_server.app.test_request_context('/message', method='PUT'):
+        response = mq_server.submit_command(Command('1', Operation.NOOP))
+    assert response.status_code == 503
+    assert node.logs.log_size == 0
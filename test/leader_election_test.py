@@ -143,3 +143,27 @@ def test_initiate_leader_election():
         mq_server.initiate_leader_election()
         assert node.role == Role.FOLLOWER
         assert node.term == 4
+
+
+def test_vote_once_per_term(client):
+    headers = {'content-type': 'application/json'}
+    candidate = mq_server.node = raft.Node(1, ['localhost:90', 'localhost:92'])
+    candidate.transition_to_new_role(Role.CANDIDATE)
+    candidate.increment_term()
+    # a candidate voted for itself, it does not vote for a rival of its term
+    assert candidate.voted_for == 1
+    message = {'term': candidate.term, 'candidateId': 2, 'lastLogIndex': -1, 'lastLogTerm': -1}
+    response = client.post('/election/vote', data=json.dumps(message), headers=headers)
+    assert response.json['vote'] == False
+
+    # a vote for the candidate 0 counts as a vote
+    follower = mq_server.node = raft.Node(1, ['localhost:90', 'localhost:92'])
+    message = {'term': 1, 'candidateId': 0, 'lastLogIndex': -1, 'lastLogTerm': -1}
+    assert client.post('/election/vote', data=json.dumps(message), headers=headers).json['vote'] == True
+    assert follower.voted_for == 0
+    message['candidateId'] = 2
+    assert client.post('/election/vote', data=json.dumps(message), headers=headers).json['vote'] == False
+    # a new term resets the vote
+    message['term'] = 2
+    assert client.post('/election/vote', data=json.dumps(message), headers=headers).json['vote'] == True
+    mq_server.node = node
@@ -1,12 +1,18 @@
 import json
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
 
 import pytest
+import requests
 import requests_mock
 
 import src.node as mq_server
-from src import raft
+from src import raft, rest_client, wire
 from src.log import LogEntry, Command, Operation
 from src.raft import Role
+from src.wal import FsyncPolicy
 
 node = None
 
@@ -43,7 +49,7 @@ def test_sync_logs_failures(client):
         'leaderId': 3,
         'prevLogTerm': 2,
         'prevLogIndex': 2,
-        'entry': None,
+        'entries': [],
         'leaderCommit': 5
     }
     response = client.post('/logs/append', data=json.dumps(message), headers=headers)
@@ -69,6 +75,16 @@ def test_sync_logs_failures(client):
     assert response.status_code == 200
     assert data['success'] == False
     assert data['term'] == 3
+    # the follower reports the term of its conflicting entry and the first index of that term
+    assert data['conflictTerm'] == 1
+    assert data['conflictIndex'] == 0
+    message['prevLogIndex'] = 3
+    message['prevLogTerm'] = 3
+    data = client.post('/logs/append', data=json.dumps(message), headers=headers).json
+    assert (data['conflictTerm'], data['conflictIndex']) == (2, 2)
+    message['prevLogIndex'] = 5
+    data = client.post('/logs/append', data=json.dumps(message), headers=headers).json
+    assert (data['conflictTerm'], data['conflictIndex']) == (-1, 5)
 
 
 def test_sync_logs_success(client):
@@ -79,7 +95,7 @@ def test_sync_logs_success(client):
         'leaderId': 3,
         'prevLogTerm': 3,
         'prevLogIndex': 4,
-        'entry': None,
+        'entries': [],
         'leaderCommit': 5
     }
     response = client.post('/logs/append', data=json.dumps(message), headers=headers)
@@ -97,7 +113,7 @@ def test_sync_logs_success(client):
         'leaderId': 3,
         'prevLogTerm': 2,
         'prevLogIndex': 2,
-        'entry': LogEntry(3, Command(1, Operation.GET_TOPICS, '')).json_encode(),
+        'entries': [LogEntry(3, Command(1, Operation.GET_TOPICS, '')).json_encode()],
         'leaderCommit': 5
     }
     response = client.post('/logs/append', data=json.dumps(message), headers=headers)
@@ -110,6 +126,53 @@ def test_sync_logs_success(client):
     assert node.committed_index == 3
 
 
+def test_sync_logs_batch(client):
+    headers = {'content-type': 'application/json'}
+    # append a batch, part of which is already present on the follower
+    message = {
+        'term': 3,
+        'leaderId': 3,
+        'prevLogTerm': 1,
+        'prevLogIndex': 1,
+        'entries': [LogEntry(2, None).json_encode(), LogEntry(2, None).json_encode(),
+                    LogEntry(3, None).json_encode(), LogEntry(3, None).json_encode(),
+                    LogEntry(3, None).json_encode()],
+        'leaderCommit': 5
+    }
+    response = client.post('/logs/append', data=json.dumps(message), headers=headers)
+    data = json.loads(response.data.decode('utf-8'))
+    assert data['success'] == True
+    assert node.logs.log_size == 7
+    assert [entry.term for entry in node.logs.entries] == [1, 1, 2, 2, 3, 3, 3]
+    assert node.committed_index == 5
+
+    # a stale, shorter batch must not truncate the entries appended after it
+    message['entries'] = message['entries'][:2]
+    response = client.post('/logs/append', data=json.dumps(message), headers=headers)
+    data = json.loads(response.data.decode('utf-8'))
+    assert data['success'] == True
+    assert node.logs.log_size == 7
+
+
+def test_append_entries_pipelined(client, monkeypatch):
+    monkeypatch.setattr(mq_server, 'MAX_APPEND_ENTRIES', 2)
+    node.next_index['localhost:91'] = 0
+    node.next_index['localhost:92'] = 0
+    node.next_index['localhost:93'] = 5
+    node.match_index.update({server: -1 for server in node.sibling_nodes})
+    with requests_mock.Mocker() as mocker:
+        for server in node.sibling_nodes:
+            mocker.post(f'http://{server}/logs/append', json={'success': True, 'term': 3}, status_code=200)
+        mq_server.append_entries()
+        batches = [json.loads(request.text) for request in mocker.request_history
+                   if request.url == 'http://localhost:91/logs/append']
+        assert sorted(len(batch['entries']) for batch in batches) == [1, 2, 2]
+        assert sorted(batch['prevLogIndex'] for batch in batches) == [-1, 1, 3]
+    for server in node.sibling_nodes:
+        assert node.next_index[server] == 5
+        assert node.match_index[server] == 4
+
+
 def test_append_entries(client):
     node.next_index['localhost:91'] = 5
     node.next_index['localhost:92'] = 3
@@ -120,10 +183,10 @@ def test_append_entries(client):
         mocker.post('http://localhost:93/logs/append', json={'success': False, 'term': 3}, status_code=200)
         mq_server.append_entries()
         assert node.next_index['localhost:91'] == 5
-        assert node.next_index['localhost:92'] == 4
+        assert node.next_index['localhost:92'] == 5
         assert node.next_index['localhost:93'] == 1
         assert node.match_index['localhost:91'] == 4
-        assert node.match_index['localhost:92'] == 2
+        assert node.match_index['localhost:92'] == 4
 
     with requests_mock.Mocker() as mocker:
         mocker.post('http://localhost:91/logs/append', json={'success': False, 'term': 4}, status_code=200)
@@ -132,3 +195,236 @@ def test_append_entries(client):
         mq_server.append_entries()
         assert node.role == Role.FOLLOWER
         assert node.term == 4
+
+
+def test_replication_loop_slow_follower(client, monkeypatch):
+    send = rest_client.send
+
+    def slow_send(method, hostname, *args, **kwargs):
+        if hostname == 'localhost:91':
+            time.sleep(0.5)
+        return send(method, hostname, *args, **kwargs)
+
+    monkeypatch.setattr(rest_client, 'send', slow_send)
+    node.transition_to_new_role(Role.LEADER)
+    node.prepare_for_leadership()
+    with requests_mock.Mocker() as mocker:
+        for server in node.sibling_nodes:
+            mocker.post(f'http://{server}/logs/append', json={'success': True, 'term': 3}, status_code=200)
+        mq_server.start_replicators()
+        threads = [thread for _, thread in mq_server.replicators.values()]
+        # the slow follower does not delay the commit on the other two
+        deadline = time.time() + 0.3
+        while node.committed_index < 4 and time.time() < deadline:
+            time.sleep(0.01)
+        assert node.committed_index == 4
+
+        # new entries are sent right away instead of waiting for the next heartbeat
+        _, index = mq_server.append_commands([Command('1', Operation.NOOP)])
+        deadline = time.time() + mq_server.HEARTBEAT_INTERVAL / 2
+        while node.committed_index < index and time.time() < deadline:
+            time.sleep(0.001)
+        assert node.committed_index == index
+
+        mq_server.update_term_return_to_follower(4)
+        for thread in threads:
+            thread.join(1)
+            assert not thread.is_alive()
+
+
+def test_replication_loop_unreachable_follower(client):
+    node.transition_to_new_role(Role.LEADER)
+    node.prepare_for_leadership()
+    node.next_index['localhost:92'] = 1  # the follower is missing entries
+    with requests_mock.Mocker() as mocker:
+        mocker.post('http://localhost:92/logs/append', exc=requests.exceptions.ConnectionError)
+        mq_server.replication_events.setdefault('localhost:92', threading.Event())
+        thread = threading.Thread(target=mq_server.run_replicator, args=('localhost:92', node.term), daemon=True)
+        thread.start()
+        time.sleep(0.3)
+        mq_server.update_term_return_to_follower(4)
+        thread.join(1)
+        assert not thread.is_alive()
+        # the loop waits a heartbeat interval after a round without any reply instead of retrying right away
+        assert 0 < mocker.call_count <= 0.3 / mq_server.HEARTBEAT_INTERVAL + 2
+
+
+def test_sync_logs_binary(client):
+    message = {
+        'term': 3,
+        'leaderId': 3,
+        'prevLogTerm': 3,
+        'prevLogIndex': 4,
+        'entries': [LogEntry(3, Command(str(uuid.uuid4()), Operation.PUT_MESSAGE, '{"topic": "a"}')),
+                    LogEntry(3, None)],
+        'leaderCommit': 5
+    }
+    body, content_type = wire.encode_request('logs/append', message, wire.BINARY)
+    response = client.post('/logs/append', data=body, headers={'content-type': content_type})
+    data = json.loads(response.data.decode('utf-8'))
+    assert data['success'] == True
+    assert response.headers['Accept-Post'] == wire.ACCEPT_POST
+    assert node.logs.log_size == 7
+    assert node.logs.entries[5].command.json_encode() == message['entries'][0].command.json_encode()
+    assert node.logs.entries[6].command is None
+
+
+def test_append_entries_negotiates_wire_format(client, monkeypatch):
+    monkeypatch.setattr(rest_client, 'accepted_types', {})
+    node.next_index.update({server: 4 for server in node.sibling_nodes})
+    with requests_mock.Mocker() as mocker:
+        mocker.post('http://localhost:91/logs/append', json={'success': True, 'term': 3},
+                    headers={'Accept-Post': wire.ACCEPT_POST}, status_code=200)
+        for server in ['localhost:92', 'localhost:93']:
+            mocker.post(f'http://{server}/logs/append', json={'success': True, 'term': 3}, status_code=200)
+        mq_server.append_entries()
+        node.next_index.update({server: 4 for server in node.sibling_nodes})
+        mq_server.append_entries()
+        requests = [request for request in mocker.request_history if request.url == 'http://localhost:91/logs/append']
+        assert [request.headers['Content-Type'] for request in requests] == [wire.JSON, wire.BINARY]
+        data = wire.decode_append_request(requests[1].body, wire.BINARY)
+        assert data['prevLogIndex'] == 3 and [entry.term for entry in data['entries']] == [3]
+        # peers which did not advertise the binary format keep receiving JSON
+        requests = [request for request in mocker.request_history if request.url == 'http://localhost:92/logs/append']
+        assert [request.headers['Content-Type'] for request in requests] == [wire.JSON, wire.JSON]
+
+
+def test_append_entries_conflict_hint(client):
+    node.next_index['localhost:91'] = 5
+    node.next_index['localhost:92'] = 5
+    node.next_index['localhost:93'] = 5
+    with requests_mock.Mocker() as mocker:
+        # the leader has entries of the conflicting term: resume after its last one
+        mocker.post('http://localhost:91/logs/append', json={'success': False, 'term': 3, 'conflictTerm': 2,
+                                                              'conflictIndex': 1})
+        # the leader has no entry of the conflicting term: resume at its first index in the follower's log
+        mocker.post('http://localhost:92/logs/append', json={'success': False, 'term': 3, 'conflictTerm': 0,
+                                                              'conflictIndex': 1})
+        # the follower's log is too short
+        mocker.post('http://localhost:93/logs/append', json={'success': False, 'term': 3, 'conflictTerm': -1,
+                                                              'conflictIndex': 2})
+        mq_server.append_entries()
+    assert node.next_index == {'localhost:91': 4, 'localhost:92': 1, 'localhost:93': 2}
+
+
+class InlineExecutor:
+    """
+    Runs the submitted calls right away, so the leader and the follower can share the node module in turns.
+    """
+
+    def submit(self, function, *args):
+        future = Future()
+        future.set_result(function(*args))
+        return future
+
+
+def test_divergent_follower_convergence(client, monkeypatch):
+    global node
+    divergent_entries = 20000
+    leader = raft.Node(0, ['localhost:91'])
+    follower = raft.Node(1, ['localhost:90'])
+    for log, terms in [(leader.logs, [1] * 10 + [2] * 5 + [4] * divergent_entries),
+                       (follower.logs, [1] * 10 + [2] * 5 + [3] * divergent_entries)]:
+        log.extend([LogEntry(term, Command(str(index), Operation.PUT_MESSAGE, 'message'))
+                    for index, term in enumerate(terms)])
+    leader.term = 4
+    follower.term = 3
+    leader.transition_to_new_role(Role.LEADER)
+    leader.prepare_for_leadership()
+    rejections = []
+
+    def post_rpc(server, service_url, data, timeout):
+        body, content_type = wire.encode_request(service_url, data, wire.BINARY)
+        mq_server.node = follower
+        try:
+            output = client.post('/logs/append', data=body, content_type=content_type).json
+        finally:
+            mq_server.node = leader
+        if not output['success']:
+            rejections.append(output)
+        return output
+
+    monkeypatch.setattr(mq_server, 'post_rpc', post_rpc)
+    node = mq_server.node = leader
+    started = time.monotonic()
+    rounds = 0
+    while leader.match_index['localhost:91'] < leader.logs.log_size - 1:
+        mq_server.replicate_to('localhost:91', InlineExecutor())
+        rounds += 1
+    elapsed = time.monotonic() - started
+    print(f'Converged over {divergent_entries} divergent entries in {rounds} rounds, {elapsed:.2f} seconds.')
+    # a single rejection skips the whole divergent term, instead of one per entry
+    assert len(rejections) == 1
+    assert rounds <= divergent_entries // (mq_server.MAX_APPEND_ENTRIES * mq_server.MAX_INFLIGHT_APPENDS) + 2
+    assert [follower.logs.term_at(index) for index in (14, 15, -1)] == [2, 4, 4]
+    assert follower.logs.log_size == leader.logs.log_size
+
+
+def test_update_committed_index(client):
+    node.transition_to_new_role(Role.LEADER)
+    node.prepare_for_leadership()
+    node.match_index['localhost:91'] = 4
+    assert not mq_server.update_committed_index()
+    # the quorum-th largest match index holds an entry of an older term, it is not committed on its own
+    node.match_index['localhost:92'] = 2
+    assert not mq_server.update_committed_index()
+    assert node.committed_index == -1
+    node.match_index['localhost:92'] = 4
+    assert mq_server.update_committed_index()
+    assert node.committed_index == 4
+
+
+def test_leader_counts_its_durable_entries(tmp_path):
+    global node
+    node = mq_server.node = raft.Node(0, ['localhost:91', 'localhost:92'], str(tmp_path), FsyncPolicy.BATCH)
+    node.term = 1
+    node.transition_to_new_role(Role.LEADER)
+    node.prepare_for_leadership()
+    node.logs.entries.sync()
+    mq_server.append_commands([Command('1', Operation.NOOP)])
+    # the follower alone is not a majority, the entry of the leader is not synced yet
+    mq_server.handle_append_response('localhost:91', 1, time.monotonic(), -1, 1, {'success': True, 'term': 1})
+    assert node.match_index['localhost:91'] == 0
+    assert node.committed_index == -1
+    time.sleep(0.05)
+    assert node.logs.sync_if_due()
+    assert mq_server.update_committed_index()
+    assert node.committed_index == 0
+    node.logs.close()
+
+
+def test_concurrent_appends_of_same_batch(tmp_path):
+    global node
+    message = {'term': 1, 'leaderId': 0, 'prevLogTerm': -1, 'prevLogIndex': -1, 'leaderCommit': -1,
+               'entries': [LogEntry(1, Command(str(i), Operation.NOOP)).json_encode() for i in range(300)]}
+    body = json.dumps(message)
+    barrier = threading.Barrier(2)
+
+    def append():
+        barrier.wait()
+        response = mq_server.app.test_client().post('/logs/append', data=body,
+                                                    headers={'content-type': 'application/json'})
+        return response.json['success']
+
+    # a pipelined or retried batch arriving while the first copy is written is appended once
+    for trial in range(5):
+        node = mq_server.node = raft.Node(1, ['localhost:90', 'localhost:92'], str(tmp_path / str(trial)),
+                                          FsyncPolicy.ALWAYS)
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            assert all(executor.map(lambda _: append(), range(2)))
+        assert node.logs.log_size == 300
+        assert [entry.command.id for entry in node.logs.entries] == [str(i) for i in range(300)]
+        node.logs.close()
+
+
+def test_follower_syncs_before_acknowledging(tmp_path):
+    global node
+    node = mq_server.node = raft.Node(1, ['localhost:90', 'localhost:92'], str(tmp_path), FsyncPolicy.BATCH)
+    message = {'term': 1, 'leaderId': 0, 'prevLogTerm': -1, 'prevLogIndex': -1, 'leaderCommit': -1,
+               'entries': [LogEntry(1, Command(str(i), Operation.NOOP)).json_encode() for i in range(3)]}
+    response = mq_server.app.test_client().post('/logs/append', data=json.dumps(message),
+                                                headers={'content-type': 'application/json'})
+    assert response.json['success']
+    # the batch fsync policy does not delay the acknowledgement past the write to disk
+    assert node.logs.durable_index == 2
+    node.logs.close()
@@ -0,0 +1,129 @@
+import json
+
+import pytest
+import requests_mock
+
+from src import rest_client
+from src.message_client import MessageClient, NoLeaderError, ShardedClient
+
+HOSTS = ['localhost:91', 'localhost:92', 'localhost:93']
+
+
+@pytest.fixture(autouse=True)
+def set_up():
+    rest_client.leaders.clear()
+
+
+def mock_status(mocker, leader, hint=None, hosts=HOSTS):
+    for host in hosts:
+        role = 'Leader' if host == leader else 'Follower'
+        headers = {rest_client.LEADER_HEADER: hint} if hint else {}
+        mocker.get(f'http://{host}/status', json={'role': role, 'term': 1}, headers=headers)
+
+
+def test_find_leader():
+    with requests_mock.Mocker() as mocker:
+        mock_status(mocker, 'localhost:92')
+        client = MessageClient(HOSTS)
+        assert client.find_leader() == 'localhost:92'
+        # the followers name the leader, which does not answer the probe
+        mock_status(mocker, None, 'localhost:93')
+        assert client.find_leader() == 'localhost:93'
+        mock_status(mocker, None)
+        with pytest.raises(NoLeaderError):
+            client.find_leader()
+        client.close()
+
+
+def test_leader_is_cached():
+    with requests_mock.Mocker() as mocker:
+        mock_status(mocker, 'localhost:91')
+        mocker.put('http://localhost:91/topic', json={'success': True})
+        client = MessageClient(HOSTS)
+        for _ in range(3):
+            assert client.create_topic('a') == {'success': True}
+        # a single probe, the nodes which did not answer yet may still be probed in the background
+        paths = [request.path for request in mocker.request_history]
+        assert paths.count('/status') <= len(HOSTS)
+        assert paths.count('/topic') == 3
+        client.close()
+
+
+def test_follow_leader_hint():
+    with requests_mock.Mocker() as mocker:
+        mock_status(mocker, 'localhost:91')
+        # the node forwarded the request and named the new leader
+        mocker.put('http://localhost:91/topic', json={'success': True},
+                   headers={rest_client.LEADER_HEADER: 'localhost:93'})
+        client = MessageClient(HOSTS)
+        client.create_topic('a')
+        assert client.leader == 'localhost:93'
+        client.close()
+
+
+def test_retry_after_failover():
+    with requests_mock.Mocker() as mocker:
+        mock_status(mocker, 'localhost:91')
+        mocker.put('http://localhost:91/message', text='Only leader node can serve requests.', status_code=403)
+        mocker.put('http://localhost:92/message', json={'success': True})
+        client = MessageClient(HOSTS, client_id='producer1', backoff=0.01)
+        assert client.find_leader() == 'localhost:91'
+        mock_status(mocker, 'localhost:92')
+        assert client.put_message('a', 'b') == {'success': True}
+        assert client.leader == 'localhost:92'
+        # the retry carries the same sequence number, so the leader applies it once
+        bodies = [json.loads(request.text) for request in mocker.request_history if request.method == 'PUT']
+        assert [(body['clientId'], body['sequence']) for body in bodies] == [('producer1', 1), ('producer1', 1)]
+        client.close()
+
+
+def test_no_retry_on_other_errors():
+    with requests_mock.Mocker() as mocker:
+        mock_status(mocker, 'localhost:91')
+        mocker.put('http://localhost:91/message', status_code=500)
+        client = MessageClient(HOSTS)
+        with pytest.raises(Exception):
+            client.put_message('a', 'b')
+        assert [request.method for request in mocker.request_history].count('PUT') == 1
+        client.close()
+
+
+def test_batch_and_async():
+    with requests_mock.Mocker() as mocker:
+        mock_status(mocker, 'localhost:91')
+        mocker.put('http://localhost:91/messages', json={'success': True, 'results': [{'success': True}] * 2})
+        mocker.put('http://localhost:91/message', json={'success': True})
+        mocker.get('http://localhost:91/message/a?max=2&wait=1', json={'success': True, 'messages': ['b', 'c']})
+        client = MessageClient(HOSTS)
+        assert client.put_messages([('a', 'b'), ('a', 'c')])['success']
+        futures = [client.put_message_async('a', str(i)) for i in range(5)]
+        assert all(future.result()['success'] for future in futures)
+        sequences = sorted(json.loads(request.text)['sequence'] for request in mocker.request_history if
+                           request.method == 'PUT')
+        assert sequences == list(range(1, 7))
+        assert client.get_messages_async('a', 2, wait=1).result() == {'success': True, 'messages': ['b', 'c']}
+        client.close()
+
+
+def test_sharded_client():
+    config = {'addresses': [{'ip': 'localhost', 'ports': [91 + i, 191 + i]} for i in range(3)],
+              'placement': {'a': 0, 'b': 1, 'c': 1}}
+    with requests_mock.Mocker() as mocker:
+        mock_status(mocker, 'localhost:91')
+        mock_status(mocker, 'localhost:192', hosts=['localhost:191', 'localhost:192', 'localhost:193'])
+        for leader in ('localhost:91', 'localhost:192'):
+            mocker.put(f'http://{leader}/message', json={'success': True})
+            mocker.put(f'http://{leader}/messages', json=lambda request, context: {
+                'success': True, 'results': [{'success': True, 'topic': message['topic']} for message in
+                                             json.loads(request.text)['messages']]})
+        mocker.get('http://localhost:91/topic', json={'success': True, 'topics': ['a', 'b', 'c']})
+        client = ShardedClient.from_config(config)
+        assert client.put_message('b', 'd') == {'success': True}
+        assert client.clients[0].leader is None and client.clients[1].leader == 'localhost:192'
+        output = client.put_messages([('b', 'd'), ('a', 'e'), ('c', 'f'), ('a', 'g')])
+        assert output['success']
+        assert [result['topic'] for result in output['results']] == ['b', 'a', 'c', 'a']
+        assert client.get_topics() == {'success': True, 'topics': ['a', 'b', 'c']}
+        # a single request, the node lists the topics of the other group itself
+        assert [request.path for request in mocker.request_history].count('/topic') == 1
+        client.close()
@@ -1,4 +1,5 @@
 import threading
+import time
 
 import pytest
 
@@ -6,16 +7,29 @@ import src.node as mq_server
 from src import raft, rest_client
 
 
+@pytest.fixture(scope='module', autouse=True)
+def server():
+    flask_thread = threading.Thread(target=mq_server.app.run, args=('localhost', 9543), daemon=True)
+    flask_thread.start()
+
+
 @pytest.fixture(autouse=True)
 def set_up():
     node = raft.Node(0, [])
-    app = mq_server.app
     mq_server.node = node
     mq_server.topic_queues = {}
-    background_thread = threading.Thread(target=mq_server.run_background_tasks, daemon=True)
+    mq_server.sessions.clear()
+    stop_event = threading.Event()
+    background_thread = threading.Thread(target=mq_server.run_background_tasks, args=(stop_event,), daemon=True)
     background_thread.start()
-    flask_thread = threading.Thread(target=app.run, args=('localhost', 9543), daemon=True)
-    flask_thread.start()
+    # wait for the single node to elect itself
+    for _ in range(30):
+        if node.is_leader():
+            break
+        time.sleep(0.1)
+    yield
+    stop_event.set()
+    background_thread.join()
 
 
 def test_put_topic():
@@ -81,3 +95,105 @@ def test_status():
     response = rest_client.get('localhost:9543', 'status')
     assert response['term'] >= 0
     assert response['role'] == 'Leader'
+
+
+def test_idempotent_put_message():
+    rest_client.put('localhost:9543', 'topic', {'topic': 'topic1'})
+    message = {'topic': 'topic1', 'message': 'msg1', 'clientId': 'producer1', 'sequence': 1}
+    assert rest_client.put('localhost:9543', 'message', message) == {'success': True}
+    # a retry of the same request is not applied again
+    assert rest_client.put('localhost:9543', 'message', message) == {'success': True, 'duplicate': True}
+    messages = {'messages': [{'topic': 'topic1', 'message': 'msg2'}], 'clientId': 'producer1', 'sequence': 2}
+    assert rest_client.put('localhost:9543', 'messages', messages)['success']
+    assert rest_client.put('localhost:9543', 'messages', messages)['duplicate']
+    # sequence numbers are per producer
+    message = {'topic': 'topic1', 'message': 'msg3', 'clientId': 'producer2', 'sequence': 1}
+    assert rest_client.put('localhost:9543', 'message', message) == {'success': True}
+    response = rest_client.get('localhost:9543', 'message/topic1?max=10')
+    assert response['messages'] == ['msg1', 'msg2', 'msg3']
+
+
+def test_partitioned_topic():
+    response = rest_client.put('localhost:9543', 'topic', {'topic': 'topic1', 'partitions': 3})
+    assert response['success'] == True
+    response = rest_client.put('localhost:9543', 'topic', {'topic': 'topic2', 'partitions': 0})
+    assert response['success'] == False
+    response = rest_client.get('localhost:9543', 'topic')
+    assert response == {'success': True, 'topics': ['topic1'], 'partitions': {'topic1': 3}}
+
+    # the messages of a key stay in order in one partition
+    outputs = [rest_client.put('localhost:9543', 'message', {'topic': 'topic1', 'message': f'msg{i}', 'key': 'k'})
+               for i in range(3)]
+    partitions = {output['partition'] for output in outputs}
+    assert len(partitions) == 1
+    partition = partitions.pop()
+    response = rest_client.put('localhost:9543', 'message', {'topic': 'topic1', 'message': 'other', 'partition': 9})
+    assert response == {'success': False, 'error': 'Partition does not exist.'}
+    response = rest_client.get('localhost:9543', 'topic/topic1')
+    assert response['depth'] == 3 and sorted(response['partitionDepths']) == [0, 0, 3]
+
+    response = rest_client.get('localhost:9543', f'message/topic1?partition={(partition + 1) % 3}')
+    assert response == {'success': False}
+    response = rest_client.get('localhost:9543', f'message/topic1?partition={partition}')
+    assert response == {'success': True, 'message': 'msg0', 'partition': partition}
+    # the leader picks the partition holding messages
+    response = rest_client.get('localhost:9543', 'message/topic1?max=5')
+    assert response == {'success': True, 'messages': ['msg1', 'msg2'], 'partition': partition}
+
+
+def test_consumer_groups():
+    response = rest_client.put('localhost:9543', 'topic', {'topic': 'topic1', 'mode': 'log'})
+    assert response['success'] == True
+    for i in range(3):
+        response = rest_client.put('localhost:9543', 'message', {'topic': 'topic1', 'message': f'msg{i}'})
+        assert response == {'success': True, 'offset': i}
+
+    # both groups read every message, reading does not move the offsets
+    for group in ('a', 'b'):
+        response = rest_client.get('localhost:9543', f'message/topic1?group={group}&max=2')
+        assert response == {'success': True, 'offset': 0, 'nextOffset': 2, 'messages': ['msg0', 'msg1']}
+    response = rest_client.put('localhost:9543', 'offset', {'topic': 'topic1', 'group': 'a', 'offset': 2})
+    assert response['success'] == True
+    response = rest_client.get('localhost:9543', 'message/topic1?group=a')
+    assert response == {'success': True, 'offset': 2, 'nextOffset': 3, 'message': 'msg2'}
+    response = rest_client.get('localhost:9543', 'message/topic1?offset=1&max=1')
+    assert response['messages'] == ['msg1']
+    response = rest_client.get('localhost:9543', 'topic/topic1')
+    assert (response['startOffset'], response['endOffset'], response['groups']) == (0, 3, {'a': 2})
+
+    # a long poll returns once a message is appended past the offset
+    response = rest_client.get('localhost:9543', 'message/topic1?offset=3&wait=0.2')
+    assert response == {'success': False, 'offset': 3, 'nextOffset': 3}
+    response = rest_client.put('localhost:9543', 'offset', {'topic': 'topic1', 'group': 'a', 'offset': 9})
+    assert response['success'] == False
+
+
+def test_visibility_timeout_and_ack():
+    rest_client.put('localhost:9543', 'topic', {'topic': 'topic1'})
+    for i in range(3):
+        rest_client.put('localhost:9543', 'message', {'topic': 'topic1', 'message': f'msg{i}'})
+    response = rest_client.get('localhost:9543', 'message/topic1?max=2&visibility=0.3')
+    assert response['messages'] == ['msg0', 'msg1'] and len(response['receipts']) == 2
+    receipts = response['receipts']
+    response = rest_client.get('localhost:9543', 'message/topic1?visibility=30')
+    assert response['message'] == 'msg2'
+    assert rest_client.get('localhost:9543', 'topic/topic1')['inFlight'] == 3
+
+    response = rest_client.put('localhost:9543', 'ack', {'topic': 'topic1', 'receipts': receipts[1:]})
+    assert response == {'success': True, 'acked': 1}
+    # the unacknowledged message returns once its lease expires, a long poll waits for it
+    response = rest_client.get('localhost:9543', 'message/topic1?wait=2')
+    assert response == {'success': True, 'message': 'msg0'}
+    response = rest_client.put('localhost:9543', 'ack', {'topic': 'topic1', 'receipts': receipts[:1]})
+    assert response == {'success': False, 'acked': 0}
+
+
+def test_commit_applied_without_waiting_for_tick(monkeypatch):
+    monkeypatch.setattr(mq_server, 'SCHEDULER_INTERVAL', 2)
+    time.sleep(0.05)  # the background loop waits the longer interval from now on
+    start = time.time()
+    for i in range(3):
+        response = rest_client.put('localhost:9543', 'topic', {'topic': f'topic{i}'})
+        assert response['success'] == True
+    # every commit wakes up the background loop to apply it
+    assert time.time() - start < 1
@@ -1,3 +1,6 @@
+import threading
+import time
+
 import pytest
 
 from test.test_utils import Swarm
@@ -9,8 +12,8 @@ ELECTION_TIMEOUT = 2.0
 
 
 @pytest.fixture
-def node_with_test_topic():
-    node = Swarm(PROGRAM_FILE_PATH, 1)[0]
+def node_with_test_topic(tmp_path):
+    node = Swarm(PROGRAM_FILE_PATH, 1, str(tmp_path / 'config.json'))[0]
     node.start(ELECTION_TIMEOUT)
     node.wait_for_flask_startup()
     assert (node.create_topic(TEST_TOPIC).json() == {"success": True})
@@ -19,8 +22,8 @@ def node_with_test_topic():
 
 
 @pytest.fixture
-def node():
-    node = Swarm(PROGRAM_FILE_PATH, 1)[0]
+def node(tmp_path):
+    node = Swarm(PROGRAM_FILE_PATH, 1, str(tmp_path / 'config.json'))[0]
     node.start(ELECTION_TIMEOUT)
     node.wait_for_flask_startup()
     yield node
@@ -144,3 +147,50 @@ def test_put2_and_get3_message(node_with_test_topic):
         TEST_TOPIC).json() == {"success": True, "message": second_message})
     assert (node_with_test_topic.get_message(
         TEST_TOPIC).json() == {"success": False})
+
+
+def test_put_messages(node_with_test_topic):
+    other_topic = TEST_TOPIC + "2"
+    assert (node_with_test_topic.create_topic(other_topic).json() == {"success": True})
+    messages = [(TEST_TOPIC, TEST_MESSAGE), (other_topic, TEST_MESSAGE + "2"),
+                ("inexistent_topic", TEST_MESSAGE), (TEST_TOPIC, TEST_MESSAGE + "3")]
+    assert (node_with_test_topic.put_messages(messages).json() == {
+        "success": False,
+        "results": [{"success": True}, {"success": True}, {"success": False}, {"success": True}]
+    })
+    assert (node_with_test_topic.get_message(
+        TEST_TOPIC).json() == {"success": True, "message": TEST_MESSAGE})
+    assert (node_with_test_topic.get_message(
+        TEST_TOPIC).json() == {"success": True, "message": TEST_MESSAGE + "3"})
+    assert (node_with_test_topic.get_message(
+        other_topic).json() == {"success": True, "message": TEST_MESSAGE + "2"})
+
+
+def test_get_messages(node_with_test_topic):
+    for i in range(3):
+        assert (node_with_test_topic.put_message(
+            TEST_TOPIC, TEST_MESSAGE + str(i)).json() == {"success": True})
+    assert (node_with_test_topic.get_messages(TEST_TOPIC, 2).json() == {
+        "success": True, "messages": [TEST_MESSAGE + "0", TEST_MESSAGE + "1"]
+    })
+    assert (node_with_test_topic.get_messages(TEST_TOPIC, 2).json() == {
+        "success": True, "messages": [TEST_MESSAGE + "2"]
+    })
+    assert (node_with_test_topic.get_messages(TEST_TOPIC, 2).json() == {
+        "success": False, "messages": []
+    })
+
+
+def test_get_messages_long_poll(node_with_test_topic):
+    start = time.time()
+    assert (node_with_test_topic.get_messages(TEST_TOPIC, 5, wait=0.5).json() == {
+        "success": False, "messages": []
+    })
+    assert (time.time() - start >= 0.5)
+
+    producer = threading.Timer(0.5, node_with_test_topic.put_message, args=(TEST_TOPIC, TEST_MESSAGE))
+    producer.start()
+    assert (node_with_test_topic.get_messages(TEST_TOPIC, 5, wait=3).json() == {
+        "success": True, "messages": [TEST_MESSAGE]
+    })
+    producer.join()
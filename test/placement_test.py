@@ -0,0 +1,29 @@
+from src import raft
+from src.placement import Placement, group_addresses
+
+
+def test_group_of():
+    placement = Placement(4, {'pinned': 3})
+    assert placement.group_of('pinned') == 3
+    groups = [placement.group_of(f'topic{i}') for i in range(100)]
+    assert set(groups) == {0, 1, 2, 3}
+    # the same on every node and client
+    assert groups == [Placement(4).group_of(f'topic{i}') for i in range(100)]
+    assert Placement().group_of('pinned') == 0
+
+
+def test_config():
+    config = {'addresses': [{'ip': 'http://host1', 'ports': [8000, 8001]}, {'ip': 'host2', 'ports': [8000, 8001]}],
+              'placement': {'a': 1}}
+    placement = Placement.json_decode(config)
+    assert placement.json_encode() == {'groups': 2, 'placement': {'a': 1}}
+    assert group_addresses(config, 1) == ['host1:8001', 'host2:8001']
+    single = {'addresses': [{'ip': 'host1', 'port': 8000}]}
+    assert Placement.json_decode(single).group_count == 1
+    assert group_addresses(single, 0) == ['host1:8000']
+
+
+def test_preferred_leader_times_out_first():
+    preferred = [raft.get_timeout(True) for _ in range(100)]
+    others = [raft.get_timeout() for _ in range(100)]
+    assert max(preferred) < min(others)
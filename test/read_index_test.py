@@ -0,0 +1,142 @@
+import json
+import time
+
+import pytest
+import requests_mock
+
+import src.node as mq_server
+from src import raft
+from src.log import Command, Operation
+from src.placement import Placement
+
+SIBLINGS = ['localhost:91', 'localhost:92', 'localhost:93', 'localhost:94']
+node = None
+
+
+@pytest.fixture
+def client():
+    mq_server.node = node
+    return mq_server.app.test_client()
+
+
+@pytest.fixture(autouse=True)
+def set_up():
+    global node
+    node = raft.Node(0, SIBLINGS)
+    node.term = 2
+    mq_server.node = node
+    mq_server.topic_queues = {}
+    node.transition_to_new_role(raft.Role.CANDIDATE)
+    mq_server.become_leader()
+    mq_server.append_commands([Command('t', Operation.PUT_TOPIC, json.dumps({'topic': 'topic1', 'capacity': None}))])
+    for i in range(3):
+        mq_server.append_commands(
+            [Command(str(i), Operation.PUT_MESSAGE, json.dumps({'topic': 'topic1', 'message': f'msg{i}'}))])
+    node.committed_index = node.logs.log_size - 1
+    mq_server.apply_state_machine()
+
+
+def mock_heartbeats(mocker, acks):
+    for i, server in enumerate(SIBLINGS):
+        if i < acks:
+            mocker.post(f'http://{server}/logs/append', json={'success': True, 'term': 2}, status_code=200)
+        else:
+            mocker.post(f'http://{server}/logs/append', json={}, status_code=500)
+
+
+def test_read_with_quorum(client):
+    log_size = node.logs.log_size
+    with requests_mock.Mocker() as mocker:
+        mock_heartbeats(mocker, acks=2)
+        response = client.get('/topic')
+    assert response.get_json() == {'success': True, 'topics': ['topic1']}
+    assert node.logs.log_size == log_size
+
+
+def test_read_without_quorum(client):
+    with requests_mock.Mocker() as mocker:
+        mock_heartbeats(mocker, acks=1)
+        response = client.get('/topic?timeout=0.5')
+    assert response.status_code == 503
+
+
+def test_read_lists_every_group(client):
+    mq_server.placement = Placement(2, {'topic1': 0, 'b': 1})
+    mq_server.group_nodes = {0: 'localhost:81', 1: 'localhost:181'}
+    try:
+        with requests_mock.Mocker() as mocker:
+            mock_heartbeats(mocker, acks=2)
+            mocker.get('http://localhost:181/topic', json={'success': True, 'topics': ['b'], 'partitions': {'b': 2}})
+            response = client.get('/topic')
+            assert response.get_json() == {'success': True, 'topics': ['topic1', 'b'], 'partitions': {'b': 2}}
+            # the other group lists its own topics only, instead of asking this group in turn
+            assert [request.query for request in mocker.request_history if request.netloc == 'localhost:181'] == [
+                'local']
+            response = client.get('/topic?local')
+            assert response.get_json() == {'success': True, 'topics': ['topic1']}
+            mocker.get('http://localhost:181/topic', status_code=500)
+            response = client.get('/topic')
+            assert response.status_code == 503
+    finally:
+        mq_server.placement = Placement()
+        mq_server.group_nodes = {}
+
+
+def test_read_with_slow_followers(client):
+    def slow_ack(request, context):
+        time.sleep(0.5)
+        return {'success': True, 'term': 2}
+
+    with requests_mock.Mocker() as mocker:
+        for server in SIBLINGS:
+            mocker.post(f'http://{server}/logs/append', json=slow_ack)
+        response = client.get('/topic?timeout=0.1')
+    assert response.status_code == 503
+
+
+def test_read_with_follower_behind_snapshot(client, monkeypatch):
+    monkeypatch.setattr(mq_server, 'SNAPSHOT_THRESHOLD_ENTRIES', 1)
+    mq_server.take_snapshot_if_due()
+    assert node.logs.snapshot_index == node.logs.log_size - 1
+    node.next_index['localhost:91'] = 1  # the entries this follower needs next were compacted
+    with requests_mock.Mocker() as mocker:
+        mock_heartbeats(mocker, acks=2)
+        response = client.get('/topic')
+    assert response.get_json() == {'success': True, 'topics': ['topic1']}
+
+
+def test_read_before_term_entry_is_applied(client):
+    node.transition_to_new_role(raft.Role.CANDIDATE)
+    mq_server.become_leader()
+    response = client.get('/topic?timeout=0.1')
+    assert response.status_code == 503
+
+
+def test_lease_read(client, monkeypatch):
+    monkeypatch.setattr(mq_server, 'READ_MODE', mq_server.LEASE)
+    for server in SIBLINGS[:2]:
+        mq_server.record_ack(server, time.monotonic())
+    with requests_mock.Mocker() as mocker:
+        mock_heartbeats(mocker, acks=0)
+        response = client.get('/topic')
+        assert response.get_json() == {'success': True, 'topics': ['topic1']}
+        assert not mocker.request_history
+
+    # expired lease falls back to a heartbeat round
+    monkeypatch.setattr(mq_server, 'LEASE_DURATION', 0)
+    with requests_mock.Mocker() as mocker:
+        mock_heartbeats(mocker, acks=4)
+        assert client.get('/topic').status_code == 200
+        assert mocker.request_history
+
+
+def test_peek_topic(client):
+    with requests_mock.Mocker() as mocker:
+        mock_heartbeats(mocker, acks=4)
+        response = client.get('/topic/topic1?peek=2')
+        assert response.get_json() == {
+            'success': True, 'depth': 3, 'bytes': 12, 'capacity': None, 'messages': ['msg0', 'msg1']
+        }
+        assert client.get('/topic/topic1').get_json()['messages'] == []
+        assert client.get('/topic/topic2').get_json() == {'success': False}
+    assert mq_server.topic_queues['topic1'].depth == 3
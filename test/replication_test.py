@@ -2,6 +2,7 @@ import time
 
 import pytest
 
+from src.message_client import MessageClient
 from test.test_utils import Swarm
 
 NUM_NODES_ARRAY = [5]
@@ -14,8 +15,8 @@ NUMBER_OF_LOOP_FOR_SEARCHING_LEADER = 3
 
 
 @pytest.fixture
-def swarm(num_nodes):
-    swarm = Swarm(PROGRAM_FILE_PATH, num_nodes)
+def swarm(num_nodes, tmp_path):
+    swarm = Swarm(PROGRAM_FILE_PATH, num_nodes, str(tmp_path / 'config.json'))
     swarm.start(ELECTION_TIMEOUT)
     yield swarm
     swarm.clean()
@@ -55,3 +56,28 @@ def test_is_message_shared(swarm: Swarm, num_nodes: int):
     assert (leader2 != None)
     assert (leader2.get_message(TEST_TOPIC).json()
             == {"success": True, "message": TEST_MESSAGE})
+
+
+@pytest.mark.parametrize('num_nodes', [3])
+def test_follower_forwards_to_leader(swarm: Swarm, num_nodes: int):
+    leader = swarm.get_leader_loop(NUMBER_OF_LOOP_FOR_SEARCHING_LEADER)
+    assert (leader != None)
+    assert (leader.create_topic(TEST_TOPIC).json() == {"success": True})
+    follower = next(node for node in swarm.nodes if node is not leader)
+    response = follower.put_message(TEST_TOPIC, TEST_MESSAGE)
+    assert (response.json() == {"success": True})
+    assert (response.headers["X-Raft-Leader"] == leader.address.removeprefix("http://"))
+    assert (leader.get_message(TEST_TOPIC).json() == {"success": True, "message": TEST_MESSAGE})
+
+
+@pytest.mark.parametrize('num_nodes', [3])
+def test_client_survives_failover(swarm: Swarm, num_nodes: int):
+    client = MessageClient([node.address.removeprefix("http://") for node in swarm.nodes], retries=10)
+    assert (client.create_topic(TEST_TOPIC) == {"success": True})
+    assert (client.put_message(TEST_TOPIC, "1") == {"success": True})
+    leader = next(node for node in swarm.nodes if node.address.endswith(client.leader))
+    leader.commit_clean()
+    assert (client.put_message(TEST_TOPIC, "2") == {"success": True})
+    assert (not leader.address.endswith(client.leader))
+    assert (client.get_messages(TEST_TOPIC, 10) == {"success": True, "messages": ["1", "2"]})
+    client.close()
@@ -1,4 +1,6 @@
 import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
 
 import requests_mock
 
@@ -56,3 +58,48 @@ def test_put():
             assert False
         except Exception:
             assert True
+
+
+def test_session_reuse():
+    with requests_mock.Mocker() as mocker:
+        mocker.get('http://pooled.com/path', json={'a': 'b'}, status_code=200)
+        mocker.get('http://pooled.com/fail', json={}, status_code=500)
+        session = rest_client.get_session('pooled.com')
+        rest_client.get('pooled.com', 'path')
+        rest_client.get('pooled.com', 'path')
+        try:
+            rest_client.get('pooled.com', 'fail')
+            assert False
+        except Exception:
+            assert True
+        assert rest_client.get_session('pooled.com') is session
+        assert rest_client.get_session('other.com') is not session
+        stats = rest_client.pool_stats()['pooled.com']
+        assert stats['requests'] == 3
+        assert stats['failures'] == 1
+
+
+def test_concurrent_counters():
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)  # switch threads as often as possible
+    try:
+        rest_client.get_session('counted.com')
+
+        def send_many(_):
+            for _ in range(20000):
+                rest_client.count('counted.com', 'requests')
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(send_many, range(4)))
+    finally:
+        sys.setswitchinterval(switch_interval)
+    assert rest_client.pool_stats()['counted.com']['requests'] == 80000
+
+
+def test_timeouts():
+    with requests_mock.Mocker() as mocker:
+        mocker.get('http://test.com/path', json={'a': 'b'}, status_code=200)
+        rest_client.get('test.com', 'path', timeout=2, connect_timeout=0.5)
+        rest_client.get('test.com', 'path', timeout=2)
+        assert mocker.request_history[0].timeout == (0.5, 2)
+        assert mocker.request_history[1].timeout == (2, 2)
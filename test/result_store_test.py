@@ -0,0 +1,47 @@
+import time
+
+from src.result_store import ResultStore
+
+
+def test_only_expected_results_are_stored():
+    store = ResultStore(10, 60)
+    store['a'] = {'success': True}
+    assert 'a' not in store
+    store.expect('b')
+    store['b'] = {'success': True}
+    assert store.pop('b') == {'success': True}
+    # delete on read
+    assert store.pop('b') is None
+    assert len(store) == 0
+
+
+def test_abandoned_request():
+    store = ResultStore(10, 60)
+    store.expect('a')
+    assert store.pop('a') is None  # the request timed out before its command was applied
+    store['a'] = {'success': True}
+    assert 'a' not in store
+    assert store.json_encode()['waiting'] == 0
+
+
+def test_capacity():
+    store = ResultStore(2, 60)
+    for command_id in ['a', 'b', 'c']:
+        store.expect(command_id)
+        store[command_id] = command_id
+    assert 'a' not in store and store['b'] == 'b' and store['c'] == 'c'
+    assert store.evictions == 1
+
+
+def test_ttl():
+    store = ResultStore(10, 0.05)
+    store.expect('a')
+    store['a'] = 'a'
+    time.sleep(0.1)
+    store.expect('b')
+    store['b'] = 'b'
+    assert 'a' not in store and 'b' in store
+    time.sleep(0.1)
+    store.evict()
+    assert len(store) == 0
+    assert store.json_encode() == {'size': 0, 'waiting': 0, 'evictions': 0, 'expirations': 2}
@@ -0,0 +1,48 @@
+import json
+
+import src.node as mq_server
+from src.log import Command, Operation
+from src.session_table import SessionTable
+
+
+def test_lookup_and_record():
+    table = SessionTable(10, 2)
+    assert table.lookup('a', 1) is None
+    table.record('a', 1, {'success': True})
+    assert table.lookup('a', 1) == {'success': True, 'duplicate': True}
+    assert table.lookup('a', 2) is None
+    assert table.lookup('b', 1) is None
+    table.record('a', 2, {'success': False})
+    table.record('a', 3, {'success': True})
+    # the result of sequence 1 is out of the window, it is still a duplicate
+    output = table.lookup('a', 1)
+    assert output['duplicate'] and not output['success']
+    assert table.lookup('a', 2) == {'success': False, 'duplicate': True}
+
+
+def test_capacity():
+    table = SessionTable(2, 2)
+    table.record('a', 1, {'success': True})
+    table.record('b', 1, {'success': True})
+    table.record('a', 2, {'success': True})
+    table.record('c', 1, {'success': True})
+    # b was the least recently active client
+    assert len(table) == 2
+    assert table.lookup('b', 1) is None
+    assert table.lookup('a', 2) is not None
+
+
+def test_sessions_in_snapshot():
+    mq_server.topic_queues = {}
+    mq_server.sessions.clear()
+    mq_server.apply_command(Command('1', Operation.PUT_TOPIC, json.dumps({'topic': 'topic1', 'capacity': None})))
+    message = json.dumps({'topic': 'topic1', 'message': 'msg1', 'clientId': 'producer1', 'sequence': 7})
+    mq_server.apply_command(Command('2', Operation.PUT_MESSAGE, message))
+    data = mq_server.serialize_state()
+    mq_server.sessions.clear()
+    mq_server.restore_state(data)
+    # the retry is applied after the snapshot was installed
+    mq_server.apply_command(Command('3', Operation.PUT_MESSAGE, message))
+    assert mq_server.topic_queues['topic1'].depth == 1
+    assert mq_server.sessions.json_encode() == SessionTable.json_decode(
+        json.loads(data)['sessions'], 10, 10).json_encode()
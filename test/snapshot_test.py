@@ -0,0 +1,147 @@
+import base64
+import json
+
+import pytest
+import requests_mock
+
+import src.node as mq_server
+from src import raft
+from src.log import LogEntry, Command, Operation
+from src.raft import Role
+from src.snapshot import Snapshot
+
+node = None
+
+
+def put_topic(id, topic):
+    return Command(id, Operation.PUT_TOPIC, json.dumps({'topic': topic, 'capacity': None}))
+
+
+def put_message(id, topic, message):
+    return Command(id, Operation.PUT_MESSAGE, json.dumps({'topic': topic, 'message': message}))
+
+
+@pytest.fixture
+def client():
+    mq_server.node = node
+    return mq_server.app.test_client()
+
+
+@pytest.fixture(autouse=True)
+def set_up(monkeypatch):
+    global node
+    node = raft.Node(0, ['localhost:91'])
+    node.term = 2
+    mq_server.node = node
+    mq_server.topic_queues = {}
+    monkeypatch.setattr(mq_server, 'SNAPSHOT_THRESHOLD_ENTRIES', 5)
+    node.logs.append(LogEntry(1, put_topic('t', 'topic1')))
+    for i in range(9):
+        node.logs.append(LogEntry(2, put_message(str(i), 'topic1', f'msg{i}')))
+
+
+def test_take_snapshot(client):
+    node.committed_index = 3
+    mq_server.apply_state_machine()
+    mq_server.take_snapshot_if_due()
+    assert node.snapshot is None
+
+    node.committed_index = 9
+    mq_server.apply_state_machine()
+    mq_server.take_snapshot_if_due()
+    assert node.snapshot.last_index == 9
+    assert node.snapshot.last_term == 2
+    assert node.logs.first_index == 10
+    assert node.logs.log_size == 10
+    assert node.logs.term_at(-1) == 2
+    with pytest.raises(IndexError):
+        node.logs.entries[5]
+
+    mq_server.topic_queues = {}
+    mq_server.restore_state(node.snapshot.data)
+    assert mq_server.topic_queues['topic1'].depth == 9
+    assert mq_server.topic_queues['topic1'].pop() == 'msg0'
+
+
+def test_snapshot_threshold_counts_applied_bytes(client, monkeypatch):
+    monkeypatch.setattr(mq_server, 'SNAPSHOT_THRESHOLD_ENTRIES', 100)
+    monkeypatch.setattr(mq_server, 'SNAPSHOT_THRESHOLD_BYTES', node.logs.size_bytes // 2)
+    # the log is past the threshold, but most of it is not applied yet and cannot be compacted
+    node.committed_index = 1
+    mq_server.apply_state_machine()
+    mq_server.take_snapshot_if_due()
+    assert node.snapshot is None
+
+    node.committed_index = 7
+    mq_server.apply_state_machine()
+    mq_server.take_snapshot_if_due()
+    assert node.snapshot.last_index == 7
+
+
+def test_send_snapshot_to_lagging_follower(client, monkeypatch):
+    monkeypatch.setattr(mq_server, 'SNAPSHOT_CHUNK_SIZE', 64)
+    node.transition_to_new_role(Role.LEADER)
+    node.committed_index = 9
+    mq_server.apply_state_machine()
+    mq_server.take_snapshot_if_due()
+    node.next_index['localhost:91'] = 2
+    node.match_index['localhost:91'] = 1
+    with requests_mock.Mocker() as mocker:
+        mocker.post('http://localhost:91/snapshot/install', json={'success': True, 'term': 2}, status_code=200)
+        mq_server.append_entries()
+        chunks = [json.loads(request.text) for request in mocker.request_history]
+    assert len(chunks) > 1
+    assert [chunk['done'] for chunk in chunks] == [False] * (len(chunks) - 1) + [True]
+    assert b''.join(base64.b64decode(chunk['data']) for chunk in chunks) == node.snapshot.data
+    assert node.match_index['localhost:91'] == 9
+    assert node.next_index['localhost:91'] == 10
+
+
+def test_install_snapshot(client, monkeypatch):
+    monkeypatch.setattr(mq_server, 'SNAPSHOT_CHUNK_SIZE', 64)
+    state = json.dumps({'topics': {'topic2': {'capacity': None, 'messages': ['a', 'b']}}}).encode('utf-8')
+    for offset in range(0, len(state), 64):
+        message = {
+            'term': 3,
+            'leaderId': 1,
+            'lastIncludedIndex': 20,
+            'lastIncludedTerm': 3,
+            'offset': offset,
+            'data': base64.b64encode(state[offset:offset + 64]).decode('ascii'),
+            'done': offset + 64 >= len(state)
+        }
+        response = client.post('/snapshot/install', json=message)
+        assert response.get_json()['success'] == True
+    assert node.term == 3
+    assert node.last_applied == 20
+    assert node.committed_index == 20
+    assert node.logs.log_size == 21
+    assert list(mq_server.topic_queues.keys()) == ['topic2']
+
+    # the log continues after the snapshot
+    message = {
+        'term': 3,
+        'leaderId': 1,
+        'prevLogTerm': 3,
+        'prevLogIndex': 20,
+        'entries': [LogEntry(3, put_message('m', 'topic2', 'c')).json_encode()],
+        'leaderCommit': 21
+    }
+    assert client.post('/logs/append', json=message).get_json()['success'] == True
+    mq_server.apply_state_machine()
+    assert mq_server.topic_queues['topic2'].depth == 3
+
+
+def test_restore_snapshot_after_restart(tmp_path):
+    durable_node = raft.Node(0, [], str(tmp_path))
+    for i in range(10):
+        durable_node.logs.append(LogEntry(1, None))
+    durable_node.snapshot = Snapshot(6, 1, b'{"topics": {}}')
+    durable_node.logs.close()
+
+    durable_node = raft.Node(0, [], str(tmp_path))
+    assert durable_node.snapshot.last_index == 6
+    assert durable_node.last_applied == 6
+    assert durable_node.logs.first_index == 7
+    assert durable_node.logs.log_size == 10
+    assert durable_node.logs.term_at(6) == 1
@@ -7,6 +7,7 @@ from subprocess import Popen
 import requests
 
 MESSAGE = "/message"
+MESSAGES = "/messages"
 TOPIC = "/topic"
 STATUS = "/status"
 
@@ -83,9 +84,17 @@ class Node:
         data = {"topic": topic, "message": message}
         return requests.put(self.address + MESSAGE, json=data, timeout=REQUEST_TIMEOUT)
 
+    def put_messages(self, messages: list):
+        data = {"messages": [{"topic": topic, "message": message} for topic, message in messages]}
+        return requests.put(self.address + MESSAGES, json=data, timeout=REQUEST_TIMEOUT)
+
     def get_message(self, topic: str):
         return requests.get(self.address + MESSAGE + '/' + topic, timeout=REQUEST_TIMEOUT)
 
+    def get_messages(self, topic: str, max_messages: int, wait: float = 0):
+        params = {"max": max_messages, "wait": wait}
+        return requests.get(self.address + MESSAGE + '/' + topic, params=params, timeout=REQUEST_TIMEOUT + wait)
+
     def create_topic(self, topic: str):
         data = {"topic": topic}
         return requests.put(self.address + TOPIC, json=data, timeout=REQUEST_TIMEOUT)
@@ -98,14 +107,15 @@ class Node:
 
 
 class Swarm:
-    def __init__(self, program_file_path: str, num_nodes: int):
+    def __init__(self, program_file_path: str, num_nodes: int, config_path: str = CONFIG_PATH):
         self.num_nodes = num_nodes
 
         # create the config
         config = self.make_config()
-        dump(config, open(CONFIG_PATH, 'w'))
+        with open(config_path, 'w') as config_file:
+            dump(config, config_file)
 
-        self.nodes = [Node(program_file_path, CONFIG_PATH, i, config)
+        self.nodes = [Node(program_file_path, config_path, i, config)
                       for i in range(self.num_nodes)]
 
     def start(self, sleep=0):
@@ -0,0 +1,84 @@
+import json
+import time
+
+import src.node as mq_server
+from src import raft, topic_log
+from src.log import Command, Operation
+from src.topic_log import TopicLog
+
+
+def test_read_by_offset():
+    log = TopicLog()
+    assert [log.append(f'msg{i}', 0) for i in range(5)] == [0, 1, 2, 3, 4]
+    assert log.read(1, 2) == (1, ['msg1', 'msg2'])
+    assert log.read(4, 10) == (4, ['msg4'])
+    assert log.read(5, 10) == (5, [])
+    # every consumer group has its own offset, reading does not consume
+    assert log.committed_offset('a') == 0
+    assert log.commit('a', 3) and log.committed_offset('a') == 3
+    assert log.committed_offset('b') == 0
+    assert not log.commit('a', 6)
+    assert log.depth == 5 and log.end_offset == 5
+
+
+def test_retention():
+    log = TopicLog(retention_bytes=8)
+    for i in range(5):
+        log.append(f'msg{i}', 0)
+    assert (log.start_offset, log.size_bytes) == (3, 8)
+    # offsets dropped by the retention are read from the first retained message
+    assert log.read(0, 1) == (3, ['msg3'])
+    log = TopicLog(retention_seconds=10)
+    log.append('old', 100)
+    log.append('new', 105)
+    assert log.start_offset == 0
+    log.append('newer', 111)
+    assert log.start_offset == 1 and log.peek(5) == ['new', 'newer']
+    assert log.next_expiry == 115
+    assert log.retain(120) == 1 and log.peek(5) == ['newer'] and log.next_expiry == 121
+
+
+def test_compaction(monkeypatch):
+    monkeypatch.setattr(topic_log, 'COMPACT_THRESHOLD', 4)
+    log = TopicLog(retention_bytes=4)
+    for i in range(10):
+        log.append(f'{i:04}', 0)
+    assert log.start_offset == 9 and log.read(0, 5) == (9, ['0009'])
+    restored = TopicLog.json_decode(json.loads(json.dumps(log.json_encode())))
+    assert (restored.start_offset, restored.end_offset, restored.size_bytes) == (9, 10, 4)
+
+
+def test_consumer_groups_in_snapshot():
+    mq_server.topic_queues = {}
+    mq_server.apply_command(Command('1', Operation.PUT_TOPIC, json.dumps({'topic': 'topic1', 'capacity': None,
+                                                                           'mode': 'log'})))
+    for i in range(3):
+        mq_server.apply_command(Command(f'put{i}', Operation.PUT_MESSAGE,
+                                        json.dumps({'topic': 'topic1', 'message': f'msg{i}', 'timestamp': i})))
+    mq_server.results.expect('2')
+    mq_server.apply_command(Command('2', Operation.COMMIT_OFFSET,
+                                    json.dumps({'topic': 'topic1', 'group': 'g', 'offset': 2})))
+    assert mq_server.results['2'] == {'success': True}
+    mq_server.restore_state(mq_server.serialize_state())
+    topic = mq_server.topic_queues['topic1']
+    assert topic.offsets == {'g': 2} and topic.read(topic.committed_offset('g'), 5) == (2, ['msg2'])
+
+
+def test_retention_by_leader_clock(monkeypatch):
+    mq_server.node = raft.Node(0, [])
+    mq_server.node.transition_to_new_role(raft.Role.LEADER)
+    monkeypatch.setattr(mq_server, 'next_retention_check', 0)
+    now = time.time()
+    topic = TopicLog(retention_seconds=10)
+    topic.append('old', now - 12)
+    topic.append('new', now - 5)
+    mq_server.topic_queues = {'topic1': topic, 'topic2': TopicLog()}
+    # the leader drops the messages out of the retention without waiting for the next message
+    command = mq_server.retention_command()
+    assert command.operation is Operation.RETAIN_MESSAGES
+    mq_server.results.expect(command.id)
+    mq_server.apply_command(command)
+    assert mq_server.results[command.id] == {'success': True, 'dropped': 1}
+    assert topic.peek(5) == ['new']
+    monkeypatch.setattr(mq_server, 'next_retention_check', 0)
+    assert mq_server.retention_command() is None
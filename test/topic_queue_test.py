@@ -0,0 +1,105 @@
+import json
+
+import src.node as mq_server
+from src.log import Command, Operation
+from src.topic_queue import PartitionedTopic, TopicQueue
+
+
+def test_fifo_order():
+    queue = TopicQueue()
+    for i in range(5):
+        assert queue.push(f'msg{i}')
+    assert [queue.pop() for _ in range(5)] == [f'msg{i}' for i in range(5)]
+    assert not queue
+
+
+def test_depth_and_size():
+    queue = TopicQueue()
+    queue.push('abc')
+    queue.push('défg')
+    assert queue.depth == 2
+    assert queue.size_bytes == 8
+    queue.pop()
+    assert queue.depth == 1
+    assert queue.size_bytes == 5
+
+
+def test_capacity():
+    queue = TopicQueue(capacity=2)
+    assert queue.push('msg1')
+    assert queue.push('msg2')
+    assert queue.is_full()
+    assert not queue.push('msg3')
+    assert queue.depth == 2
+    queue.pop()
+    assert queue.push('msg3')
+
+
+def test_put_message_into_full_topic():
+    mq_server.topic_queues = {}
+    mq_server.apply_command(Command('1', Operation.PUT_TOPIC, json.dumps({'topic': 'topic1', 'capacity': 1})))
+    message = json.dumps({'topic': 'topic1', 'message': 'msg1'})
+    mq_server.results.expect('2')
+    mq_server.results.expect('3')
+    mq_server.apply_command(Command('2', Operation.PUT_MESSAGE, message))
+    mq_server.apply_command(Command('3', Operation.PUT_MESSAGE, message))
+    assert mq_server.results['2'] == {'success': True}
+    assert mq_server.results['3'] == {'success': False, 'error': 'Topic is full.'}
+    assert mq_server.topic_queues['topic1'].depth == 1
+
+
+def test_partitions():
+    topic = PartitionedTopic(3, capacity=4)
+    # messages without key are spread round-robin, the ones with a key stay together
+    assert [topic.push(f'msg{i}') for i in range(3)] == [0, 1, 2]
+    partition = topic.partition_of('key')
+    assert topic.push('keyed', key='key') == partition
+    assert topic.is_full() and topic.push('msg4') is None
+    assert topic.depth == 4 and topic.depths[partition] == 2
+    assert topic.peek(10, partition) == [f'msg{partition}', 'keyed']
+    # consumers without a partition are given the next one holding messages
+    assert [topic.pop() for _ in range(3)] == ['msg0', 'msg1', 'msg2']
+    assert topic.pop() == 'keyed'
+    assert topic.assign() is None and not topic.has_messages()
+
+
+def test_partitioned_topic_snapshot():
+    topic = PartitionedTopic(2)
+    for i in range(3):
+        topic.push(f'msg{i}')
+    restored = PartitionedTopic.json_decode(json.loads(json.dumps(topic.json_encode())))
+    assert restored.depths == [2, 1]
+    assert restored.push('msg3') == topic.push('msg3') == 1
+    # a topic of a snapshot taken before the partitions
+    legacy = PartitionedTopic.json_decode({'capacity': None, 'messages': ['a', 'b']})
+    assert legacy.partition_count == 1 and legacy.pop() == 'a'
+
+
+def test_leases():
+    topic = PartitionedTopic()
+    for i in range(4):
+        topic.push(f'msg{i}')
+    assert topic.pop_leased(2, 0, 'a', 10) == (['msg0', 'msg1'], ['a:0', 'a:1'])
+    assert topic.pop_leased(1, 0, 'b', 5) == (['msg2'], ['b:0'])
+    assert topic.depth == 1 and topic.in_flight == 3 and topic.next_deadline == 5
+    assert topic.ack('a:1') and not topic.ack('a:1')
+    assert topic.expire(5) == 1 and topic.peek(5) == ['msg2', 'msg3']
+    assert topic.next_deadline == 10
+    restored = PartitionedTopic.json_decode(json.loads(json.dumps(topic.json_encode())))
+    assert topic.pop_leased(1, 0, 'c', 8) == (['msg2'], ['c:0'])
+    assert restored.pop_leased(1, 0, 'c', 8) == (['msg2'], ['c:0'])
+    # unacknowledged messages return to the start of the queue in the order they were consumed
+    for expired in (topic, restored):
+        assert expired.expire(10) == 2
+        assert expired.peek(5) == ['msg0', 'msg2', 'msg3'] and expired.next_deadline is None
+
+
+def test_leased_messages_count_towards_capacity():
+    topic = PartitionedTopic(capacity=2)
+    assert topic.push('msg0') == 0 and topic.push('msg1') == 0
+    topic.pop_leased(2, 0, 'a', 10)
+    # the leased messages may come back, so the topic stays full until they are acknowledged
+    assert topic.is_full() and topic.push('msg2') is None
+    assert topic.expire(10) == 2 and topic.depth == 2
+    topic.pop_leased(1, 0, 'b', 20)
+    assert topic.ack('b:0') and not topic.is_full()
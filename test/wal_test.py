@@ -0,0 +1,111 @@
+import os
+import uuid
+
+from src import raft
+from src.log import LogEntry, Command, Operation, MemoryLog, NodeLog, encode_entry, decode_entry
+from src.wal import SegmentedLog, FsyncPolicy
+
+
+def make_entries(terms):
+    return [LogEntry(term, Command(str(i), Operation.PUT_MESSAGE, f'msg{i}')) for i, term in enumerate(terms)]
+
+
+def open_log(log_dir, segment_bytes=1024):
+    return SegmentedLog(str(log_dir), decode_entry, encode_entry, segment_bytes, FsyncPolicy.ALWAYS)
+
+
+def test_append_and_recover(tmp_path):
+    log = open_log(tmp_path)
+    entries = make_entries([1] * 50 + [2] * 50)
+    for i in range(0, 100, 10):
+        log.extend(entries[i:i + 10])
+    assert len(log) == 100
+    assert len(os.listdir(tmp_path)) > 1  # rolled over to new segments
+    log.close()
+
+    log = open_log(tmp_path)
+    assert len(log) == 100
+    assert log[0].command.message == 'msg0'
+    assert log[73].command.message == 'msg73'
+    assert log[-1].term == 2
+    assert log.term(49) == 1 and log.term(50) == 2
+    assert [entry.command.id for entry in log[10:13]] == ['10', '11', '12']
+    assert log.size_from(90) == sum(log.size(i) for i in range(90, 100)) and log.size_from(0) == log.size_bytes
+
+
+def test_truncate(tmp_path):
+    log = open_log(tmp_path)
+    entries = make_entries([1] * 100)
+    for i in range(0, 100, 10):
+        log.extend(entries[i:i + 10])
+    log.truncate(40)
+    assert len(log) == 40
+    log.extend(make_entries([3] * 5))
+    log.close()
+
+    log = open_log(tmp_path)
+    assert len(log) == 45
+    assert log.term(39) == 1
+    assert log[44].term == 3
+
+
+def test_recover_torn_tail(tmp_path):
+    log = open_log(tmp_path, segment_bytes=1024 * 1024)
+    log.extend(make_entries([1] * 10))
+    log.close()
+    segment = os.path.join(tmp_path, os.listdir(tmp_path)[0])
+    with open(segment, 'r+b') as segment_file:
+        segment_file.truncate(os.path.getsize(segment) - 3)
+
+    log = open_log(tmp_path, segment_bytes=1024 * 1024)
+    assert len(log) == 9
+    log.extend(make_entries([2]))
+    assert log[9].term == 2
+
+
+def test_node_restart(tmp_path):
+    node = raft.Node(0, ['localhost:91'], str(tmp_path))
+    node.term = 4
+    node.voted_for = 1
+    node.logs.extend([LogEntry(4, None), LogEntry(4, Command('1', Operation.GET_TOPICS, ''))])
+    node.logs.close()
+
+    node = raft.Node(0, ['localhost:91'], str(tmp_path))
+    assert node.term == 4
+    assert node.voted_for == 1
+    assert node.logs.log_size == 2
+    assert node.logs.entries[1].command.operation is Operation.GET_TOPICS
+
+
+def test_in_memory_log():
+    log = NodeLog()
+    assert log.append(LogEntry(1, None)) == 0
+    assert log.append(LogEntry(2, None)) == 1
+    assert log.term_at(-1) == 2
+    assert not log.durable
+
+
+def test_memory_log_arena():
+    log = MemoryLog()
+    entries = make_entries([1, 1, 2, 2, 3]) + [LogEntry(3, None)]
+    entries[2] = LogEntry(2, Command(str(uuid.uuid4()), Operation.NOOP))
+    log.extend(entries)
+    assert len(log) == 6
+    assert [log.term(i) for i in range(6)] == [1, 1, 2, 2, 3, 3]
+    assert [entry.json_encode() for entry in log] == [entry.json_encode() for entry in entries]
+    assert log.size_bytes == sum(log.size(i) for i in range(6))
+    assert log.size_from(2) == sum(log.size(i) for i in range(2, 6)) and log.size_from(6) == 0
+
+    log.truncate(4)
+    assert len(log) == 4
+    log.extend(make_entries([4]))
+    assert log[4].term == 4 and log[-1].command.message == 'msg0'
+
+    log.compact(2)
+    assert log.start_index == 2
+    assert [entry.term for entry in log] == [2, 2, 4]
+    assert log[2].command.id == entries[2].command.id
+    log.compact(5)
+    assert len(log) == 5 and log.size_bytes == 0
+    log.extend(make_entries([5]))
+    assert log[5].term == 5
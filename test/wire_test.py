@@ -0,0 +1,49 @@
+import json
+import uuid
+
+from src import wire
+from src.log import Command, LogEntry, Operation
+
+
+def sample_entries():
+    batch = Command.batch(str(uuid.uuid4()), [Command(str(uuid.uuid4()), Operation.PUT_MESSAGE, '{"m": "é"}'),
+                                              Command('custom-id', Operation.GET_MESSAGE, 'topic')])
+    return [
+        LogEntry(1, None),
+        LogEntry(2, Command(str(uuid.uuid4()), Operation.NOOP)),
+        LogEntry(2, Command('1', Operation.PUT_TOPIC, '{"topic": "a", "capacity": null}')),
+        LogEntry(3, Command(str(uuid.uuid4()).upper(), Operation.PUT_MESSAGE, '')),
+        LogEntry(3, batch),
+    ]
+
+
+def test_append_request_round_trip():
+    data = {'term': 3, 'leaderId': 1, 'leaderAddress': 'localhost:91', 'prevLogTerm': -1, 'prevLogIndex': -1,
+            'entries': sample_entries(), 'leaderCommit': 2}
+    for content_type in [wire.JSON, wire.BINARY]:
+        body, sent_type = wire.encode_request('logs/append', data, content_type)
+        assert sent_type == content_type
+        decoded = wire.decode_append_request(body, content_type)
+        assert dict(decoded, entries=None) == dict(data, entries=None)
+        assert [entry.json_encode() for entry in decoded['entries']] == [entry.json_encode() for entry in
+                                                                          data['entries']]
+
+
+def test_vote_request_round_trip():
+    data = {'term': 7, 'candidateId': 2, 'lastLogTerm': 6, 'lastLogIndex': 1234}
+    body, _ = wire.encode_request('election/vote', data, wire.BINARY)
+    assert len(body) == wire.VOTE_REQUEST.size
+    assert wire.decode_vote_request(body, wire.BINARY) == data
+
+
+def test_other_requests_are_json():
+    assert wire.encode_request('snapshot/install', {'a': 1}, wire.BINARY) == (json.dumps({'a': 1}).encode(), wire.JSON)
+
+
+def test_binary_is_smaller():
+    entries = [LogEntry(5, Command(str(uuid.uuid4()), Operation.PUT_MESSAGE,
+                                   json.dumps({'topic': 'orders', 'message': 'x' * 100}))) for _ in range(100)]
+    data = {'term': 5, 'leaderId': 0, 'prevLogTerm': 5, 'prevLogIndex': 99, 'entries': entries, 'leaderCommit': 99}
+    json_body, _ = wire.encode_request('logs/append', data, wire.JSON)
+    binary_body, _ = wire.encode_request('logs/append', data, wire.BINARY)
+    assert len(binary_body) < 0.8 * len(json_body)